@@ -19,6 +19,7 @@
 # Authors:  Alvaro del Castillo <acs@bitergia.com>
 #
 
+from bicho import httpclient, ratelimit
 from bicho.config import Config
 
 from bicho.backends import Backend
@@ -35,7 +36,6 @@ import os
 import pprint
 import random
 import sys
-import time
 import traceback
 import urllib
 import feedparser
@@ -134,12 +134,56 @@ class DBAlluraIssueExtMySQL(DBAlluraIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBAlluraIssueExtSQLite(DBAlluraIssueExt):
+    """
+    SQLite subclass of L{DBAlluraIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_allura ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     labels TEXT, \
+                     private BOOLEAN, \
+                     ticket_num INTEGER NOT NULL, \
+                     discussion_thread_url TEXT, \
+                     related_artifacts TEXT, \
+                     custom_fields TEXT, \
+                     mod_date DATETIME, \
+                     issue_id INTEGER NOT NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_ext_allura_ext_issue_idx ON issues_ext_allura (issue_id);',
+    )
+
+
+class DBAlluraIssueExtPostgreSQL(DBAlluraIssueExt):
+    """
+    PostgreSQL subclass of L{DBAlluraIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_allura ( \
+                     id SERIAL PRIMARY KEY, \
+                     labels TEXT, \
+                     private BOOLEAN, \
+                     ticket_num INTEGER NOT NULL, \
+                     discussion_thread_url TEXT, \
+                     related_artifacts TEXT, \
+                     custom_fields TEXT, \
+                     mod_date TIMESTAMP, \
+                     issue_id INTEGER NOT NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_ext_allura_ext_issue_idx ON issues_ext_allura (issue_id);',
+    )
+
+
 class DBAlluraBackend(DBBackend):
     """
     Adapter for Allura backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBAlluraIssueExtMySQL]
+        self.SQLITE_EXT = [DBAlluraIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBAlluraIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -227,6 +271,8 @@ class Allura():
 
     project_test_file = None
     safe_delay = 5
+    # Requests of each issue: the ticket and its changes feed
+    requests_per_delay = 2
 
     def __init__(self):
         self.delay = Config.delay
@@ -243,7 +289,7 @@ class Allura():
         bug_number = bug_url.split('/')[-1]
 
         try:
-            f = urllib.urlopen(bug_url)
+            f = httpclient.urlopen(bug_url)
 
             # f = urllib.urlopen(bug_url)
             json_ticket = f.read()
@@ -301,7 +347,8 @@ class Allura():
 
         printdbg("Analyzing issue changes" + changes_url)
 
-        d = feedparser.parse(changes_url)
+        ratelimit.wait(changes_url)
+        d = feedparser.parse(changes_url, handlers=httpclient.get_handlers())
         changes = self.parse_changes(d)
 
         return changes
@@ -372,6 +419,14 @@ class Allura():
             time_window_start = last_mod_date
             printdbg("Last bugs analyzed were modified on: %s" % last_mod_date)
 
+        # Pages are numbered for the time window of the interrupted run
+        cursor = bugsdb.get_checkpoint(dbtrk.id)
+        if cursor:
+            time_window_start = cursor['time_window_start']
+            time_window_end = cursor['time_window_end']
+            start_page = cursor['page']
+            printout("Resuming interrupted run from page %s" % start_page)
+
         time_window = time_window_start + " TO  " + time_window_end
 
         self.url_issues = Config.url + "/search/?limit=1"
@@ -380,7 +435,7 @@ class Allura():
         self.url_issues += urllib.quote("mod_date_dt:[" + time_window + "]")
         printdbg("URL for getting metadata " + self.url_issues)
 
-        f = urllib.urlopen(self.url_issues)
+        f = httpclient.urlopen(self.url_issues)
         ticketTotal = json.loads(f.read())
 
         total_issues = int(ticketTotal['count'])
@@ -388,6 +443,7 @@ class Allura():
         print("Number of tickets: " + str(total_issues))
 
         if total_issues == 0:
+            bugsdb.clear_checkpoint(dbtrk.id)
             printout("No bugs found. Did you provide the correct url?")
             sys.exit(0)
         remaining = total_issues
@@ -404,7 +460,7 @@ class Allura():
 
             printdbg("URL for next issues " + self.url_issues)
 
-            f = urllib.urlopen(self.url_issues)
+            f = httpclient.urlopen(self.url_issues)
 
             ticketList = json.loads(f.read())
 
@@ -421,7 +477,6 @@ class Allura():
                     bugsdb.insert_issue(issue_data, dbtrk.id)
                     remaining -= 1
                     print "Remaining time: ", (remaining) * Config.delay / 60, "m"
-                    time.sleep(self.delay)
                 except Exception, e:
                     printerr("Error in function analyze_bug " + issue_url)
                     traceback.print_exc(file=sys.stdout)
@@ -429,7 +484,12 @@ class Allura():
                     printerr("UnicodeEncodeError: the issue %s couldn't be stored"
                              % (issue_data.issue))
             start_page += 1
+            bugsdb.save_checkpoint(dbtrk.id,
+                                   {'time_window_start': time_window_start,
+                                    'time_window_end': time_window_end,
+                                    'page': start_page})
 
+        bugsdb.clear_checkpoint(dbtrk.id)
         printout("Done. Bugs analyzed:" + str(total_issues - remaining))
 
 Backend.register_backend('allura', Allura)
@@ -22,28 +22,51 @@
 #          Santiago Dueñas <sduenas@libresoft.es>
 #          Alvaro del Castillo <acs@bitergia.com>
 
+import re
 import string
+import threading
 import time
 import urllib
 import urllib2
 import urlparse
 import xml.sax.handler
+import xmlrpclib
 
 from datetime import datetime, timedelta
+from dateutil import tz
 from dateutil.parser import parse
+from functools import partial
+from itertools import izip
+from multiprocessing.pool import ThreadPool
+from xml.parsers.expat import ExpatError
 
 from storm.locals import DateTime, Int, Reference, Unicode, Desc
 
-from BeautifulSoup import BeautifulSoup, Comment as BFComment
+from BeautifulSoup import BeautifulSoup, Comment as BFComment, UnicodeDammit
 
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+from bicho import httpclient
 from bicho.config import Config
 from bicho.backends import Backend
 from bicho.common import Tracker, People, Issue, Comment, Change
 from bicho.db.database import DBIssue, DBBackend, DBTracker, get_database
-from bicho.utils import printerr, printdbg, printout, valid_XML_char_ordinal
+from bicho.utils import printerr, printdbg, printout, strip_invalid_xml_chars
 
 BUGZILLA = "bugzilla"
 
+# Bytes of the XML responses fed to the parser at once
+XML_CHUNK_SIZE = 64 * 1024
+
+# First version whose Bug.history web service is used
+HISTORY_API_VERSION = (4, 4)
+
+# Numeric UTC offset at the end of the dates of the XML of the issues
+UTC_OFFSET_REGEXP = re.compile(r'[+-]\d{4}$')
+
 
 class DBBugzillaIssueExt(object):
     """
@@ -129,12 +152,90 @@ class DBBugzillaIssueExtMySQL(DBBugzillaIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBBugzillaIssueExtSQLite(DBBugzillaIssueExt):
+    """
+    SQLite subclass of L{DBBugzillaIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_bugzilla ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     alias VARCHAR(64) default NULL, \
+                     delta_ts DATETIME NOT NULL, \
+                     reporter_accessible VARCHAR(32) default NULL, \
+                     cclist_accessible VARCHAR(32) default NULL, \
+                     classification_id VARCHAR(32) default NULL, \
+                     classification VARCHAR(32) default NULL, \
+                     product VARCHAR(64) default NULL, \
+                     component VARCHAR(64) default NULL, \
+                     version VARCHAR(64) default NULL, \
+                     rep_platform VARCHAR(64) default NULL, \
+                     op_sys VARCHAR(64) default NULL, \
+                     dup_id INTEGER default NULL, \
+                     bug_file_loc MEDIUMTEXT default NULL, \
+                     status_whiteboard MEDIUMTEXT default NULL, \
+                     target_milestone VARCHAR(64) default NULL, \
+                     votes INTEGER default NULL, \
+                     everconfirmed VARCHAR(32) default NULL, \
+                     qa_contact VARCHAR(64) default NULL, \
+                     estimated_time VARCHAR(32) default NULL, \
+                     remaining_time VARCHAR(32) default NULL, \
+                     actual_time VARCHAR(32) default NULL, \
+                     deadline DATETIME default NULL, \
+                     keywords VARCHAR(64) default NULL, \
+                     flag VARCHAR(32) default NULL, \
+                     cc VARCHAR(64) default NULL, \
+                     group_bugzilla VARCHAR(32) default NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id) \
+                     );'
+
+
+class DBBugzillaIssueExtPostgreSQL(DBBugzillaIssueExt):
+    """
+    PostgreSQL subclass of L{DBBugzillaIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_bugzilla ( \
+                     id SERIAL PRIMARY KEY, \
+                     alias VARCHAR(64) default NULL, \
+                     delta_ts TIMESTAMP NOT NULL, \
+                     reporter_accessible VARCHAR(32) default NULL, \
+                     cclist_accessible VARCHAR(32) default NULL, \
+                     classification_id VARCHAR(32) default NULL, \
+                     classification VARCHAR(32) default NULL, \
+                     product VARCHAR(64) default NULL, \
+                     component VARCHAR(64) default NULL, \
+                     version VARCHAR(64) default NULL, \
+                     rep_platform VARCHAR(64) default NULL, \
+                     op_sys VARCHAR(64) default NULL, \
+                     dup_id INTEGER default NULL, \
+                     bug_file_loc TEXT default NULL, \
+                     status_whiteboard TEXT default NULL, \
+                     target_milestone VARCHAR(64) default NULL, \
+                     votes INTEGER default NULL, \
+                     everconfirmed VARCHAR(32) default NULL, \
+                     qa_contact VARCHAR(64) default NULL, \
+                     estimated_time VARCHAR(32) default NULL, \
+                     remaining_time VARCHAR(32) default NULL, \
+                     actual_time VARCHAR(32) default NULL, \
+                     deadline TIMESTAMP default NULL, \
+                     keywords VARCHAR(64) default NULL, \
+                     flag VARCHAR(32) default NULL, \
+                     cc VARCHAR(64) default NULL, \
+                     group_bugzilla VARCHAR(32) default NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id) \
+                     );'
+
+
 class DBBugzillaBackend(DBBackend):
     """
     Adapter for Bugzilla backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBBugzillaIssueExtMySQL]
+        self.SQLITE_EXT = [DBBugzillaIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBBugzillaIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -344,6 +445,128 @@ class SoupHtmlParser():
         return changes
 
 
+class LxmlHtmlParser(SoupHtmlParser):
+    """
+    Parses the table of changes using lxml, which is much faster than
+    building a BeautifulSoup tree.
+
+    The cells are read as L{SoupHtmlParser} does, so both parsers
+    return the same changes: entities are kept escaped and only the
+    first piece of text of each cell is taken. When lxml is not
+    installed or the page can not be parsed this way, the changes
+    are parsed by L{SoupHtmlParser}.
+    """
+
+    # Tags replaced by their text in the table of changes
+    remove_tags = ('a', 'span', 'i')
+
+    # Bugzilla escapes these characters in the values of the table
+    html_escapes = ((u'&', u'&amp;'), (u'<', u'&lt;'), (u'>', u'&gt;'),
+                    (u'"', u'&quot;'), (u'\xa0', u'&nbsp;'))
+
+    def parse_changes(self):
+        if etree is not None:
+            try:
+                return self._parse_changes_lxml()
+            except Exception, e:
+                printdbg("Error parsing activity of issue %s with lxml: %s. "
+                         "Using BeautifulSoup" % (self.idBug, e))
+        return SoupHtmlParser.parse_changes(self)
+
+    def _quote(self, text):
+        """
+        Escape X{text} as it was in the HTML page
+        """
+        for char, entity in self.html_escapes:
+            text = text.replace(char, entity)
+        if self.obscured_emails:
+            text = text.replace(u'@', u'&#64;')
+
+        # Whitespace-only strings are collapsed as BeautifulSoup does
+        if not text.strip(u' \t\n\r\x0c'):
+            text = u'\n' in text and u'\n' or u' '
+        return text
+
+    def _get_text(self, node):
+        return u''.join([self._quote(t).strip()
+                         for t in node.xpath('descendant::text()')])
+
+    def _get_contents(self, node, replace):
+        """
+        Returns the texts of a node. Removed tags are replaced by their
+        text, the rest of the tags by C{None}. Comments are skipped.
+        """
+        contents = []
+        if node.text:
+            contents.append(self._quote(node.text))
+        for child in node:
+            if isinstance(child.tag, basestring):
+                if replace and child.tag in self.remove_tags:
+                    contents.append(self._get_text(child))
+                else:
+                    contents.append(None)
+            if child.tail:
+                contents.append(self._quote(child.tail))
+        return contents
+
+    def _parse_changes_lxml(self):
+        html = UnicodeDammit(self.html, smartQuotesTo=None, isHTML=True).unicode
+        if html is None:
+            raise ValueError("unknown encoding")
+        self.obscured_emails = '&#64;' in self.html
+
+        root = etree.HTML(html)
+        if root is None:
+            raise ValueError("empty document")
+
+        changes = []
+
+        # We look for the first table with 5 cols
+        table = None
+        replace = False
+        for table in root.iter('table'):
+            tr = table.find('.//tr')
+            if tr is None:
+                raise ValueError("table without rows")
+            if len([th for th in tr if th.tag == 'th']) == 5:
+                replace = True
+                break
+
+        if table is None:
+            return changes
+
+        rows = list(table.iter('tr'))
+        for row in rows[1:]:
+            cols = [self._get_contents(td, replace) for td in row.iter('td')]
+            if len(cols) == 5:
+                person_email = cols[0][0].strip()
+                person_email = unicode(person_email.replace('&#64;', '@'))
+                date = self._to_datetime_with_secs(cols[1][0].strip())
+                if len(cols[2]) > 1:
+                    aux_c = unicode(" ".join(cols[2]))
+                    field = unicode(aux_c.replace("\n", "").strip())
+                else:
+                    field = unicode(cols[2][0].replace("\n", "").strip())
+                removed = unicode(cols[3][0].strip())
+                added = unicode(cols[4][0].strip())
+            else:
+                if len(cols[0]) > 1:
+                    aux_c = unicode(" ".join(cols[0]))
+                    field = aux_c.replace("\n", "").strip()
+                else:
+                    field = cols[0][0].strip()
+                removed = cols[1][0].strip()
+                added = cols[2][0].strip()
+
+            field, removed, added = self.sanityze_change(field, removed, added)
+            by = People(person_email)
+            by.set_email(person_email)
+            change = Change(field, removed, added, by, date)
+            changes.append(change)
+
+        return changes
+
+
 class BugzillaIssue(Issue):
     """
     Ad-hoc Issue extension for bugzilla's issue
@@ -650,11 +873,29 @@ class BugsHandler(xml.sax.handler.ContentHandler):
         # TBD attachments and flag, see bugzilla.dtd
         #self.issues_data = {}
         self.issues_data = []
+        self.server_dates = []
         self.init_bug()
 
     def get_issues(self):
         return self.issues_data
 
+    def pop_issues(self):
+        """
+        Return the issues parsed since the last call and forget them.
+        """
+        issues = self.issues_data
+        self.issues_data = []
+        return issues
+
+    def pop_server_dates(self):
+        """
+        Return the dates with a UTC offset parsed since the last call
+        and forget them.
+        """
+        dates = self.server_dates
+        self.server_dates = []
+        return dates
+
     def init_bug(self):
         """
         Clean all the values to start parsing a new bug
@@ -823,13 +1064,24 @@ class BugsHandler(xml.sax.handler.ContentHandler):
         """
         Returns datetime object from string
         """
-        return parse(str_date).replace(tzinfo=None)
+        return self._to_local_datetime(str_date)
 
     def _to_datetime_with_secs(self, str_date):
         """
         Returns datetime object from string with seconds
         """
-        return parse(str_date).replace(tzinfo=None)
+        return self._to_local_datetime(str_date)
+
+    def _to_local_datetime(self, str_date):
+        """
+        Returns the datetime of the server from string, keeping the
+        dates with a numeric UTC offset to find out its time zone
+        """
+        date = parse(str_date)
+        if date.tzinfo is not None and \
+                UTC_OFFSET_REGEXP.search(str_date.strip()):
+            self.server_dates.append(date)
+        return date.replace(tzinfo=None)
 
     def get_issue(self):
         issue_id = self.atags["bug_id"]
@@ -916,6 +1168,102 @@ class BugsHandler(xml.sax.handler.ContentHandler):
 
         return issue
 
+class BugzillaTransport(xmlrpclib.Transport):
+    """
+    Sends the XML-RPC requests through the shared HTTP client, so
+    they use the session cookies and the rate limit of the tracker.
+
+    @param url: URL of the XML-RPC service
+    @type url: C{str}
+    """
+
+    def __init__(self, url):
+        xmlrpclib.Transport.__init__(self, use_datetime=True)
+        self.url = url
+
+    def request(self, host, handler, request_body, verbose=0):
+        self.verbose = verbose
+        request = urllib2.Request(self.url, request_body,
+                                  {'Content-Type': 'text/xml'})
+        return self.parse_response(httpclient.urlopen(request))
+
+
+class ServerTimezone(object):
+    """
+    Time zone of the dates shown by Bugzilla, found out from the UTC
+    offsets of the dates of the XML of the issues.
+
+    The candidates are the zones of the time zone database of dateutil
+    that agree with every offset seen. A UTC date is only converted
+    when all of them give it the same offset, so the dates converted
+    are the ones shown in the activity pages.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.zones = None
+        self.samples = []
+
+    def add_dates(self, dates):
+        """
+        Add dates of the server with their UTC offsets.
+
+        @param dates: dates with time zone information
+        @type dates: C{list} of L{datetime.datetime}
+        """
+        with self.lock:
+            for date in dates:
+                offset = date.utcoffset()
+                utc = (date - offset).replace(tzinfo=None)
+                self.samples.append((utc, offset))
+
+    def to_local(self, utc):
+        """
+        Convert a UTC date to the time zone of the server.
+
+        @param utc: naive UTC date
+        @type utc: L{datetime.datetime}
+
+        @return: the naive date of the server or C{None} when its
+          offset is not known
+        @rtype: L{datetime.datetime}
+        """
+        with self.lock:
+            self._filter_zones()
+            offsets = set([self._get_offset(zone, utc)
+                           for zone in self.zones])
+        if len(offsets) != 1:
+            return None
+        return utc + offsets.pop()
+
+    def _filter_zones(self):
+        if self.zones is None:
+            self.zones = self._load_zones()
+        for utc, offset in self.samples:
+            self.zones = [zone for zone in self.zones
+                          if self._get_offset(zone, utc) == offset]
+        self.samples = []
+
+    def _load_zones(self):
+        try:
+            from dateutil.zoneinfo import get_zonefile_instance
+            return get_zonefile_instance().zones.values()
+        except (ImportError, AttributeError):
+            printdbg("Time zone database not available. Dates of "
+                     "Bug.history can not be converted")
+            return []
+
+    def _get_offset(self, zone, utc):
+        return utc.replace(tzinfo=tz.tzutc()).astimezone(zone).utcoffset()
+
+
+def version_to_tuple(version):
+    """
+    Converts a Bugzilla version string like '4.4.1' to (4, 4, 1)
+    """
+    return tuple([int(n) for n in re.findall(r'\d+', version or '')])
+
+
 # length of hibernation in seconds
 HIBERNATION_LENGTH = 100
 
@@ -926,10 +1274,20 @@ class BGBackend(Backend):
         self.url = self._healthy_url(Config.url)
         self.delay = Config.delay
         self.max_issues = Config.nissues
+        self.workers = max(getattr(Config, 'workers', 1) or 1, 1)
         self.cookies = {}
         self.version = None
         self.tracker = None
         self.retrieved = {}  # retrieved issues on this run
+        self.checkpoint = False
+        self.history_api = getattr(Config, 'bg_history_api', False)
+        self.field_names = None
+        # Fields of Bug.history already compared with an activity page
+        self.checked_fields = set()
+        self.history_lock = threading.Lock()
+        # Bugzilla 4.4 and later escape '@' in the activity pages
+        self.obscured_emails = True
+        self.timezone = ServerTimezone()
 
         try:
             self.backend_password = Config.backend_password
@@ -944,12 +1302,18 @@ class BGBackend(Backend):
 
     def run(self):
         printout("Running Bicho with delay of %s seconds" % str(self.delay))
+        if self.workers > 1:
+            printout("Using %s fetch workers" % self.workers)
 
         self._login()
         self._set_version()
+        self._set_history_api()
         self._set_tracker()
 
         self._process_issues()
+        self.bugsdb.flush_issues()
+        if self.checkpoint:
+            self.bugsdb.clear_checkpoint(self.tracker.id)
 
         if not self.retrieved:
             printout("No issues found. Did you provide the correct url?")
@@ -964,22 +1328,15 @@ class BGBackend(Backend):
             printdbg("No account data provided. Not logged in bugzilla")
             return
 
-        import cookielib
-
-        cookie_j = cookielib.CookieJar()
-        cookie_h = urllib2.HTTPCookieProcessor(cookie_j)
-
         url = self._get_login_url(self.url)
         values = {'Bugzilla_login': self.backend_user,
                   'Bugzilla_password': self.backend_password}
 
-        opener = urllib2.build_opener(cookie_h)
-        urllib2.install_opener(opener)
+        # Session cookies are kept by the HTTP client
         data = urllib.urlencode(values)
         request = urllib2.Request(url, data)
-        urllib2.urlopen(request)
-        for i, c in enumerate(cookie_j):
-            self.cookies[c.name] = c.value
+        httpclient.urlopen(request)
+        self.cookies = httpclient.get_cookies(url)
 
         printout("Logged in bugzilla as %s" % self.backend_user)
         printdbg("Bugzilla session cookies: %s" % self.cookies)
@@ -1004,8 +1361,9 @@ class BGBackend(Backend):
         parser = xml.sax.make_parser()
         parser.setContentHandler(handler)
         try:
-            cleaned_contents = ''. \
-                join(c for c in contents if valid_XML_char_ordinal(ord(c)))
+            cleaned_contents, removed = strip_invalid_xml_chars(contents)
+            if removed:
+                printdbg("Removed %s invalid XML characters" % removed)
             parser.feed(cleaned_contents)
         except Exception:
             printerr("Error parsing URL %s" % info_url)
@@ -1015,6 +1373,20 @@ class BGBackend(Backend):
         self.version = handler.get_version()
         printdbg("Bugzilla version: %s" % self.version)
 
+    def _set_history_api(self):
+        """
+        Disables the Bug.history web service on old versions
+        """
+        if not self.history_api:
+            return
+
+        if version_to_tuple(self.version) < HISTORY_API_VERSION:
+            printout("Bug.history is not supported by Bugzilla %s. "
+                     "Retrieving activity from HTML pages" % self.version)
+            self.history_api = False
+        else:
+            printdbg("Retrieving activity using Bug.history")
+
     def _set_tracker(self):
         # FIXME: supported trackers have to be inserted during
         # the initialization
@@ -1034,6 +1406,8 @@ class BGBackend(Backend):
             i = 0
             max_rounds = 50  # 50*10000
             url = self._get_domain(self.url)
+            self.checkpoint = True
+            self._resume_from_checkpoint(url)
             last_date, next_date = self._get_last_and_next_dates()
 
             # Some bugzillas limit the number of results that a query can return.
@@ -1059,6 +1433,41 @@ class BGBackend(Backend):
             if i > 0:
                 printout("No more issues to retrieve")
 
+    def _resume_from_checkpoint(self, base_url):
+        """
+        Retrieve the issues that were pending when the last run was
+        interrupted.
+        """
+        cursor = self.bugsdb.get_checkpoint(self.tracker.id)
+        if not cursor:
+            return
+
+        self.retrieved.update(cursor.get('retrieved', {}))
+        pending = cursor.get('pending', [])
+        if pending:
+            printout("Resuming interrupted run - Total issues to retrieve: %d"
+                     % len(pending))
+            self._retrieve_issues(pending, base_url, self.tracker.id)
+
+    def _save_checkpoint(self, pending):
+        """
+        Save the issues not retrieved yet, together with the issues
+        retrieved at the last modification date. Those issues would
+        be requested again on resume because the date is inclusive.
+
+        @param pending: identifiers of the issues not retrieved yet
+        @type pending: C{list}
+        """
+        if not self.checkpoint:
+            return
+
+        last_ts = max(self.retrieved.itervalues()) if self.retrieved else None
+        retrieved = dict((id, ts) for id, ts in self.retrieved.iteritems()
+                         if ts == last_ts)
+        self.bugsdb.save_checkpoint(self.tracker.id,
+                                    {'pending': pending,
+                                     'retrieved': retrieved})
+
     def _retrieve_issues_ids(self, base_url, version, from_date, not_retrieved=True):
         url = self._get_issues_list_url(base_url, version, from_date)
         printdbg("Getting bugzilla issues from %s" % url)
@@ -1086,6 +1495,10 @@ class BGBackend(Backend):
         return ids
 
     def _retrieve_issues(self, ids, base_url, trk_id):
+        if self.workers > 1:
+            self._retrieve_issues_concurrently(ids, base_url, trk_id)
+            return
+
         # We want to use pop() to get the oldest first so we must reverse the
         # order
         ids.reverse()
@@ -1094,17 +1507,22 @@ class BGBackend(Backend):
             while (len(query_issues) < self.max_issues and ids):
                 query_issues.append(ids.pop())
 
-            # Retrieving main bug information
-            url = self._get_issues_info_url(base_url, query_issues)
-            printdbg("Issues to retrieve from: %s" % url)
+            histories = self._retrieve_issues_history(base_url, query_issues)
 
-            handler = BugsHandler()
-            self._safe_xml_parse(url, handler)
-            issues = handler.get_issues()
+            # Issues are processed as soon as they are parsed, while
+            # the rest of the batch is downloaded, only when no other
+            # request is sent meanwhile. Activity pages wait for the
+            # rate limit, so the download would be idle long enough
+            # for the server to drop it; the batch is read first.
+            if self._needs_activity_pages(query_issues, histories):
+                issues = self._retrieve_issues_batch(base_url, query_issues)
+            else:
+                issues = self._iter_issues_batch(base_url, query_issues)
 
-            # Retrieving changes
             for issue in issues:
-                changes = self._retrieve_issue_activity(base_url, issue.issue)
+                # Retrieving changes
+                changes = self._get_issue_changes(base_url, issue.issue,
+                                                  histories)
                 for c in changes:
                     issue.add_change(c)
 
@@ -1113,14 +1531,279 @@ class BGBackend(Backend):
                 self._store_issue(issue, trk_id)
                 self.retrieved[issue.issue] = self._timestamp_to_str(issue.delta_ts)
 
-                time.sleep(self.delay)
+            self._save_checkpoint(ids[::-1])
+
+    def _retrieve_issues_concurrently(self, ids, base_url, trk_id):
+        """
+        Retrieve the issues using a pool of X{workers} threads.
+
+        Workers download the XML batches and the activity of the issues,
+        sharing the request rate limit of the tracker. The next batch
+        is requested while the activity of the current one is
+        retrieved. This thread is the only writer: it stores the
+        issues in the same order as the sequential mode, so the last
+        modification date is always safe to resume from.
+        """
+        batches = [ids[i:i + self.max_issues]
+                   for i in range(0, len(ids), self.max_issues)]
+        if not batches:
+            return
+
+        pool = ThreadPool(self.workers)
+
+        try:
+            next_batch = pool.apply_async(self._retrieve_issues_batch,
+                                          (base_url, batches[0]))
+            next_history = pool.apply_async(self._retrieve_issues_history,
+                                            (base_url, batches[0]))
+            for i in range(len(batches)):
+                issues = next_batch.get()
+                histories = next_history.get()
+                if i + 1 < len(batches):
+                    next_batch = pool.apply_async(self._retrieve_issues_batch,
+                                                  (base_url, batches[i + 1]))
+                    next_history = pool.apply_async(self._retrieve_issues_history,
+                                                    (base_url, batches[i + 1]))
+
+                get_changes = partial(self._get_issue_changes, base_url,
+                                      histories=histories)
+                activities = pool.imap(get_changes,
+                                       [issue.issue for issue in issues])
+                for issue, changes in izip(issues, activities):
+                    for c in changes:
+                        issue.add_change(c)
+                    self._store_issue(issue, trk_id)
+                    self.retrieved[issue.issue] = self._timestamp_to_str(issue.delta_ts)
+
+                self._save_checkpoint([id for batch in batches[i + 1:]
+                                       for id in batch])
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+    def _retrieve_issues_batch(self, base_url, ids):
+        return list(self._iter_issues_batch(base_url, ids))
+
+    def _iter_issues_batch(self, base_url, ids):
+        url = self._get_issues_info_url(base_url, ids)
+        printdbg("Issues to retrieve from: %s" % url)
+
+        handler = BugsHandler()
+        for issues in self._safe_xml_parse(url, handler):
+            self.timezone.add_dates(handler.pop_server_dates())
+            for issue in issues:
+                yield issue
+
+    def _needs_activity_pages(self, ids, histories):
+        """
+        Returns whether the activity of any of the issues has to be
+        retrieved from its HTML page
+        """
+        if histories is None:
+            return True
+        for id in ids:
+            if id not in histories:
+                return True
+        return False
+
+    def _get_issue_changes(self, base_url, id, histories=None):
+        """
+        Returns the changes of an issue, taken from the histories
+        retrieved using Bug.history when available
+        """
+        if histories is not None and id in histories:
+            changes = self._get_history_changes(base_url, id, histories[id])
+            if changes is not None:
+                return changes
+        return self._retrieve_issue_activity(base_url, id)
+
+    def _get_xmlrpc_proxy(self, base_url):
+        url = base_url + "xmlrpc.cgi"
+        return xmlrpclib.ServerProxy(url, transport=BugzillaTransport(url),
+                                     allow_none=True)
+
+    def _xmlrpc_params(self, **params):
+        if self.backend_user and self.backend_password:
+            params['Bugzilla_login'] = self.backend_user
+            params['Bugzilla_password'] = self.backend_password
+        return params
+
+    def _get_field_names(self, proxy):
+        """
+        Returns the names shown in the activity pages of the fields
+        """
+        if self.field_names is None:
+            params = self._xmlrpc_params(include_fields=['name', 'display_name'])
+            result = proxy.Bug.fields(params)
+            self.field_names = dict((f['name'], f['display_name'])
+                                    for f in result['fields'])
+        return self.field_names
+
+    def _retrieve_issues_history(self, base_url, ids):
+        """
+        Retrieves the changes of a list of issues with one call to
+        Bug.history.
+
+        When the web service fails, the activity is retrieved from
+        the HTML pages for the rest of the run.
+
+        @return: changes by issue id, C{None} when Bug.history is
+          not used
+        @rtype: C{dict} of C{list} of L{Change}
+        """
+        if not self.history_api or not ids:
+            return None
+
+        printdbg("Retrieving history of %s issues using Bug.history" % len(ids))
+        proxy = self._get_xmlrpc_proxy(base_url)
+        try:
+            field_names = self._get_field_names(proxy)
+            result = proxy.Bug.history(self._xmlrpc_params(ids=list(ids)))
+        except (xmlrpclib.Error, urllib2.URLError, ExpatError), e:
+            printerr("Error calling Bug.history: %s. Retrieving activity "
+                     "from HTML pages" % e)
+            self.history_api = False
+            return None
+
+        histories = {}
+        for bug in result['bugs']:
+            id = str(bug['id'])
+            histories[id] = self._history_to_changes(id, bug['history'],
+                                                     field_names)
+        return histories
+
+    def _history_to_changes(self, id, history, field_names):
+        """
+        Returns the changes of the history of an issue as Bug.history
+        returns them, with unescaped values and UTC dates. They are
+        normalized with L{_localize_history}.
+        """
+        changes = []
+
+        for event in history:
+            by = People(event['who'])
+            by.set_email(event['who'])
+            date = event['when']
+
+            for change in event['changes']:
+                field = field_names.get(change['field_name'],
+                                        change['field_name'])
+                if change.get('attachment_id'):
+                    field = u"Attachment #%s %s" % (change['attachment_id'],
+                                                    field)
+                changes.append(Change(unicode(field),
+                                      unicode(change['removed']),
+                                      unicode(change['added']), by, date))
+
+        return changes
+
+    def _localize_history(self, changes):
+        """
+        Returns the changes of Bug.history as the activity pages show
+        them: values HTML-escaped and dates in the time zone of the
+        server, so they have the same fingerprints as the changes
+        retrieved from those pages.
+
+        @return: the changes or C{None} when the time zone of any of
+          the dates is not known
+        @rtype: C{list} of L{Change}
+        """
+        parser = LxmlHtmlParser(None, None)
+        parser.obscured_emails = self.obscured_emails
+        localized = []
+
+        for change in changes:
+            date = self.timezone.to_local(change.changed_on)
+            if date is None:
+                return None
+            field, removed, added = parser.sanityze_change(
+                parser._quote(change.field).replace(u"\n", u"").strip(),
+                parser._quote(change.old_value),
+                parser._quote(change.new_value))
+            localized.append(Change(field, removed, added,
+                                    change.changed_by, date))
+
+        return localized
+
+    def _get_history_changes(self, base_url, id, history):
+        """
+        Returns the changes of an issue taken from Bug.history,
+        normalized with L{_localize_history}. Issues with fields not
+        seen before in the run are checked with L{_check_history}.
+
+        @return: the changes or C{None} when they have to be retrieved
+          from the activity page
+        @rtype: C{list} of L{Change}
+        """
+        with self.history_lock:
+            if not self.history_api:
+                return None
+            if not self._get_field_kinds(history) <= self.checked_fields:
+                return self._check_history(base_url, id, history)
+
+        changes = self._localize_history(history)
+        if changes is None:
+            printdbg("Time zone of the changes of issue #%s unknown. "
+                     "Retrieving its activity page" % id)
+        return changes
+
+    def _check_history(self, base_url, id, history):
+        """
+        Compares the changes of an issue taken from Bug.history with
+        its activity page, which also tells whether '@' is escaped.
+        Each field is shown in its own way, so every field is checked
+        the first time it is found. When they differ, the activity
+        pages are used for the rest of the run, so no change is stored
+        twice in different forms.
+
+        @return: the changes of the issue or C{None} when the time
+          zone of its dates is not known yet
+        @rtype: C{list} of L{Change}
+        """
+        if self._localize_history(history) is None:
+            return None
+
+        activity_url = self._get_issue_activity_url(base_url, id)
+        printdbg("Checking Bug.history with the activity of issue #%s from %s"
+                 % (id, activity_url))
+        data = self._urlopen_auth(activity_url).read()
+        activity = LxmlHtmlParser(data, id).parse_changes()
+        self.obscured_emails = '&#64;' in data
+        changes = self._localize_history(history)
+
+        if self._get_change_keys(changes) != self._get_change_keys(activity):
+            printerr("Changes of issue #%s from Bug.history differ from its "
+                     "activity page. Retrieving activity from HTML pages"
+                     % id)
+            self.history_api = False
+            return activity
+
+        self.checked_fields.update(self._get_field_kinds(history))
+        return changes
+
+    def _get_field_kinds(self, changes):
+        """
+        Returns the fields of the changes, without attachment numbers
+        """
+        return set([re.sub(r'#\d+', '#', c.field) for c in changes])
+
+    def _get_change_keys(self, changes):
+        """
+        Returns the values of the fingerprints of the changes
+        """
+        return sorted([(c.field, c.old_value, c.new_value, c.changed_on)
+                       for c in changes])
 
     def _retrieve_issue_activity(self, base_url, id):
         activity_url = self._get_issue_activity_url(base_url, id)
         printdbg("Retrieving activity of issue #%s from %s"
                  % (id, activity_url))
         data = self._urlopen_auth(activity_url).read()
-        parser = SoupHtmlParser(data, id)
+        parser = LxmlHtmlParser(data, id)
         changes = parser.parse_changes()
         return changes
 
@@ -1160,20 +1843,15 @@ class BGBackend(Backend):
             url = tokens[0] + 'product=' + urllib.quote(tokens[1])
         return url
 
-    def _urlopen_auth(self, url):
+    def _urlopen_auth(self, url, stream=False):
         """
         Opens an URL using an authenticated session
         """
         keep_trying = True
         while keep_trying:
-            if self._is_auth_session():
-                opener = urllib2.build_opener()
-                for c in self.cookies:
-                    q = str(c) + '=' + self.cookies[c]
-                    opener.addheaders.append(('Cookie', q))
             keep_trying = False
             try:
-                aux = urllib2.urlopen(url)
+                aux = httpclient.urlopen(url, stream=stream)
             except urllib2.HTTPError as e:
                 printerr("The server couldn\'t fulfill the request.")
                 printerr("Error code: %s" % e.code)
@@ -1264,34 +1942,61 @@ class BGBackend(Backend):
         return base_url + "show_activity.cgi?id=" + issue_id
 
     def _safe_xml_parse(self, bugs_url, handler):
-        f = self._urlopen_auth(bugs_url)
+        """
+        Parse the XML of X{bugs_url} while it is downloaded.
+
+        The response is fed to the parser in chunks of about
+        X{XML_CHUNK_SIZE} bytes, removing the control characters
+        not allowed by XML. They are single bytes in UTF-8, so they
+        can be removed from any chunk. Chunks are cut before a tag, so the
+        texts of the elements reach the handler split as if the
+        whole response was parsed at once.
+
+        @return: generator of the lists of issues completed after
+          parsing each chunk
+        @rtype: generator of C{list} of L{BugzillaIssue}
+        """
+        f = self._urlopen_auth(bugs_url, stream=True)
         parser = xml.sax.make_parser()
         parser.setContentHandler(handler)
+        pending = ''
+        removed = 0
 
         try:
-            contents = f.read()
-        except Exception:
-            printerr("Error retrieving URL: %s" % (bugs_url))
-            raise
+            while True:
+                try:
+                    chunk = f.read(XML_CHUNK_SIZE)
+                except Exception:
+                    printerr("Error retrieving URL: %s" % (bugs_url))
+                    raise
+
+                cleaned, n = strip_invalid_xml_chars(chunk)
+                removed += n
+                data = pending + cleaned
+                if chunk:
+                    cut = data.rfind('<')
+                    if cut <= 0:
+                        pending = data
+                        continue
+                    data, pending = data[:cut], data[cut:]
 
-        try:
-            parser.feed(contents)
-            parser.close()
-        except Exception:
-            # Clean only the invalid XML
-            try:
-                parser2 = xml.sax.make_parser()
-                parser2.setContentHandler(handler)
-                parser2.setContentHandler(handler)
-                printdbg("Cleaning dirty XML")
-                cleaned_contents = ''. \
-                    join(c for c in contents if valid_XML_char_ordinal(ord(c)))
-                parser2.feed(cleaned_contents)
-                parser2.close()
-            except Exception:
-                printerr("Error parsing URL: %s" % (bugs_url))
-                raise
-        f.close()
+                try:
+                    parser.feed(data)
+                    if not chunk:
+                        parser.close()
+                except Exception:
+                    printerr("Error parsing URL: %s" % (bugs_url))
+                    raise
+                yield handler.pop_issues()
+
+                if not chunk:
+                    break
+        finally:
+            f.close()
+
+        if removed:
+            printdbg("Removed %s invalid XML characters from %s"
+                     % (removed, bugs_url))
 
     def _timestamp_to_str(self, ts):
         if not ts:
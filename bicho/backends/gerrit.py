@@ -19,16 +19,20 @@
 # Authors:  Alvaro del Castillo <acs@bitergia.com>
 #
 
+from bicho import httpclient
 from bicho.config import Config
 
 from bicho.backends import Backend
-from bicho.utils import create_dir, printdbg, printout, printerr
+from bicho.utils import create_dir, bicho_dot_dir, printdbg, printout, \
+    printerr
 from bicho.db.database import DBIssue, DBBackend, DBTracker, get_database
 from bicho.common import Tracker, Issue, Comment, People, Change
 
-from dateutil.parser import parse
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
+import Queue
+import calendar
 import errno
 import json
 import os
@@ -45,6 +49,41 @@ import re
 from storm.locals import DateTime, Desc, Int, Reference, Unicode, Bool
 
 
+# Port of the ssh interface of Gerrit
+GERRIT_SSH_PORT = "29418"
+
+# Seconds the shared ssh connection stays open after the last query
+SSH_CONTROL_PERSIST = 60
+
+# Changes requested on each page of the REST API
+REST_PAGE_SIZE = 500
+
+# Details of the changes requested to the REST API
+REST_OPTIONS = ("ALL_REVISIONS", "MESSAGES", "DETAILED_LABELS",
+                "DETAILED_ACCOUNTS")
+
+# Time windows of the history of the project fetched by each worker
+REST_WINDOWS_PER_WORKER = 4
+
+# Events found in the comments of a review
+UPLOADED_EVENT = u"UPLOADED"
+MERGED_EVENT = u"MERGED"
+ABANDONED_EVENT = u"ABANDONED"
+RESTORED_EVENT = u"RESTORED"
+
+# Comments of a patch set, like 'Patch Set 2: Code-Review+2' or
+# 'Uploaded patch set 2.'
+PATCHSET_COMMENT_PATTERN = re.compile(r'^Patch Set ((?:(?!Patch Set )[^:\n])*)'
+                                      r'(?=[^\n]*:)')
+UPLOADED_COMMENT_PATTERN = re.compile(r'^Uploaded patch set (?=.)([^ .]*)')
+
+# Comments like 'Patch Set 1: Abandoned' or 'Abandoned'
+ABANDONED_COMMENT_PATTERN = re.compile(r'^(?:Patch Set (.*?): )?Abandoned')
+RESTORED_COMMENT_PATTERN = re.compile(r'^(?:Patch Set (.*?): )?Restored')
+
+MERGED_COMMENT = "Change has been successfully merged into the git repository."
+
+
 class DBGerritIssueExt(object):
 
     __storm_table__ = 'issues_ext_gerrit'
@@ -89,12 +128,56 @@ class DBGerritIssueExtMySQL(DBGerritIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBGerritIssueExtSQLite(DBGerritIssueExt):
+    """
+    SQLite subclass of L{DBGerritIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_gerrit ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     branch TEXT, \
+                     url TEXT, \
+                     change_id TEXT, \
+                     related_artifacts TEXT, \
+                     project TEXT, \
+                     mod_date DATETIME, \
+                     issue_id INTEGER NOT NULL, \
+                     open TEXT \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_ext_gerrit_ext_issue_idx ON issues_ext_gerrit (issue_id);',
+    )
+
+
+class DBGerritIssueExtPostgreSQL(DBGerritIssueExt):
+    """
+    PostgreSQL subclass of L{DBGerritIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_gerrit ( \
+                     id SERIAL PRIMARY KEY, \
+                     branch TEXT, \
+                     url TEXT, \
+                     change_id TEXT, \
+                     related_artifacts TEXT, \
+                     project TEXT, \
+                     mod_date TIMESTAMP, \
+                     issue_id INTEGER NOT NULL, \
+                     open TEXT \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_ext_gerrit_ext_issue_idx ON issues_ext_gerrit (issue_id);',
+    )
+
+
 class DBGerritBackend(DBBackend):
     """
     Adapter for Gerrit backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBGerritIssueExtMySQL]
+        self.SQLITE_EXT = [DBGerritIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBGerritIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -183,14 +266,27 @@ class Gerrit():
 
     def __init__(self):
         self.delay = Config.delay
+        self.workers = max(getattr(Config, 'workers', 1) or 1, 1)
+
+        # Reviews are retrieved from the REST API when its URL is set
+        self.rest_url = None
+        rest = getattr(Config, 'gerrit_rest', None)
+        if rest is not None:
+            self.web_url = (rest or "https://" + Config.url).rstrip('/')
+            self.rest_url = self.web_url
+            password = getattr(Config, 'backend_password', None)
+            if password:
+                # Authenticated requests are sent to /a/
+                self.rest_url += "/a"
+                httpclient.add_credentials(self.rest_url,
+                                           Config.backend_user, password)
 
     def _convert_to_datetime(self, date):
         """
-        Returns datetime object from string
+        Returns the local datetime object of the seconds since the epoch
         """
-        import time
-        return parse(time.strftime('%Y %m %d %H:%M:%S', time.localtime(date)))
-        # return parse(str(str_date)).replace(tzinfo=None)
+        # Seconds are truncated, as when formatting the local time
+        return datetime.fromtimestamp(int(date))
 
     def analyze_review(self, review):
         try:
@@ -349,11 +445,11 @@ class Gerrit():
         # Check with changes added from MERGED and ABANDONED comments
         query_i = "SELECT COUNT(id) FROM  "
         query_c = "SELECT COUNT(DISTINCT(issue_id)) FROM  "
-        query_i_m = query_i + 'issues WHERE status="MERGED" AND tracker_id='+str(dbtrk_id)
-        query_c_m = query_c + 'changes, issues WHERE field="status" AND new_value="MERGED"'
+        query_i_m = query_i + "issues WHERE status='MERGED' AND tracker_id="+str(dbtrk_id)
+        query_c_m = query_c + "changes, issues WHERE field='status' AND new_value='MERGED'"
         query_c_m += ' AND changes.issue_id = issues.id AND tracker_id='+str(dbtrk_id)
-        query_i_a = query_i + 'issues WHERE status="ABANDONED" AND tracker_id='+str(dbtrk_id)
-        query_c_a = query_c + 'changes, issues WHERE field="status" AND new_value="ABANDONED"'
+        query_i_a = query_i + "issues WHERE status='ABANDONED' AND tracker_id="+str(dbtrk_id)
+        query_c_a = query_c + "changes, issues WHERE field='status' AND new_value='ABANDONED'"
         query_c_a += ' AND changes.issue_id = issues.id AND tracker_id='+str(dbtrk_id)
         aux = store.execute(query_i_m)
         issues_merged = aux.get_one()[0]
@@ -385,13 +481,47 @@ class Gerrit():
                                 unicode("NEW"), by, date)
         issue.add_change(change)
 
-    def add_merged_abandoned_changes(self, review, issue):
+    def classify_comments(self, review):
+        """
+        Find the events of the comments of a review in a single pass.
+
+        The first comment of each patch set is an UPLOADED event. The
+        comments that merged, abandoned or restored the review are
+        MERGED, ABANDONED and RESTORED events.
+
+        @param review: review of gerrit query
+        @type review: C{dict}
+
+        @return: the events in the order of the comments, as tuples of
+          the event, the patch set and the comment
+        @rtype: C{list} of C{tuple}
+        """
+        events = []
+        uploaded = set()
+
+        for comment in review.get('comments', []):
+            message = comment["message"]
+
+            match = PATCHSET_COMMENT_PATTERN.match(message) or \
+                UPLOADED_COMMENT_PATTERN.match(message)
+            # Sometimes we get more than one Verified for the same patch
+            if match and match.group(1) not in uploaded:
+                uploaded.add(match.group(1))
+                events.append((UPLOADED_EVENT, match.group(1), comment))
+
+            if message == MERGED_COMMENT:
+                events.append((MERGED_EVENT, u'', comment))
+            elif ABANDONED_COMMENT_PATTERN.match(message):
+                events.append((ABANDONED_EVENT, u'', comment))
+            elif RESTORED_COMMENT_PATTERN.match(message):
+                events.append((RESTORED_EVENT, u'', comment))
+
+        return events
+
+    def add_merged_abandoned_changes(self, review, issue, events=None):
         if (issue.status<>'MERGED' and issue.status<>'ABANDONED'): return
 
-        ABANDONED_REGEXP_1 = re.compile(r'^Patch Set (.*?): Abandoned(.*)')
-        ABANDONED_REGEXP_2 = re.compile(r'^Abandoned(.*)')
         patchSets = review['patchSets']
-        comments = review['comments']
         by = None
         date = None
         patchNumber = unicode('')
@@ -411,9 +541,10 @@ class Gerrit():
 
         # ABANDONED event searched from comments
         if (issue.status=='ABANDONED'):
-            for comment in comments:
-                if (ABANDONED_REGEXP_1.match(comment["message"]) or
-                   ABANDONED_REGEXP_2.match(comment["message"])):
+            if events is None:
+                events = self.classify_comments(review)
+            for event, patchset, comment in events:
+                if event == ABANDONED_EVENT:
                     by = People(comment['reviewer']["username"])
                     date = self._convert_to_datetime(comment["timestamp"])
 
@@ -422,70 +553,76 @@ class Gerrit():
                             issue.status, by, date)
             issue.add_change(change)
 
-    def add_uploaded_patchset_from_comments(self, review, issue):
-        # comm.text like '%Patch Set%Verified%' "
-        UPLOAD_REGEXP_1 = re.compile(r'^Uploaded patch set (.*?).')
-        UPLOAD_REGEXP_2 = re.compile(r'^Patch Set (.*?):(.*)')
-        # Review all comments and create MERGE and ABANDONED changes
-        comments = review['comments']
-        ncomment = 0
-        patchset_added = []
-        for comment in comments:
-            ncomment += 1
-            by = People(comment['reviewer']["username"])
-            if (UPLOAD_REGEXP_2.match(comment["message"])):
-                patchset = comment["message"].split("Patch Set ")[1]
-                patchset = patchset.split(":")[0]
-            elif (UPLOAD_REGEXP_1.match(comment["message"])):
-                patchset = comment["message"].split(" ")[3]
-                patchset = patchset.split(".")[0]
-            else:
+    def add_uploaded_patchset_from_comments(self, review, issue, events=None):
+        # Create an UPLOADED change for the first comment of each patch set
+        if events is None:
+            events = self.classify_comments(review)
+        for event, patchset, comment in events:
+            if event != UPLOADED_EVENT:
                 continue
-            # Sometimes we get more than one Verfieid for the same patch
-            if patchset in patchset_added: continue
-            patchset_added.append(patchset)
+            by = People(comment['reviewer']["username"])
             change = Change(unicode("status"), unicode(patchset),
-                            unicode("UPLOADED"), by,
+                            UPLOADED_EVENT, by,
                             self._convert_to_datetime(comment["timestamp"]))
             issue.add_change(change)
 
     # Comments are not a robust way for getting review status
-    def add_merged_abandoned_changes_from_comments(self, review, issue):
-        # text like 'Patch Set %: Abandoned%' or text like 'Abandoned%'
-        ABANDONED_REGEXP_1 = re.compile(r'^Patch Set (.*?): Abandoned(.*)')
-        ABANDONED_REGEXP_2 = re.compile(r'^Abandoned(.*)')
-        RESTORED_REGEXP_1 = re.compile(r'^Patch Set (.*?): Restored(.*)')
-        RESTORED_REGEXP_2 = re.compile(r'^Restored(.*)')
-        abandoned = False
-
+    def add_merged_abandoned_changes_from_comments(self, review, issue,
+                                                   events=None):
         # Review all comments and create MERGE and ABANDONED changes
-        comments = review['comments']
-        ncomment = 0
-        for comment in comments:
-            ncomment += 1
-            by = People(comment['reviewer']["username"])
-            if (comment["message"] == "Change has been successfully merged into the git repository."):
+        if events is None:
+            events = self.classify_comments(review)
+        abandoned = None
+        for event, patchset, comment in events:
+            if event == MERGED_EVENT:
+                by = People(comment['reviewer']["username"])
                 change = Change(unicode("status"), unicode(""),
-                                unicode("MERGED"), by,
+                                MERGED_EVENT, by,
                                 self._convert_to_datetime(comment["timestamp"]))
                 issue.add_change(change)
-            elif (ABANDONED_REGEXP_1.match(comment["message"]) or
-                   ABANDONED_REGEXP_2.match(comment["message"])):
-                abandoned = True
-                by_abandoned = by
-                date_abandoned = self._convert_to_datetime(comment["timestamp"])
-            elif (RESTORED_REGEXP_1.match(comment["message"]) or 
-                   RESTORED_REGEXP_2.match(comment["message"])):
-                abandoned = False
+            elif event == ABANDONED_EVENT:
+                abandoned = comment
+            elif event == RESTORED_EVENT:
+                abandoned = None
 
         if (abandoned):
+            by = People(abandoned['reviewer']["username"])
             change = Change(unicode("status"), unicode(""),
-                            unicode("ABANDONED"), by_abandoned, date_abandoned)
+                            ABANDONED_EVENT, by,
+                            self._convert_to_datetime(abandoned["timestamp"]))
             issue.add_change(change)
 
+    def _get_ssh_cmd(self, args):
+        """
+        Return the ssh command that runs X{args} in the Gerrit server.
+
+        The queries of the run share a master connection through a
+        socket in ~/.bicho/ssh, so the ssh handshake is done only once.
+        The master connection is closed when it has been idle for
+        L{SSH_CONTROL_PERSIST} seconds.
+        """
+        control_dir = os.path.join(bicho_dot_dir(), 'ssh')
+        create_dir(control_dir)
+
+        host = Config.url
+        if getattr(Config, 'backend_user', None):
+            host = Config.backend_user + "@" + Config.url
+
+        return ["ssh", "-p", GERRIT_SSH_PORT,
+                "-o", "ControlMaster=auto",
+                "-o", "ControlPath=" + os.path.join(control_dir, "%r@%h:%p"),
+                "-o", "ControlPersist=%s" % SSH_CONTROL_PERSIST,
+                host, args]
 
     def getReviews(self, limit, start):
+        """
+        Query the reviews of the project, yielding each entry of the
+        output as soon as it is read. The output has an entry per
+        line, the last one with the stats of the query.
 
+        When the generator is closed before reading all the entries,
+        the query is stopped.
+        """
         args_gerrit = "gerrit query "
         args_gerrit += "project:" + Config.gerrit_project
         args_gerrit += " limit:" + str(limit)
@@ -494,48 +631,320 @@ class Gerrit():
         # --patch-sets --submit
         args_gerrit += " --all-approvals --comments --format=JSON"
 
-        if 'backend_user' in vars(Config):
-            cmd = ["ssh", "-p 29418", Config.backend_user + "@" + Config.url, args_gerrit]
-            printdbg("Gerrit cmd: " + "ssh -p 29418 " + Config.backend_user + "@" + Config.url + " " + args_gerrit)
+        cmd = self._get_ssh_cmd(args_gerrit)
+        printdbg("Gerrit cmd: " + " ".join(cmd))
+
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        finished = False
+        try:
+            # readline does not wait to fill a read-ahead buffer
+            for line in iter(proc.stdout.readline, ''):
+                if line.strip():
+                    yield json.loads(line)
+            finished = True
+        finally:
+            proc.stdout.close()
+            if not finished and proc.poll() is None:
+                proc.terminate()
+            proc.wait()
+
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    def _rest_get(self, query, start=0, limit=REST_PAGE_SIZE,
+                  options=REST_OPTIONS):
+        """
+        Query the changes of the REST API, from the most recently
+        updated.
+
+        @return: the changes and whether there are more after them
+        @rtype: C{tuple}
+        """
+        url = self.rest_url + "/changes/?q=" + urllib.quote_plus(query)
+        url += "&n=%s&S=%s" % (limit, start)
+        url += "".join("&o=" + o for o in options)
+        printdbg("Gerrit REST query: " + url)
+
+        content = httpclient.urlopen(url).read()
+        # The first line protects against XSSI
+        changes = json.loads(content[content.find("\n") + 1:])
+        more = bool(changes) and changes[-1].get('_more_changes', False)
+        return changes, more
+
+    def _rest_time(self, value):
+        """
+        Return the seconds since the epoch of a UTC timestamp of the
+        REST API, like 2013-02-01 09:59:32.126000000
+        """
+        return calendar.timegm(time.strptime(value[:19], '%Y-%m-%d %H:%M:%S'))
+
+    def _rest_account(self, account):
+        return dict((k, account[k]) for k in ('username', 'name', 'email')
+                    if k in account)
+
+    def _convert_rest_change(self, change):
+        """
+        Convert a change of the REST API to the format of the reviews
+        of gerrit query.
+
+        The REST API only returns the last vote of each reviewer, so
+        the approvals are added to the last patch set.
+        """
+        revisions = sorted(change.get('revisions', {}).items(),
+                           key=lambda r: r[1]['_number'])
+        patchsets = []
+        for sha, revision in revisions:
+            patchsets.append({'number': str(revision['_number']),
+                              'revision': sha,
+                              'ref': revision.get('ref'),
+                              'uploader': self._rest_account(
+                                  revision.get('uploader', {})),
+                              'createdOn': self._rest_time(revision['created'])})
+
+        approvals = []
+        for label, info in change.get('labels', {}).items():
+            for vote in info.get('all', []):
+                # Reviewers without a vote are listed with value 0
+                if not vote.get('value') or 'date' not in vote:
+                    continue
+                approvals.append({'type': label,
+                                  'value': str(vote['value']),
+                                  'grantedOn': self._rest_time(vote['date']),
+                                  'by': self._rest_account(vote)})
+        if patchsets and approvals:
+            patchsets[-1]['approvals'] = approvals
+
+        comments = []
+        for message in change.get('messages', []):
+            comments.append({'message': message['message'],
+                             'reviewer': self._rest_account(
+                                 message.get('author', {})),
+                             'timestamp': self._rest_time(message['date'])})
+
+        number = str(change['_number'])
+        review = {'project': change['project'],
+                  'branch': change['branch'],
+                  'id': change['change_id'],
+                  'number': number,
+                  'subject': change['subject'],
+                  'owner': self._rest_account(change['owner']),
+                  'url': self.web_url + "/" + number,
+                  'createdOn': self._rest_time(change['created']),
+                  'lastUpdated': self._rest_time(change['updated']),
+                  'open': change['status'] not in ('MERGED', 'ABANDONED'),
+                  'status': change['status'],
+                  'patchSets': patchsets,
+                  'comments': comments}
+        if 'topic' in change:
+            review['topic'] = change['topic']
+        return review
+
+    def _get_oldest_update(self):
+        """
+        Return the time of the least recently updated change of the
+        project, looking for its offset with a binary search.
+        """
+        query = "project:" + Config.gerrit_project
+        if not self._rest_get(query, 0, 1, ())[0]:
+            return None
+
+        low, high = 0, 1
+        while self._rest_get(query, high, 1, ())[0]:
+            low, high = high, high * 2
+        while high - low > 1:
+            middle = (low + high) / 2
+            if self._rest_get(query, middle, 1, ())[0]:
+                low = middle
+            else:
+                high = middle
+
+        changes, more = self._rest_get(query, low, 1, ())
+        return self._rest_time(changes[0]['updated'])
+
+    def _get_windows(self, start, end, count):
+        """
+        Split the time between X{start} and X{end} in X{count} windows.
+
+        A window is a list with the first and last second of the
+        window and the number of changes of its last second already
+        retrieved.
+        """
+        step = max((end - start) / count, 1)
+        windows = []
+        while start < end:
+            windows.append([start, min(start + step, end), 0])
+            start += step
+        return windows
+
+    def _get_window_page(self, window):
+        """
+        Retrieve the next page of the reviews of a time window, from
+        the most recently updated.
+
+        Errors are returned instead of raised, so the thread storing
+        the reviews gets them.
+
+        @return: the window, the reviews, whether there are more and
+          the error, if any
+        @rtype: C{tuple}
+        """
+        after, before, skip = window
+        query = 'project:%s after:"%s +0000" before:"%s +0000"' % \
+            (Config.gerrit_project,
+             time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(after)),
+             time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(before)))
+
+        try:
+            changes, more = self._rest_get(query, skip)
+            reviews = [self._convert_rest_change(c) for c in changes]
+        except Exception:
+            return window, None, False, sys.exc_info()
+        return window, reviews, more, None
+
+    def _next_window_page(self, window, reviews):
+        """
+        Move the end of a window to the last update of the reviews
+        retrieved. Offsets are only used among the changes updated
+        in the same second, so the changes updated while the window
+        is retrieved do not move the next pages.
+        """
+        last = reviews[-1]['lastUpdated']
+        if last == window[1]:
+            window[2] += len(reviews)
         else:
-            cmd = ["ssh", "-p 29418", Config.url, args_gerrit]
-            printdbg("Gerrit cmd: " + "ssh " + "-p 29418 " + Config.url + " " + args_gerrit)
-        tickets_raw = subprocess.check_output(cmd)
-        # tickets_raw = open('./tickets.json', 'r').read()
-        tickets_raw = "[" + tickets_raw.replace("\n", ",") + "]"
-        tickets_raw = tickets_raw.replace(",]", "]")
-        tickets = json.loads(tickets_raw)
-
-#        tickets_test = '[{"project":"openstack/nova","branch":"master","topic":"bug/857209","id":"I660532ee5758c7595138d4dcf5a2825ddf898c65","number":"637","subject":"contrib/nova.sh: Updated to latest \\u0027upstream\\u0027 commit:6a8433a resolves bug 857209","owner":{"name":"Dave Walker","email":"Dave.Walker@canonical.com","username":"davewalker"},"url":"https://review.openstack.org/637","createdOn":1316815511,"lastUpdated":1316815646,"sortKey":"0017e78f0000027d","open":false,"status":"ABANDONED","patchSets":[{"number":"1","revision":"95d8d0f75c188f7eabf00ecf6bd5b397852e67b9","ref":"refs/changes/37/637/1","uploader":{"name":"Dave Walker","email":"Dave.Walker@canonical.com","username":"davewalker"},"createdOn":1316815511}]},'
-#        tickets_test += '{"project":"openstack/nova","branch":"master","id":"I812e95fb0744ad84abd7ea2ad7d11123667abbc8","number":"635","subject":"Made jenkins email pruning more resilient.","owner":{"name":"Monty Taylor","email":"mordred@inaugust.com","username":"mordred"},"url":"https://review.openstack.org/635","createdOn":1316813897,"lastUpdated":1316814951,"sortKey":"0017e7830000027b","open":false,"status":"MERGED","patchSets":[{"number":"1","revision":"c586e4ed23846420177802c164f594e021cceea8","ref":"refs/changes/35/635/1","uploader":{"name":"Monty Taylor","email":"mordred@inaugust.com","username":"mordred"},"createdOn":1316813897,"approvals":[{"type":"SUBM","value":"1","grantedOn":1316814951,"by":{"name":"Jenkins","username":"jenkins"}},{"type":"VRIF","description":"Verified","value":"1","grantedOn":1316814948,"by":{"name":"Jenkins","username":"jenkins"}},{"type":"CRVW","description":"Code Review","value":"2","grantedOn":1316814192,"by":{"name":"Brian Waldon","email":"bcwaldon@gmail.com","username":"bcwaldon"}}]}]},'
-#        tickets_test += '{"project":"openstack/nova","branch":"master","id":"I495363b44d9da96d66f85c2a621393329830aeb3","number":"630","subject":"Fixing bug 857712","owner":{"name":"Brian Waldon","email":"bcwaldon@gmail.com","username":"bcwaldon"},"url":"https://review.openstack.org/630","createdOn":1316810421,"lastUpdated":1316813692,"sortKey":"0017e76e00000276","open":false,"status":"MERGED","patchSets":[{"number":"1","revision":"ddb6945e8fbb8a00d5b67a6a6b8a069b7642022d","ref":"refs/changes/30/630/1","uploader":{"name":"Brian Waldon","email":"bcwaldon@gmail.com","username":"bcwaldon"},"createdOn":1316810421,"approvals":[{"type":"SUBM","value":"1","grantedOn":1316813692,"by":{"name":"Jenkins","username":"jenkins"}},{"type":"VRIF","description":"Verified","value":"1","grantedOn":1316813689,"by":{"name":"Jenkins","username":"jenkins"}},{"type":"CRVW","description":"Code Review","value":"1","grantedOn":1316811221,"by":{"name":"Josh Kearney","email":"josh@jk0.org","username":"jk0"}},{"type":"CRVW","description":"Code Review","value":"2","grantedOn":1316812789,"by":{"name":"Brian Lamar","email":"brian.lamar@gmail.com","username":"blamar"}},{"type":"CRVW","description":"Code Review","value":"1","grantedOn":1316810744,"by":{"name":"Mark McLoughlin","email":"markmc@redhat.com","username":"markmc"}}]}]},'
-#        tickets_test += '{"type":"stats","rowCount":67,"runTimeMilliseconds":365}]'
-#        tickets = json.loads(tickets_test)
-
-        return tickets
+            window[1] = last
+            window[2] = len([r for r in reviews if r['lastUpdated'] == last])
 
-    def run(self):
+    def store_review(self, bugsdb, review, trk_id):
         """
+        Analyze a review and store it with the changes found in its
+        approvals and comments.
+
+        @return: whether the review was stored
+        @rtype: C{bool}
         """
-        printout("Running Bicho with delay of %s seconds" % (str(self.delay)))
+        review_data = self.analyze_review(review)
+        if review_data is None:
+            pprint.pprint("ERROR in review. Ignoring it.")
+            return False
+
+        # extra changes not included in gerrit changes, found walking
+        # the comments once
+        events = self.classify_comments(review)
+        # self.add_merged_abandoned_changes_from_comments(review, review_data, events)
+        self.add_merged_abandoned_changes(review, review_data, events)
+        self.add_uploaded_patchset_from_comments(review, review_data, events)
+        self.add_new_change(review_data)
+        bugsdb.insert_issue(review_data, trk_id)
+        return True
+
+    def _run_rest(self, bugsdb, dbtrk):
+        """
+        Retrieve the reviews from the REST API. The history of the
+        project is split in time windows, fetched by X{workers}
+        threads a page at a time, and this thread stores the reviews
+        of each page as it arrives. The windows left, with the point
+        reached in each one, are saved in the checkpoint.
+
+        @return: number of reviews stored
+        @rtype: C{int}
+        """
+        cursor = bugsdb.get_checkpoint(dbtrk.id)
+        if cursor and 'windows' in cursor:
+            windows = cursor['windows']
+            printout("Resuming interrupted run, %s time windows left"
+                     % len(windows))
+        else:
+            last_mod_date = bugsdb.get_last_modification_date(tracker_id=dbtrk.id)
+            if last_mod_date:
+                printdbg("Last reviews analyzed were modified on date: %s"
+                         % last_mod_date)
+                start = int(time.mktime(time.strptime(last_mod_date,
+                                                      '%Y-%m-%d %H:%M:%S')))
+            else:
+                start = self._get_oldest_update()
+                if start is None:
+                    return 0
+            windows = self._get_windows(start, int(time.time()) + 1,
+                                        self.workers * REST_WINDOWS_PER_WORKER)
+
+        # Windows share their limits, so a review can be found twice
+        stored = set()
+        waiting = list(windows)
+        running = 0
+        pages = Queue.Queue()
+        pool = ThreadPool(self.workers)
+
+        def fetch(window):
+            pool.apply_async(self._get_window_page, (window,),
+                             callback=pages.put)
 
-        bugs = []
-        bugsdb = get_database(DBGerritBackend())
+        try:
+            while waiting or running:
+                # A page of each window is retrieved at once
+                while waiting and running < self.workers:
+                    fetch(waiting.pop(0))
+                    running += 1
+
+                # A timeout keeps the wait interruptible by Ctrl-C
+                while True:
+                    try:
+                        window, reviews, more, error = pages.get(True, 1)
+                        break
+                    except Queue.Empty:
+                        pass
+                if error:
+                    raise error[0], error[1], error[2]
 
-        # still useless in gerrit
-        bugsdb.insert_supported_traker("gerrit", "beta")
-        trk = Tracker(Config.url + "_" + Config.gerrit_project, "gerrit", "beta")
-        dbtrk = bugsdb.insert_tracker(trk)
+                for review in reviews:
+                    if review['number'] in stored:
+                        continue
+                    if self.store_review(bugsdb, review, dbtrk.id):
+                        stored.add(review['number'])
 
-        last_mod_time = 0
-        last_mod_date = bugsdb.get_last_modification_date(tracker_id=dbtrk.id)
-        if last_mod_date:
-            printdbg("Last reviews analyzed were modified on date: %s"
-                     % last_mod_date)
-            last_mod_time = time.mktime(time.strptime(last_mod_date, '%Y-%m-%d %H:%M:%S'))
+                if more and reviews:
+                    self._next_window_page(window, reviews)
+                    fetch(window)
+                else:
+                    windows = [w for w in windows if w is not window]
+                    running -= 1
+                bugsdb.save_checkpoint(dbtrk.id, {'windows': windows})
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+        return len(stored)
+
+    def _run_ssh(self, bugsdb, dbtrk):
+        """
+        Retrieve the reviews with gerrit query, from the most recently
+        updated, until the last one stored is found.
 
+        @return: number of reviews stored
+        @rtype: C{int}
+        """
         limit = 500  # gerrit default 500
         last_item = ""
+        last_mod_time = 0
+
+        # Reviews are retrieved from the newest, so the date of the
+        # interrupted run must be used instead of the last one stored
+        cursor = bugsdb.get_checkpoint(dbtrk.id)
+        if cursor and 'sortkey' in cursor:
+            last_item = cursor['sortkey']
+            last_mod_time = cursor['last_mod_time']
+            printout("Resuming interrupted run from sortKey %s" % last_item)
+        else:
+            last_mod_date = bugsdb.get_last_modification_date(tracker_id=dbtrk.id)
+            if last_mod_date:
+                printdbg("Last reviews analyzed were modified on date: %s"
+                         % last_mod_date)
+                last_mod_time = time.mktime(time.strptime(last_mod_date, '%Y-%m-%d %H:%M:%S'))
+
         # last_item = "001f672c00002f80";
         number_results = limit
         total_reviews = 0
@@ -552,24 +961,42 @@ class Gerrit():
                     if (entry['lastUpdated'] < last_mod_time):
                         break
                     reviews.append(entry["number"])
-                    review_data = self.analyze_review(entry)
-
-                    if review_data is None:
-                        pprint.pprint("ERROR in review. Ignoring it.")
+                    if not self.store_review(bugsdb, entry, dbtrk.id):
                         continue
 
                     last_item = entry['sortKey']
-                    # extra changes not included in gerrit changes
-                    # self.add_merged_abandoned_changes_from_comments(entry, review_data)
-                    self.add_merged_abandoned_changes(entry, review_data)
-                    self.add_uploaded_patchset_from_comments(entry, review_data)
-                    self.add_new_change(review_data)
-                    bugsdb.insert_issue(review_data, dbtrk.id)
                     number_results += 1
                 elif 'rowCount' in entry.keys():
                     pprint.pprint(entry)
                     printdbg("CONTINUE FROM: " + last_item)
+            # Stop the query when older reviews were found
+            tickets.close()
             total_reviews = total_reviews + int(number_results)
+            if last_item:
+                bugsdb.save_checkpoint(dbtrk.id,
+                                       {'sortkey': last_item,
+                                        'last_mod_time': last_mod_time})
+        return total_reviews
+
+    def run(self):
+        """
+        """
+        printout("Running Bicho with delay of %s seconds" % (str(self.delay)))
+
+        bugs = []
+        bugsdb = get_database(DBGerritBackend())
+
+        # still useless in gerrit
+        bugsdb.insert_supported_traker("gerrit", "beta")
+        trk = Tracker(Config.url + "_" + Config.gerrit_project, "gerrit", "beta")
+        dbtrk = bugsdb.insert_tracker(trk)
+
+        if self.rest_url:
+            total_reviews = self._run_rest(bugsdb, dbtrk)
+        else:
+            total_reviews = self._run_ssh(bugsdb, dbtrk)
+
+        bugsdb.clear_checkpoint(dbtrk.id)
         self.check_merged_abandoned_changes(bugsdb.store, dbtrk.id)
 
         print("Done. Number of reviews: " + str(total_reviews))
@@ -17,12 +17,14 @@
 #
 # Authors: Luis Cañas Díaz <lcanas@libresoft.es>
 
+import hashlib
+import re
 import sys
+import json
 import time
 import urllib2
-import base64
-import json
 
+from bicho import httpcache, httpclient
 from bicho.backends import Backend
 from bicho.config import Config
 from bicho.utils import printerr, printdbg, printout
@@ -40,6 +42,280 @@ from lazr.restfulclient.errors import HTTPError
 CLOSED_STATE = "closed"
 OPEN_STATE = "open"
 
+# Items requested on each page, the maximum of the GitHub API
+PER_PAGE = 100
+
+LINK_RE = re.compile(r'<([^>]*)>\s*;\s*rel="([^"]*)"')
+
+
+def parse_link_header(value):
+    """
+    Parse the X{Link} header of a paginated response.
+
+    @param value: value of the header
+    @type value: C{str}
+
+    @return: URLs by relation (next, last, first, prev)
+    @rtype: C{dict}
+    """
+    return dict((rel, url) for url, rel in LINK_RE.findall(value or ''))
+
+
+class GithubSession(object):
+    """
+    Authenticated requests to the GitHub API.
+
+    The credentials are registered once in the HTTP client. Responses
+    are stored in a cache, so unchanged resources are revalidated
+    with their X{ETag} and GitHub answers X{304 Not Modified}, which
+    does not count against the rate limit. The responses are kept in
+    memory, or in the directory of the X{path} option when it is
+    set, apart from the ones retrieved with other credentials.
+
+    @param url: URL of the API
+    @type url: C{str}
+    @param user: GitHub user
+    @type user: C{str}
+    @param password: password or token of the user
+    @type password: C{str}
+    """
+
+    def __init__(self, url, user, password):
+        httpclient.add_credentials(url, user, password)
+        path = getattr(Config, 'path', None)
+        if path is None:
+            self.cache = httpcache.MemoryCache()
+        else:
+            key = hashlib.sha1('%s:%s' % (user, password)).hexdigest()
+            self.cache = httpcache.HTTPCache(httpcache.get_cache_dir(path),
+                                             key)
+        self.remaining_ratelimit = 0
+
+    def get(self, url):
+        """
+        Retrieve a resource.
+
+        @return: the decoded JSON and the URL of the next page, if any
+        @rtype: C{tuple}
+        """
+        result = httpclient.urlopen(url, cache=self.cache)
+        content = result.read()
+        headers = result.info()
+
+        if not getattr(result, 'from_cache', False):
+            self.remaining_ratelimit = headers.getheader('X-RateLimit-Remaining')
+        else:
+            printdbg("%s not modified" % url)
+
+        links = parse_link_header(headers.getheader('Link'))
+        return json.loads(content), links.get('next')
+
+    def get_all(self, url):
+        """
+        Retrieve all the items of a paginated resource, following the
+        X{next} links.
+
+        @rtype: C{list}
+        """
+        sep = '?' in url and '&' or '?'
+        url = url + sep + 'per_page=%s' % PER_PAGE
+
+        items = []
+        while url:
+            page, url = self.get(url)
+            items.extend(page)
+        return items
+
+
+# Issue events of the timeline, with the name given by the REST API
+GRAPHQL_EVENTS = (('AssignedEvent', 'assigned'),
+                  ('ClosedEvent', 'closed'),
+                  ('DemilestonedEvent', 'demilestoned'),
+                  ('LabeledEvent', 'labeled'),
+                  ('LockedEvent', 'locked'),
+                  ('MarkedAsDuplicateEvent', 'marked_as_duplicate'),
+                  ('MentionedEvent', 'mentioned'),
+                  ('MilestonedEvent', 'milestoned'),
+                  ('PinnedEvent', 'pinned'),
+                  ('ReferencedEvent', 'referenced'),
+                  ('RenamedTitleEvent', 'renamed'),
+                  ('ReopenedEvent', 'reopened'),
+                  ('SubscribedEvent', 'subscribed'),
+                  ('TransferredEvent', 'transferred'),
+                  ('UnassignedEvent', 'unassigned'),
+                  ('UnlabeledEvent', 'unlabeled'),
+                  ('UnlockedEvent', 'unlocked'),
+                  ('UnmarkedAsDuplicateEvent', 'unmarked_as_duplicate'),
+                  ('UnpinnedEvent', 'unpinned'),
+                  ('UnsubscribedEvent', 'unsubscribed'))
+
+# Commit of the events that reference one
+GRAPHQL_EVENT_COMMITS = {'ClosedEvent': 'closer { ... on Commit { oid } }',
+                         'ReferencedEvent': 'commit { oid }'}
+
+# Maximum cost of a query of issues, in points of the rate limit
+GRAPHQL_MAX_COST = 10
+
+GRAPHQL_RATELIMIT = 'rateLimit { cost remaining resetAt }'
+
+GRAPHQL_COMMENTS = """
+  comments(first: %s, after: $cursor) {
+    pageInfo { hasNextPage endCursor }
+    nodes { body createdAt author { login } }
+  }""" % PER_PAGE
+
+GRAPHQL_TIMELINE = """
+  timelineItems(first: %s, after: $cursor, itemTypes: [%s]) {
+    pageInfo { hasNextPage endCursor }
+    nodes { __typename %s }
+  }""" % (PER_PAGE,
+          ', '.join(re.sub(r'(?<=.)([A-Z])', r'_\1', t).upper()
+                    for t, e in GRAPHQL_EVENTS),
+          ' '.join('... on %s { createdAt actor { login } %s }'
+                   % (t, GRAPHQL_EVENT_COMMITS.get(t, ''))
+                   for t, e in GRAPHQL_EVENTS))
+
+# Only the first label and assignee are stored, as in the REST mode
+GRAPHQL_ISSUES_QUERY = """
+query($owner: String!, $name: String!, $first: Int!, $after: String,
+      $states: [IssueState!], $since: DateTime, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    issues(first: $first, after: $after, states: $states,
+           filterBy: {since: $since},
+           orderBy: {field: UPDATED_AT, direction: ASC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        id databaseId number title body state url
+        createdAt updatedAt closedAt
+        author { login }
+        assignees(first: 1) { nodes { login } }
+        labels(first: 1) { nodes { name } }
+        milestone { number title description }
+        %s
+        %s
+      }
+    }
+  }
+  %s
+}""" % (GRAPHQL_COMMENTS, GRAPHQL_TIMELINE, GRAPHQL_RATELIMIT)
+
+# Next page of the comments or events of an issue
+GRAPHQL_ISSUE_QUERY = """
+query($id: ID!, $cursor: String) {
+  node(id: $id) {
+    ... on Issue {
+      %%s
+    }
+  }
+  %s
+}""" % GRAPHQL_RATELIMIT
+
+
+class GithubGraphQLError(Exception):
+    """
+    Error returned by the GitHub GraphQL API
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class GithubGraphQL(object):
+    """
+    Queries to the GitHub GraphQL API.
+
+    The cost of each query and the remaining points of the rate limit
+    are kept after each query. Queries wait until the rate limit is
+    reset when the remaining points are not enough.
+
+    @param url: URL of the REST API of the issues of a repository
+    @type url: C{str}
+    @param token: OAuth token of the user
+    @type token: C{str}
+    """
+
+    def __init__(self, url, token):
+        root = url[:url.find('/repos/')]
+        if root.endswith('/api/v3'):
+            # GitHub Enterprise
+            self.url = root[:-len('v3')] + 'graphql'
+        else:
+            self.url = root + '/graphql'
+        self.token = token
+        self.cost = 1
+        self.remaining_ratelimit = None
+        self.reset_at = None
+
+    def query(self, query, variables):
+        """
+        Send a query.
+
+        @param query: GraphQL query
+        @type query: C{str}
+        @param variables: values of the variables of the query
+        @type variables: C{dict}
+
+        @return: the data of the response
+        @rtype: C{dict}
+
+        @raise GithubGraphQLError: when the response has errors
+        """
+        self.wait(self.cost)
+
+        body = json.dumps({'query': query, 'variables': variables})
+        request = urllib2.Request(self.url, body,
+                                  {'Authorization': 'bearer %s' % self.token,
+                                   'Content-Type': 'application/json'})
+        result = json.loads(httpclient.urlopen(request).read())
+        if result.get('errors'):
+            raise GithubGraphQLError(result['errors'])
+
+        data = result['data']
+        self.cost = data['rateLimit']['cost']
+        self.remaining_ratelimit = data['rateLimit']['remaining']
+        self.reset_at = parse(data['rateLimit']['resetAt'][:-1])
+        return data
+
+    def wait(self, cost):
+        """
+        Wait until the rate limit is reset when there are not X{cost}
+        points left.
+
+        @param cost: points needed by the next query
+        @type cost: C{int}
+        """
+        if self.remaining_ratelimit is None or \
+                self.remaining_ratelimit >= cost:
+            return
+
+        seconds = (self.reset_at - datetime.utcnow()).total_seconds()
+        if seconds > 0:
+            printout("GitHub rate limit exceeded, waiting %d seconds"
+                     % seconds)
+            time.sleep(seconds + 1)
+        self.remaining_ratelimit = None
+
+    def page_size(self, size):
+        """
+        Return the number of items of the next page, given that the
+        last query requested X{size} items.
+
+        The size keeps the cost of a query under L{GRAPHQL_MAX_COST}
+        and the remaining points of the rate limit.
+
+        @param size: items requested by the last query
+        @type size: C{int}
+
+        @rtype: C{int}
+        """
+        cost = float(max(self.cost, 1)) / size
+        points = GRAPHQL_MAX_COST
+        if self.remaining_ratelimit is not None:
+            points = min(points, self.remaining_ratelimit)
+        return max(1, min(PER_PAGE, int(points / cost)))
+
 
 class DBGithubIssueExt(object):
     """
@@ -94,12 +370,58 @@ class DBGithubIssueExtMySQL(DBGithubIssueExt):
                      ) ENGINE=MYISAM; '
 
 
+class DBGithubIssueExtSQLite(DBGithubIssueExt):
+    """
+    SQLite subclass of L{DBGithubIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_github ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     status VARCHAR(32) default NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     web_link VARCHAR(255) default NULL, \
+                     closed_at DATETIME default NULL, \
+                     updated_at DATETIME default NULL, \
+                     milestone_name VARCHAR(32) default NULL, \
+                     milestone_summary VARCHAR(255) default NULL, \
+                     milestone_title VARCHAR(255) default NULL, \
+                     milestone_web_link VARCHAR(255) default NULL, \
+                     labels VARCHAR(255) default NULL, \
+                     title VARCHAR(255) default NULL, \
+                     UNIQUE(issue_id) \
+                     );'
+
+
+class DBGithubIssueExtPostgreSQL(DBGithubIssueExt):
+    """
+    PostgreSQL subclass of L{DBGithubIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_github ( \
+                     id SERIAL PRIMARY KEY, \
+                     status VARCHAR(32) default NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     web_link VARCHAR(255) default NULL, \
+                     closed_at TIMESTAMP default NULL, \
+                     updated_at TIMESTAMP default NULL, \
+                     milestone_name VARCHAR(32) default NULL, \
+                     milestone_summary VARCHAR(255) default NULL, \
+                     milestone_title VARCHAR(255) default NULL, \
+                     milestone_web_link VARCHAR(255) default NULL, \
+                     labels VARCHAR(255) default NULL, \
+                     title VARCHAR(255) default NULL, \
+                     UNIQUE(issue_id) \
+                     );'
+
+
 class DBGithubBackend(DBBackend):
     """
     Adapter for GitHub backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBGithubIssueExtMySQL]
+        self.SQLITE_EXT = [DBGithubIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBGithubIssueExtPostgreSQL]
 
     def get_last_modification_date(self, store, bugs_state, tracker_id):
         # get last modification date stored in the database for a given status
@@ -369,6 +691,9 @@ class GithubIssue(Issue):
 
 class GithubBackend(Backend):
 
+    # Requests of each issue: its comments and its events
+    requests_per_delay = 2
+
     def __init__(self):
         self.url = Config.url
         self.delay = Config.delay
@@ -379,7 +704,23 @@ class GithubBackend(Backend):
             printerr("\n--backend-user and --backend-password are mandatory \
             to download bugs from Github\n")
             sys.exit(1)
-        self.remaining_ratelimit = 0
+        self.session = GithubSession(self.url, self.backend_user,
+                                     self.backend_password)
+
+        # Comments and events of the repository by issue number,
+        # retrieved at once in bulk mode
+        self.bulk = getattr(Config, 'github_bulk_fetch', False)
+        self.bulk_comments = {}
+        self.bulk_events = {}
+
+        # Issues are retrieved with their comments and events by pages
+        # of GraphQL queries, starting after the cursor of the last one
+        self.graphql = None
+        if getattr(Config, 'github_graphql', False):
+            self.graphql = GithubGraphQL(self.url, self.backend_password)
+        self.page_size = PER_PAGE
+        self.after = None
+        self.has_next = True
 
     def get_domain(self, url):
         strings = url.split('/')
@@ -388,9 +729,12 @@ class GithubBackend(Backend):
     def analyze_bug(self, bug):
         #Retrieving main bug information
 
+        if self.graphql:
+            ratelimit = self.graphql.remaining_ratelimit
+        else:
+            ratelimit = self.session.remaining_ratelimit
         printdbg(bug['url'] + " " + bug['state'] + " updated_at " +
-                 bug['updated_at'] + ' (ratelimit = ' +
-                 str(self.remaining_ratelimit) + ")")
+                 bug['updated_at'] + ' (ratelimit = ' + str(ratelimit) + ")")
 
         issue = bug['id']
         if bug['labels']:
@@ -435,7 +779,10 @@ class GithubBackend(Backend):
             issue.set_milestone_title(bug['milestone']['title'])
             issue.set_milestone_web_link(bug['milestone']['url'])
 
-        comments = self.__get_batch_comments(bug['number'])
+        if self.bulk or self.graphql:
+            comments = self.bulk_comments.get(bug['number'], [])
+        else:
+            comments = self.__get_batch_comments(bug['number'])
         for c in comments:
             by = People(c['user']['login'])
             ## by.setname() FIXME - to be done
@@ -444,7 +791,10 @@ class GithubBackend(Backend):
             issue.add_comment(com)
 
         # activity
-        entries = self.__get_batch_activities(bug['number'])
+        if self.bulk or self.graphql:
+            entries = self.bulk_events.get(bug['number'], [])
+        else:
+            entries = self.__get_batch_activities(bug['number'])
         for e in entries:
             field = e['event']
             added = e['commit_id']
@@ -485,37 +835,177 @@ class GithubBackend(Backend):
 
     def __get_batch_activities(self, bug_number):
         url = self.url + "/" + str(bug_number) + "/events"
-        base64string = base64.encodestring(
-            '%s:%s' % (self.backend_user,
-                       self.backend_password)).replace('\n', '')
+        return self.session.get_all(url)
 
-        request = urllib2.Request(url)
-        request.add_header("Authorization", "Basic %s" % base64string)
+    def __get_batch_comments(self, bug_number):
+        url = self.url + "/" + str(bug_number) + "/comments"
+        return self.session.get_all(url)
 
-        result = urllib2.urlopen(request)
-        content = result.read()
+    def __get_repo_comments(self, since=None):
+        """
+        Retrieve the comments of the repository updated since the
+        given date, by issue number.
+        """
+        url = self.url + "/comments?sort=created&direction=asc"
+        if since:
+            url = url + "&since=" + str(since)
 
-        events = json.loads(content)
+        comments = {}
+        for c in self.session.get_all(url):
+            number = int(c['issue_url'][c['issue_url'].rfind('/') + 1:])
+            comments.setdefault(number, []).append(c)
+        return comments
 
+    def __get_repo_events(self, since=None):
+        """
+        Retrieve the events of the repository created since the
+        given date, by issue number.
+        """
+        # Events can not be filtered by date and they are listed
+        # from the newest
+        url = self.url + "/events?per_page=%s" % PER_PAGE
+
+        events = {}
+        while url:
+            page, url = self.session.get(url)
+            for e in page:
+                if since and e['created_at'][:19] < since[:19]:
+                    url = None
+                    break
+                events.setdefault(e['issue']['number'], []).append(e)
+
+        for entries in events.values():
+            entries.reverse()
         return events
 
-    def __get_batch_comments(self, bug_number):
-        url = self.url + "/" + str(bug_number) + "/comments"
-        base64string = base64.encodestring(
-            '%s:%s' % (self.backend_user,
-                       self.backend_password)).replace('\n', '')
-
-        request = urllib2.Request(url)
-        request.add_header("Authorization", "Basic %s" % base64string)
-
-        result = urllib2.urlopen(request)
-        content = result.read()
+    def __load_bulk_data(self):
+        # Comments and events of both states of issues are needed
+        if self.mod_date_open and self.mod_date_closed:
+            since = min(self.mod_date_open, self.mod_date_closed)
+        else:
+            since = None
 
-        comments = json.loads(content)
+        printdbg("Retrieving comments and events of the repository since %s"
+                 % since)
+        self.bulk_comments = self.__get_repo_comments(since)
+        self.bulk_events = self.__get_repo_events(since)
+        printdbg("%s comments and %s events retrieved"
+                 % (sum(len(c) for c in self.bulk_comments.values()),
+                    sum(len(e) for e in self.bulk_events.values())))
 
-        return comments
+    def __get_graphql_items(self, node, name):
+        """
+        Retrieve all the comments or events of an issue, querying the
+        pages that did not fit in the query of issues.
+        """
+        connections = {'comments': GRAPHQL_COMMENTS,
+                       'timelineItems': GRAPHQL_TIMELINE}
+
+        items = node[name]['nodes']
+        page_info = node[name]['pageInfo']
+        while page_info['hasNextPage']:
+            data = self.graphql.query(GRAPHQL_ISSUE_QUERY % connections[name],
+                                      {'id': node['id'],
+                                       'cursor': page_info['endCursor']})
+            items.extend(data['node'][name]['nodes'])
+            page_info = data['node'][name]['pageInfo']
+        return items
+
+    def __from_graphql(self, node):
+        """
+        Convert an issue of the GraphQL API to the fields of the REST
+        API used by L{analyze_bug}.
+        """
+        # Authors of deleted accounts are null
+        ghost = {'login': u'ghost'}
+        url = self.url.rstrip('/')
+
+        if node['milestone']:
+            # Milestones have no REST identifier in the GraphQL API
+            m = node['milestone']
+            milestone = {'id': m['number'],
+                         'description': m['description'],
+                         'title': m['title'],
+                         'url': url[:url.rfind('/issues')] +
+                         '/milestones/' + str(m['number'])}
+        else:
+            milestone = None
+
+        bug = {'id': node['databaseId'],
+               'number': node['number'],
+               'url': url + '/' + str(node['number']),
+               'html_url': node['url'],
+               'state': node['state'].lower(),
+               'title': node['title'],
+               'body': node['body'],
+               'user': node['author'] or ghost,
+               'assignee': (node['assignees']['nodes'] or [None])[0],
+               'labels': node['labels']['nodes'],
+               'milestone': milestone,
+               'created_at': node['createdAt'],
+               'updated_at': node['updatedAt'],
+               'closed_at': node['closedAt']}
+
+        comments = [{'body': c['body'],
+                     'user': c['author'] or ghost,
+                     'created_at': c['createdAt']}
+                    for c in self.__get_graphql_items(node, 'comments')]
+
+        names = dict(GRAPHQL_EVENTS)
+        events = []
+        for e in self.__get_graphql_items(node, 'timelineItems'):
+            commit = e.get('closer') or e.get('commit') or {}
+            events.append({'event': names[e['__typename']],
+                           'commit_id': commit.get('oid'),
+                           'actor': e['actor'],
+                           'created_at': e['createdAt']})
+
+        return bug, comments, events
+
+    def __get_graphql_bugs_state(self, state, since):
+        if not self.has_next:
+            return []
+
+        owner, name = self.__get_project_from_url().split('/')
+        variables = {'owner': owner,
+                     'name': name,
+                     'first': self.page_size,
+                     'after': self.after,
+                     'states': [state.upper()],
+                     'since': since and since + 'Z',
+                     'cursor': None}
+        try:
+            data = self.graphql.query(GRAPHQL_ISSUES_QUERY, variables)
+        except urllib2.HTTPError, e:
+            # GitHub gives up on queries that take too long
+            if e.code != 502 or self.page_size == 1:
+                raise
+            self.page_size = max(1, self.page_size / 2)
+            printdbg("GraphQL query timed out, retrying with %s issues"
+                     % self.page_size)
+            return self.__get_graphql_bugs_state(state, since)
+
+        issues = data['repository']['issues']
+        self.after = issues['pageInfo']['endCursor']
+        self.has_next = issues['pageInfo']['hasNextPage']
+        self.page_size = self.graphql.page_size(variables['first'])
+        printdbg("GraphQL query cost %s points, next page of %s issues"
+                 % (self.graphql.cost, self.page_size))
+
+        bugs = []
+        self.bulk_comments = {}
+        self.bulk_events = {}
+        for node in issues['nodes']:
+            bug, comments, events = self.__from_graphql(node)
+            bugs.append(bug)
+            self.bulk_comments[bug['number']] = comments
+            self.bulk_events[bug['number']] = events
+        return bugs
 
     def __get_batch_bugs_state(self, state=OPEN_STATE, since=None):
+        if self.graphql:
+            return self.__get_graphql_bugs_state(state, since)
+
         if state == OPEN_STATE:
             url = self.url + "?state=open&page=" + str(self.pagecont) \
                 + "&per_page=100&sort=updated&direction=asc"
@@ -528,19 +1018,7 @@ class GithubBackend(Backend):
         if since:
             url = url + "&since=" + str(since)
 
-        base64string = base64.encodestring(
-            '%s:%s' % (self.backend_user,
-                       self.backend_password)).replace('\n', '')
-
-        request = urllib2.Request(url)
-        request.add_header("Authorization", "Basic %s" % base64string)
-
-        result = urllib2.urlopen(request)
-        content = result.read()
-
-        self.remaining_ratelimit = result.info()['x-ratelimit-remaining']
-        bugs = json.loads(content)
-
+        bugs, next_url = self.session.get(url)
         return bugs
 
     def __get_batch_bugs(self):
@@ -550,6 +1028,8 @@ class GithubBackend(Backend):
             if len(bugs) == 0:
                 self.bugs_state = CLOSED_STATE
                 self.pagecont = 1
+                self.after = None
+                self.has_next = True
         if self.bugs_state == CLOSED_STATE:
             bugs = self.__get_batch_bugs_state(state=CLOSED_STATE,
                                                since=self.mod_date_closed)
@@ -569,6 +1049,8 @@ class GithubBackend(Backend):
         bugsdb.insert_supported_traker("github", "v3")
         trk = Tracker(url, "github", "v3")
         dbtrk = bugsdb.insert_tracker(trk)
+        # dbtrk changes when the issues belong to other trackers
+        trk_id = dbtrk.id
 
         self.bugs_state = "open"
         self.pagecont = 1
@@ -585,12 +1067,28 @@ class GithubBackend(Backend):
         if aux_date_closed:
             self.mod_date_closed = aux_date_closed.isoformat()
 
+        # Pages are numbered for the dates of the interrupted run
+        cursor = bugsdb.get_checkpoint(trk_id)
+        if cursor:
+            self.bugs_state = cursor['state']
+            self.pagecont = cursor['page']
+            self.mod_date_open = cursor['mod_date_open']
+            self.mod_date_closed = cursor['mod_date_closed']
+            self.after = cursor.get('after')
+            printout("Resuming interrupted run from page %s of %s bugs"
+                     % (self.pagecont, self.bugs_state))
+
         printdbg("Last open bug already cached: %s" % self.mod_date_open)
         printdbg("Last closed bug already cached: %s" % self.mod_date_closed)
+
+        if self.bulk and not self.graphql:
+            self.__load_bulk_data()
+
         bugs = self.__get_batch_bugs()
         nbugs = len(bugs)
 
         if len(bugs) == 0:
+            bugsdb.clear_checkpoint(trk_id)
             if aux_date_open or aux_date_closed:
                 printout("Bicho database up to date")
             else:
@@ -627,14 +1125,20 @@ class GithubBackend(Backend):
                     print e
 
                 printdbg ("Getting ticket number " + str(bug["number"]))
-                time.sleep(self.delay)
 
             self.pagecont += 1
+            bugsdb.save_checkpoint(trk_id,
+                                   {'state': self.bugs_state,
+                                    'page': self.pagecont,
+                                    'mod_date_open': self.mod_date_open,
+                                    'mod_date_closed': self.mod_date_closed,
+                                    'after': self.after})
             bugs = self.__get_batch_bugs()
             nbugs = nbugs + len(bugs)
 
         #end while
 
+        bugsdb.clear_checkpoint(trk_id)
         printout("Done. %s bugs analyzed" % (nbugs))
 
 Backend.register_backend("github", GithubBackend)
@@ -22,6 +22,7 @@
 The Google Code backend is abandoned and nonfunctional as of November 2013.
 """
 
+from bicho import httpclient, ratelimit
 from bicho.config import Config
 
 from bicho.backends import Backend
@@ -38,7 +39,6 @@ import os
 import pprint
 import random
 import sys
-import time
 import traceback
 import urllib
 import feedparser
@@ -82,12 +82,50 @@ class DBGoogleCodeIssueExtMySQL(DBGoogleCodeIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBGoogleCodeIssueExtSQLite(DBGoogleCodeIssueExt):
+    """
+    SQLite subclass of L{DBGoogleCodeIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_googlecode ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     star TEXT, \
+                     ticket_num INTEGER NOT NULL, \
+                     mod_date DATETIME, \
+                     closed_date DATETIME, \
+                     issue_id INTEGER NOT NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_ext_googlecode_ext_issue_idx ON issues_ext_googlecode (issue_id);',
+    )
+
+
+class DBGoogleCodeIssueExtPostgreSQL(DBGoogleCodeIssueExt):
+    """
+    PostgreSQL subclass of L{DBGoogleCodeIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_googlecode ( \
+                     id SERIAL PRIMARY KEY, \
+                     star TEXT, \
+                     ticket_num INTEGER NOT NULL, \
+                     mod_date TIMESTAMP, \
+                     closed_date TIMESTAMP, \
+                     issue_id INTEGER NOT NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_ext_googlecode_ext_issue_idx ON issues_ext_googlecode (issue_id);',
+    )
+
+
 class DBGoogleCodeBackend(DBBackend):
     """
     Adapter for GoogleCode backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBGoogleCodeIssueExtMySQL]
+        self.SQLITE_EXT = [DBGoogleCodeIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBGoogleCodeIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
 
@@ -176,7 +214,8 @@ class GoogleCode():
         changes_url = Config.url + "/issues/" + issue.ticket_num + "/comments/full"
         printdbg("Analyzing issue " + changes_url)
 
-        d = feedparser.parse(changes_url)
+        ratelimit.wait(changes_url)
+        d = feedparser.parse(changes_url, handlers=httpclient.get_handlers())
         changes = self.parse_changes(d, issue.ticket_num)
 
         for c in changes:
@@ -229,7 +268,8 @@ class GoogleCode():
         self.url_issues = Config.url + "/issues/full?max-results=1"
         printdbg("URL for getting metadata " + self.url_issues)
 
-        d = feedparser.parse(self.url_issues)
+        ratelimit.wait(self.url_issues)
+        d = feedparser.parse(self.url_issues, handlers=httpclient.get_handlers())
 
         total_issues = int(d['feed']['opensearch_totalresults'])
         print "Total bugs: ", total_issues
@@ -246,7 +286,8 @@ class GoogleCode():
 
             printdbg("URL for next issues " + self.url_issues)
 
-            d = feedparser.parse(self.url_issues)
+            ratelimit.wait(self.url_issues)
+            d = feedparser.parse(self.url_issues, handlers=httpclient.get_handlers())
 
             for entry in d['entries']:
                 try:
@@ -256,7 +297,6 @@ class GoogleCode():
                     bugsdb.insert_issue(issue, dbtrk.id)
                     remaining -= 1
                     print "Remaining time: ", (remaining) * Config.delay / 60, "m", " issues ", str(remaining)
-                    time.sleep(Config.delay)
                 except Exception, e:
                     printerr("Error in function analyze_bug ")
                     pprint.pprint(entry)
@@ -267,6 +307,7 @@ class GoogleCode():
 
             start_issue += issues_per_query
 
+        bugsdb.flush_issues()
         printout("Done. %s bugs analyzed" % (total_issues - remaining))
 
 Backend.register_backend('googlecode', GoogleCode)
@@ -23,7 +23,6 @@
 
 import urllib2
 import base64
-import time
 import sys
 
 from storm.locals import Int, DateTime, Unicode, Reference, Desc
@@ -32,8 +31,9 @@ from dateutil.parser import parse
 from bicho.common import Issue, People, Tracker, Comment, Change, Attachment
 from bicho.backends import Backend
 from bicho.db.database import DBIssue, DBBackend, DBTracker, get_database
+from bicho import httpclient, ratelimit
 from bicho.config import Config
-from bicho.utils import printout, printerr, printdbg
+from bicho.utils import printout, printerr, printdbg, strip_invalid_xml_chars
 from BeautifulSoup import BeautifulSoup
 #from BeautifulSoup import NavigableString
 from BeautifulSoup import Comment as BFComment
@@ -107,12 +107,66 @@ class DBJiraIssueExtMySQL(DBJiraIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBJiraIssueExtSQLite(DBJiraIssueExt):
+    """
+    SQLite subclass of L{DBJiraIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_jira ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     issue_key VARCHAR(32) NOT NULL, \
+                     link VARCHAR(100) NOT NULL, \
+                     title VARCHAR(100) NOT NULL, \
+                     environment VARCHAR(35) NOT NULL, \
+                     security VARCHAR(35) NOT NULL, \
+                     updated DATETIME NOT NULL, \
+                     version VARCHAR(35) NOT NULL, \
+                     component VARCHAR(35) NOT NULL, \
+                     votes INTEGER, \
+                     project VARCHAR(35) NOT NULL, \
+                     project_id INTEGER, \
+                     project_key VARCHAR(35) NOT NULL, \
+                     status VARCHAR(35) NOT NULL, \
+                     resolution VARCHAR(35) NOT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id) \
+                     );'
+
+
+class DBJiraIssueExtPostgreSQL(DBJiraIssueExt):
+    """
+    PostgreSQL subclass of L{DBJiraIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_jira ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_key VARCHAR(32) NOT NULL, \
+                     link VARCHAR(100) NOT NULL, \
+                     title VARCHAR(100) NOT NULL, \
+                     environment VARCHAR(35) NOT NULL, \
+                     security VARCHAR(35) NOT NULL, \
+                     updated TIMESTAMP NOT NULL, \
+                     version VARCHAR(35) NOT NULL, \
+                     component VARCHAR(35) NOT NULL, \
+                     votes INTEGER, \
+                     project VARCHAR(35) NOT NULL, \
+                     project_id INTEGER, \
+                     project_key VARCHAR(35) NOT NULL, \
+                     status VARCHAR(35) NOT NULL, \
+                     resolution VARCHAR(35) NOT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id) \
+                     );'
+
+
 class DBJiraBackend(DBBackend):
     """
     Adapter for Jira backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBJiraIssueExtMySQL]
+        self.SQLITE_EXT = [DBJiraIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBJiraIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -735,7 +789,8 @@ class BugsHandler(xml.sax.handler.ContentHandler):
             serverUrl = Config.url.split("/browse/")[0]
             user_url = serverUrl + "/activity?maxResults=1&streams=user+IS+" + username
             email = ""
-            d = feedparser.parse(user_url)
+            ratelimit.wait(user_url)
+            d = feedparser.parse(user_url, handlers=httpclient.get_handlers())
             if 'entries' in d:
                 if len(d['entries']) > 0:
                     email = d['entries'][0]['author_detail']['email']
@@ -827,11 +882,6 @@ class JiraConnection(object):
             printout("No account data provided. Not logged in Jira")
             return
 
-        import cookielib
-
-        cookie_j = cookielib.CookieJar()
-        cookie_h = urllib2.HTTPCookieProcessor(cookie_j)
-
         auth_info = user + ':' + password
         auth_info = auth_info.replace('\n', '')
         base64string = base64.encodestring(auth_info)
@@ -839,12 +889,9 @@ class JiraConnection(object):
         request = urllib2.Request(url)
         request.add_header("Authorization", "Basic %s" % base64string)
 
-        opener = urllib2.build_opener(cookie_h)
-        urllib2.install_opener(opener)
-
-        urllib2.urlopen(request)
-        for i, c in enumerate(cookie_j):
-            self.cookies[c.name] = c.value
+        # Session cookies are kept by the HTTP client
+        httpclient.urlopen(request)
+        self.cookies = httpclient.get_cookies(url)
 
         printout("Logged in Jira as %s" % user)
         printdbg("Jira session cookies: %s" % self.cookies)
@@ -855,14 +902,8 @@ class JiraConnection(object):
         """
         request = urllib2.Request(url)
 
-        opener = urllib2.build_opener()
-
-        if self.is_auth_session():
-            q = [str(c) + '=' + v for c, v in self.cookies.items()]
-            opener.addheaders.append(('Cookie', '; '.join(q)))
-
         try:
-            return opener.open(request)
+            return httpclient.urlopen(request)
         except (urllib2.HTTPError, urllib2.URLError) as e:
             printerr("Error code: %s, reason: %s" % (e.code, e.reason))
             raise e
@@ -912,14 +953,6 @@ class JiraBackend(Backend):
         bugs = data_url.split("<issue")[1].split('\"/>')[0].split("total=\"")[1]
         return int(bugs)
 
-    # http://stackoverflow.com/questions/8733233/filtering-out-certain-bytes-in-python
-    def valid_XML_char_ordinal(self, i):
-        return (  # conditions ordered by presumed frequency
-            0x20 <= i <= 0xD7FF
-            or i in (0x9, 0xA, 0xD)
-            or 0xE000 <= i <= 0xFFFD
-            or 0x10000 <= i <= 0x10FFFF)
-
     def safe_xml_parse(self, url_issues, handler):
         f = self.conn.urlopen_auth(url_issues)
         parser = xml.sax.make_parser()
@@ -935,9 +968,9 @@ class JiraBackend(Backend):
                 parser2 = xml.sax.make_parser()
                 parser2.setContentHandler(handler)
                 parser2.setContentHandler(handler)
-                printdbg("Cleaning dirty XML")
-                cleaned_contents = ''. \
-                    join(c for c in contents if self.valid_XML_char_ordinal(ord(c)))
+                cleaned_contents, removed = strip_invalid_xml_chars(contents)
+                printdbg("Cleaning dirty XML: %s invalid characters removed"
+                         % removed)
                 parser2.feed(cleaned_contents)
                 parser2.close()
             except Exception:
@@ -962,6 +995,11 @@ class JiraBackend(Backend):
             traceback.print_exc()
             sys.exit(0)
 
+        # The offset only makes sense for the same query, so the date
+        # used to build it is saved too
+        bugsdb.save_checkpoint(dbtrk_id, {'last_mod_date': self.last_mod_date,
+                                          'offset': offset + nissues})
+
     def run(self):
         printout("Running Bicho with delay of %s seconds" % (str(self.delay)))
 
@@ -988,28 +1026,36 @@ class JiraBackend(Backend):
             handler = BugsHandler()
             parser.setContentHandler(handler)
             try:
-                parser.parse(serverUrl + query + bug_key + "/" + bug_key + ".xml")
+                bug_url = serverUrl + query + bug_key + "/" + bug_key + ".xml"
+                parser.parse(httpclient.urlopen(bug_url))
                 issue = handler.getIssues(self.conn)[0]
                 bugsdb.insert_issue(issue, dbtrk.id)
+                bugsdb.flush_issues()
             except Exception, e:
                 #printerr(e)
                 print(e)
 
         else:
-            self.last_mod_date = bugsdb.get_last_modification_date(tracker_id=dbtrk.id)
+            offset = 0
+            cursor = bugsdb.get_checkpoint(dbtrk.id)
+            if cursor:
+                self.last_mod_date = cursor['last_mod_date']
+                offset = cursor['offset']
+                printout("Resuming interrupted run from issue %s" % offset)
+            else:
+                self.last_mod_date = bugsdb.get_last_modification_date(tracker_id=dbtrk.id)
             if self.last_mod_date:
                 # self.url = self.url + "&updated:after=" + last_mod_date
                 printdbg("Last bugs cached were modified at: %s" % self.last_mod_date)
 
             bugs_number = self.bugsNumber(self.url)
             print "Tickets to be retrieved:", str(bugs_number)
-            remaining = bugs_number
+            remaining = bugs_number - offset
             while (remaining > 0):
                 self.analyze_bug_list(self.max_issues, bugs_number - remaining, bugsdb, dbtrk.id)
                 remaining -= self.max_issues
-                #print "Remaining time: ", (remaining/issues_per_xml_query)*Config.delay/60, "m", "(",remaining,")"
-                time.sleep(self.delay)
 
+            bugsdb.clear_checkpoint(dbtrk.id)
             printout("Done. %s bugs analyzed" % (bugs_number))
 
 
@@ -17,26 +17,42 @@
 #
 # Authors: Luis Cañas Díaz <lcanas@libresoft.es>
 
+import errno
+import json
 import sys
+import tempfile
 import time
 import os
 import pwd
+import urllib
 
 from launchpadlib.launchpad import Launchpad
-from launchpadlib.credentials import Credentials
 from launchpadlib.errors import NotFound
 
+from bicho import ratelimit
 from bicho.backends import Backend
 from bicho.config import Config
-from bicho.utils import printerr, printdbg, printout
+from bicho.utils import printerr, printdbg, printout, bicho_dot_dir, \
+    create_dir
 from bicho.common import Tracker, People, Issue, Comment, Change, TempRelationship, Attachment
-from bicho.db.database import DBIssue, DBBackend, DBTracker, DBIssue, get_database, NotFoundError
+from bicho.db.database import DBIssue, DBBackend, get_database, NotFoundError
 
 from storm.locals import DateTime, Int, Reference, Unicode, Desc
 from datetime import datetime
 from dateutil.parser import parse  # used to convert str time to datetime
 
-from tempfile import mkdtemp
+# Number of entries requested on each page of a collection in bulk
+# mode. Launchpad does not return more than 300.
+LP_PAGE_SIZE = 300
+
+# Dates of the bug tasks stored by the backend
+LP_TASK_DATES = ('date_assigned', 'date_closed', 'date_confirmed',
+                 'date_created', 'date_fix_committed', 'date_fix_released',
+                 'date_in_progress', 'date_incomplete', 'date_left_closed',
+                 'date_left_new', 'date_triaged', 'date_last_message')
+
+# Days that the people saved in the cache file are valid
+LP_PEOPLE_CACHE_DAYS = 7
 
 
 class DBLaunchpadIssueExt(object):
@@ -133,12 +149,98 @@ class DBLaunchpadIssueExtMySQL(DBLaunchpadIssueExt):
                      ) ENGINE=MYISAM; '
 
 
+class DBLaunchpadIssueExtSQLite(DBLaunchpadIssueExt):
+    """
+    SQLite subclass of L{DBLaunchpadIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_launchpad ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     status VARCHAR(32) default NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     description TEXT default NULL, \
+                     web_link VARCHAR(32) default NULL, \
+                     bug_target_display_name VARCHAR(32) default NULL, \
+                     bug_target_name VARCHAR(32) default NULL, \
+                     date_assigned DATETIME default NULL, \
+                     date_closed DATETIME default NULL, \
+                     date_confirmed DATETIME default NULL, \
+                     date_created DATETIME default NULL, \
+                     date_fix_committed DATETIME default NULL, \
+                     date_fix_released DATETIME default NULL, \
+                     date_in_progress DATETIME default NULL, \
+                     date_incomplete DATETIME default NULL, \
+                     date_left_closed DATETIME default NULL, \
+                     date_left_new DATETIME default NULL, \
+                     date_triaged DATETIME default NULL, \
+                     date_last_message DATETIME default NULL, \
+                     date_last_updated DATETIME default NULL, \
+                     milestone_code_name VARCHAR(32) default NULL, \
+                     milestone_data_targeted VARCHAR(32) default NULL, \
+                     milestone_name VARCHAR(32) default NULL, \
+                     milestone_summary VARCHAR(32) default NULL, \
+                     milestone_title VARCHAR(32) default NULL, \
+                     milestone_web_link VARCHAR(32) default NULL, \
+                     heat INTEGER default NULL, \
+                     linked_branches VARCHAR(32) default NULL, \
+                     tags VARCHAR(32) default NULL, \
+                     title VARCHAR(32) default NULL, \
+                     users_affected_count INTEGER default NULL, \
+                     web_link_standalone VARCHAR(32) default NULL, \
+                     UNIQUE(issue_id) \
+                     );'
+
+
+class DBLaunchpadIssueExtPostgreSQL(DBLaunchpadIssueExt):
+    """
+    PostgreSQL subclass of L{DBLaunchpadIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_launchpad ( \
+                     id SERIAL PRIMARY KEY, \
+                     status VARCHAR(32) default NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     description TEXT default NULL, \
+                     web_link VARCHAR(32) default NULL, \
+                     bug_target_display_name VARCHAR(32) default NULL, \
+                     bug_target_name VARCHAR(32) default NULL, \
+                     date_assigned TIMESTAMP default NULL, \
+                     date_closed TIMESTAMP default NULL, \
+                     date_confirmed TIMESTAMP default NULL, \
+                     date_created TIMESTAMP default NULL, \
+                     date_fix_committed TIMESTAMP default NULL, \
+                     date_fix_released TIMESTAMP default NULL, \
+                     date_in_progress TIMESTAMP default NULL, \
+                     date_incomplete TIMESTAMP default NULL, \
+                     date_left_closed TIMESTAMP default NULL, \
+                     date_left_new TIMESTAMP default NULL, \
+                     date_triaged TIMESTAMP default NULL, \
+                     date_last_message TIMESTAMP default NULL, \
+                     date_last_updated TIMESTAMP default NULL, \
+                     milestone_code_name VARCHAR(32) default NULL, \
+                     milestone_data_targeted VARCHAR(32) default NULL, \
+                     milestone_name VARCHAR(32) default NULL, \
+                     milestone_summary VARCHAR(32) default NULL, \
+                     milestone_title VARCHAR(32) default NULL, \
+                     milestone_web_link VARCHAR(32) default NULL, \
+                     heat INTEGER default NULL, \
+                     linked_branches VARCHAR(32) default NULL, \
+                     tags VARCHAR(32) default NULL, \
+                     title VARCHAR(32) default NULL, \
+                     users_affected_count INTEGER default NULL, \
+                     web_link_standalone VARCHAR(32) default NULL, \
+                     UNIQUE(issue_id) \
+                     );'
+
+
 class DBLaunchpadBackend(DBBackend):
     """
     Adapter for Launchpad backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBLaunchpadIssueExtMySQL]
+        self.SQLITE_EXT = [DBLaunchpadIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBLaunchpadIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -705,11 +807,128 @@ class LaunchpadIssue(Issue):
         self.web_link_standalone = web_link_standalone
 
 
+class LPPeopleCache(object):
+    """
+    Launchpad people by nickname, shared by all the lookups of a run.
+
+    People deleted from Launchpad are cached too. When a file is
+    given, the cache is loaded from it and saved back at the end of
+    the run. Entries older than L{LP_PEOPLE_CACHE_DAYS} days are
+    retrieved again.
+
+    @param path: file where the cache is saved, C{None} to keep it
+      in memory
+    @type path: C{str}
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.people = {}
+        self.hits = 0
+        self.misses = 0
+
+        if path:
+            self.load()
+
+    def get(self, nickname, fetch):
+        """
+        Return the identity of X{nickname}.
+
+        @param nickname: nickname of the person
+        @type nickname: C{str}
+        @param fetch: function that retrieves the person when it is not
+          cached. It raises C{KeyError} when the person was deleted.
+        @type fetch: C{callable} returning L{People}
+
+        @rtype: L{People}
+        """
+        entry = self.people.get(nickname)
+
+        if entry is None:
+            self.misses += 1
+            try:
+                p = fetch()
+                entry = {'user_id': p.user_id, 'name': p.name,
+                         'email': p.email}
+            except KeyError:
+                # user deleted from Launchpad!
+                entry = {'user_id': nickname, 'name': None, 'email': None}
+            entry['updated'] = time.time()
+            self.people[nickname] = entry
+        else:
+            self.hits += 1
+
+        p = People(entry['user_id'])
+        p.set_name(entry['name'])
+        p.set_email(entry['email'])
+        return p
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                people = json.load(f)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                printerr("Error reading people cache %s: %s" % (self.path, e))
+            return
+        except ValueError:
+            printerr("Invalid people cache %s ignored" % self.path)
+            return
+
+        expired = time.time() - LP_PEOPLE_CACHE_DAYS * 24 * 60 * 60
+        self.people = dict((nickname, entry)
+                           for nickname, entry in people.iteritems()
+                           if entry['updated'] > expired)
+        printdbg("%s people loaded from %s" % (len(self.people), self.path))
+
+    def save(self):
+        """
+        Save the cache to its file, if any.
+        """
+        printdbg("People cache: %s hits, %s misses" % (self.hits, self.misses))
+        if not self.path:
+            return
+
+        # Written to a temporary file and renamed, so an interrupted
+        # run does not leave a truncated cache
+        create_dir(os.path.dirname(self.path))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                json.dump(self.people, f)
+            os.rename(tmp, self.path)
+        except:
+            os.unlink(tmp)
+            raise
+
+
+def get_people_cache_path(path):
+    """
+    Return the file of the people cache for the value of the
+    X{lp_people_cache} option. An empty value means the cache
+    directory of Bicho.
+
+    @rtype: C{str}
+    """
+    if path is None:
+        return None
+    if not path:
+        return os.path.join(bicho_dot_dir(), 'cache', 'launchpad-people.json')
+    return os.path.abspath(os.path.expanduser(path))
+
+
 class LPBackend(Backend):
 
     def __init__(self):
         self.url = Config.url
         self.delay = Config.delay
+        self.bulk = getattr(Config, 'lp_bulk_fetch', False)
+
+        # Milestones retrieved in bulk mode, by self_link
+        self.milestone_links = {}
+
+        path = get_people_cache_path(getattr(Config, 'lp_people_cache', None))
+        self.people_cache = LPPeopleCache(path)
 
     def get_domain(self, url):
         strings = url.split('/')
@@ -740,11 +959,12 @@ class LPBackend(Backend):
         bug_type = bug.importance
         summary = bug.bug.title
         desc = bug.bug.description
-        submitted_by = self._get_person(bug.owner)
+        submitted_by = self._get_person_from_link(bug.lp_get_parameter('owner_link'))
         submitted_on = self.__drop_timezone(bug.date_created)
 
-        if bug.assignee:
-            assignee = self._get_person(bug.assignee)
+        assignee_link = bug.lp_get_parameter('assignee_link')
+        if assignee_link:
+            assignee = self._get_person_from_link(assignee_link)
         else:
             assignee = People("nobody")
 
@@ -866,7 +1086,7 @@ class LPBackend(Backend):
                     # we skip the first comment which is the description
                     skip = 0
                     continue
-                by = self._get_person(c.owner)
+                by = self._get_person_from_link(c.lp_get_parameter('owner_link'))
                 com = Comment(c.content, by, c.date_created)
                 issue.add_comment(com)
 
@@ -880,7 +1100,7 @@ class LPBackend(Backend):
             field = entry['whatchanged']
             removed = entry['oldvalue']
             added = entry['newvalue']
-            by = self.__get_people_from_uri(entry['person_link'])
+            by = self._get_person_from_link(entry['person_link'])
             date = self.__to_datetime(entry['datechanged'])
             change = Change(field, removed, added, by, date)
 
@@ -894,7 +1114,7 @@ class LPBackend(Backend):
             aux = a['message_link']
             comment_id = int(aux[aux.rfind('/') + 1:])
             comment = bug.bug.messages[comment_id]
-            a_by = self._get_person(comment.owner)
+            a_by = self._get_person_from_link(comment.lp_get_parameter('owner_link'))
             a_on = self.__drop_timezone(comment.date_created)
 
             #a_desc = a['']
@@ -905,6 +1125,173 @@ class LPBackend(Backend):
 
         return issue
 
+    def analyze_bug_bulk(self, task):
+        """
+        Build an issue from the JSON representation of a bug task.
+
+        Same as L{analyze_bug}, but messages, activity and attachments
+        are retrieved in pages of L{LP_PAGE_SIZE} entries, each person
+        and milestone is retrieved once per run and the attachments
+        take their authors from the messages already retrieved.
+        Linked branches are not retrieved.
+
+        @param task: representation of the bug task
+        @type task: C{dict}
+
+        @rtype: L{LaunchpadIssue}
+        """
+        bug = self._get_json(task['bug_link'])
+        printdbg(task['web_link'] + " updated at " + bug['date_last_updated'])
+
+        issue = task['web_link'][task['web_link'].rfind('/') + 1:]
+        submitted_by = self._get_person_from_link(task['owner_link'])
+        submitted_on = self.__to_datetime(task['date_created'])
+
+        issue = LaunchpadIssue(issue, task['importance'], bug['title'],
+                               bug['description'], submitted_by,
+                               submitted_on)
+
+        if task['assignee_link']:
+            issue.set_assigned(self._get_person_from_link(task['assignee_link']))
+        else:
+            issue.set_assigned(People("nobody"))
+
+        issue.set_status(task['status'])
+        issue.set_description(bug['description'])
+        issue.set_web_link(task['web_link'])
+
+        issue.set_target_display_name(task['bug_target_display_name'])
+        issue.set_target_name(task['bug_target_name'])
+
+        for field in LP_TASK_DATES:
+            if task.get(field):
+                setter = getattr(issue, 'set_' + field)
+                setter(self.__to_datetime(task[field]))
+
+        if bug['date_last_updated']:
+            issue.set_date_last_updated(self.__to_datetime(bug['date_last_updated']))
+
+        if task['milestone_link']:
+            milestone = self._get_milestone_from_link(task['milestone_link'])
+            issue.set_milestone_code_name(milestone['code_name'])
+            if milestone['date_targeted']:
+                issue.set_milestone_data_targeted(parse(milestone['date_targeted']))
+            issue.set_milestone_name(milestone['name'])
+            issue.set_milestone_summary(milestone['summary'])
+            issue.set_milestone_title(milestone['title'])
+            issue.set_milestone_web_link(milestone['web_link'])
+
+        # Private issues are not stored, so those relationships
+        # will not be resolved
+        if bug['duplicate_of_link']:
+            dup_link = bug['duplicate_of_link']
+            temp_rel = TempRelationship(bug['id'],
+                                        unicode('duplicate_of'),
+                                        unicode(dup_link[dup_link.rfind('/') + 1:]))
+            issue.add_temp_relationship(temp_rel)
+
+        issue.set_heat(bug['heat'])
+
+        # first message of the bugs contains the description
+        messages = list(self._iter_collection(bug['messages_collection_link']))
+        for c in messages[1:]:
+            by = self._get_person_from_link(c['owner_link'])
+            com = Comment(c['content'], by, parse(c['date_created']))
+            issue.add_comment(com)
+
+        issue.set_tags(bug['tags'])
+        issue.set_title(bug['title'])
+        issue.set_users_affected_count(bug['users_affected_count'])
+        issue.set_web_link_standalone(bug['web_link'])
+
+        for entry in self._iter_collection(bug['activity_collection_link']):
+            by = self._get_person_from_link(entry['person_link'])
+            change = Change(entry['whatchanged'], entry['oldvalue'],
+                            entry['newvalue'], by,
+                            self.__to_datetime(entry['datechanged']))
+            issue.add_change(change)
+
+        for a in self._iter_collection(bug['attachments_collection_link']):
+            # author and date are stored in the comment object
+            aux = a['message_link']
+            comment = messages[int(aux[aux.rfind('/') + 1:])]
+            a_by = self._get_person_from_link(comment['owner_link'])
+            a_on = self.__to_datetime(comment['date_created'])
+
+            att = Attachment(a['data_link'], a_by, a_on)
+            att.set_name(a['title'])
+            issue.add_attachment(att)
+
+        return issue
+
+    def _get_json(self, url):
+        """
+        Retrieve the JSON representation of a resource.
+        """
+        # The browser of launchpadlib signs the requests
+        return json.loads(self.lp._browser.get(url))
+
+    def _iter_collection(self, url):
+        """
+        Iterate over the entries of a collection, requesting pages
+        of L{LP_PAGE_SIZE} entries.
+        """
+        sep = '?' in url and '&' or '?'
+        url = url + sep + urllib.urlencode({'ws.size': LP_PAGE_SIZE})
+
+        while url:
+            page = self._get_json(url)
+            for entry in page['entries']:
+                yield entry
+            url = page.get('next_collection_link')
+
+    def _get_person_from_link(self, link):
+        """
+        Return Bicho People object from the link to a Launchpad person.
+        People are retrieved once and kept in the people cache.
+        """
+        nickname = self._get_nickname_from_uri(link)
+
+        if self.bulk:
+            fetch = lambda: self._fetch_person_json(link)
+        else:
+            fetch = lambda: self._get_person(self.lp.people[nickname])
+        return self.people_cache.get(nickname, fetch)
+
+    def _fetch_person_json(self, link):
+        try:
+            lpperson = self._get_json(link)
+        except NotFound:
+            raise KeyError(link)
+
+        p = People(lpperson['name'])
+        p.set_name(lpperson['display_name'])
+        emails = lpperson.get('confirmed_email_addresses_collection_link')
+        if emails:
+            for m in self._iter_collection(emails):
+                p.set_email(m['email'])
+                break
+        return p
+
+    def _get_milestone_from_link(self, link):
+        if link not in self.milestone_links:
+            self.milestone_links[link] = self._get_json(link)
+        return self.milestone_links[link]
+
+    def _get_search_url(self, project, status, modified_since=None):
+        """
+        Return the URL of the bug tasks of X{project} ordered by
+        their last update.
+        """
+        params = [('ws.op', 'searchTasks')]
+        params.extend([('status', s) for s in status])
+        params.extend([('omit_duplicates', 'false'),
+                       ('order_by', 'date_last_updated'),
+                       ('ws.size', LP_PAGE_SIZE)])
+        if modified_since:
+            params.append(('modified_since', modified_since.isoformat()))
+        return project.self_link + '?' + urllib.urlencode(params)
+
     def __to_datetime(self, str):
         # converts str time to datetime
 
@@ -924,17 +1311,6 @@ class LPBackend(Backend):
         aux = uri.rfind('~') + 1
         return uri[aux:]
 
-    def __get_people_from_uri(self, uri):
-        # returns People object from uri (person_link)
-        try:
-            people_lp = self.lp.people[self._get_nickname_from_uri(uri)]
-            people_issue = People(people_lp.name)
-            people_issue.set_name(people_lp.display_name)
-        except KeyError:
-            # user deleted from Launchpad!
-            people_issue = People(self._get_nickname_from_uri(uri))
-        return people_issue
-
     def __get_project_from_url(self):
 
         project_name = None
@@ -957,6 +1333,12 @@ class LPBackend(Backend):
         sys.exit()
 
     def run(self):
+        try:
+            self.__retrieve()
+        finally:
+            self.people_cache.save()
+
+    def __retrieve(self):
 
         print("Running Bicho with delay of %s seconds" % (str(self.delay)))
 
@@ -990,6 +1372,11 @@ class LPBackend(Backend):
 
         last_mod_date = bugsdb.get_last_modification_date(tracker_id=dbtrk.id)
 
+        if self.bulk:
+            printdbg("Retrieving issues in bulk mode")
+            self.__run_bulk(bugsdb, dbtrk, pname, aux_status, last_mod_date)
+            return
+
         if last_mod_date:
             bugs = self.lp.projects[pname].searchTasks(status=aux_status,
                                                        omit_duplicates=False,
@@ -1008,12 +1395,17 @@ class LPBackend(Backend):
             sys.exit(0)
 
         analyzed = []
+        trk_ids = set()
 
         for bug in bugs:
 
             if bug.web_link in analyzed:
                 continue  # for the bizarre error #338
 
+            # launchpadlib sends the requests, so the rate limit
+            # is applied once per bug
+            ratelimit.wait(bug.self_link)
+
             try:
                 issue_data = self.analyze_bug(bug)
             except Exception:
@@ -1030,6 +1422,7 @@ class LPBackend(Backend):
                     aux_trk = Tracker(tr_url, "launchpad", "x.x")
                     dbtrk = bugsdb.insert_tracker(aux_trk)
                 bugsdb.insert_issue(issue_data, dbtrk.id)
+                trk_ids.add(dbtrk.id)
             except UnicodeEncodeError:
                 printerr("UnicodeEncodeError: the issue %s couldn't be stored"
                          % (issue_data.issue))
@@ -1042,15 +1435,78 @@ class LPBackend(Backend):
                 print e
 
             analyzed.append(bug.web_link)  # for the bizarre error #338
-            time.sleep(self.delay)
 
         try:
             # we read the temporary table with the relationships and create
             # the final one
-            bugsdb.store_final_relationships()
+            bugsdb.store_final_relationships(list(trk_ids))
         except:
             raise
 
         printout("Done. %s bugs analyzed" % (nbugs))
 
+    def __run_bulk(self, bugsdb, dbtrk, pname, aux_status, last_mod_date):
+        url = self.url
+        search_url = self._get_search_url(self.lp.projects[pname], aux_status,
+                                          last_mod_date)
+        printdbg("Last bug already cached: %s" % last_mod_date)
+
+        page = self._get_json(search_url)
+        nbugs = page.get('total_size')
+        if nbugs is None:
+            nbugs = self._get_json(page['total_size_link'])
+
+        if nbugs == 0:
+            printout("No bugs found. Did you provide the correct url?")
+            sys.exit(0)
+
+        analyzed = set()
+        trk_ids = set()
+
+        while page:
+            for task in page['entries']:
+                if task['web_link'] in analyzed:
+                    continue  # for the bizarre error #338
+
+                # the rate limit is applied once per bug
+                ratelimit.wait(task['self_link'])
+
+                try:
+                    issue_data = self.analyze_bug_bulk(task)
+                except Exception:
+                    printerr("Error in function analyze_bug_bulk with URL: "
+                             "%s and Bug: %s" % (url, task['web_link']))
+                    raise
+
+                try:
+                    # we can have meta-trackers but we want to have the
+                    # original tracker name
+                    tr_url = task['web_link'][:task['web_link'].rfind('+bug') - 1]
+                    if (tr_url != url):
+                        aux_trk = Tracker(tr_url, "launchpad", "x.x")
+                        dbtrk = bugsdb.insert_tracker(aux_trk)
+                    bugsdb.insert_issue(issue_data, dbtrk.id)
+                    trk_ids.add(dbtrk.id)
+                except UnicodeEncodeError:
+                    printerr("UnicodeEncodeError: the issue %s couldn't be stored"
+                             % (issue_data.issue))
+                except NotFoundError:
+                    printerr("NotFoundError: the issue %s couldn't be stored"
+                             % (issue_data.issue))
+                except Exception, e:
+                    printerr("Unexpected Error: the issue %s couldn't be stored"
+                             % (issue_data.issue))
+                    print e
+
+                analyzed.add(task['web_link'])
+
+            next_url = page.get('next_collection_link')
+            page = next_url and self._get_json(next_url)
+
+        # we read the temporary table with the relationships and create
+        # the final one
+        bugsdb.store_final_relationships(list(trk_ids))
+
+        printout("Done. %s bugs analyzed" % (nbugs))
+
 Backend.register_backend("lp", LPBackend)
@@ -21,7 +21,6 @@
 #
 
 import json
-import time
 import urllib2
 import base64
 import pprint
@@ -33,6 +32,7 @@ from storm.locals import DateTime, Desc, Int, Reference
 
 from BeautifulSoup import BeautifulSoup
 
+from bicho import httpclient
 from bicho.config import Config
 from bicho.backends import Backend
 from bicho.utils import printdbg, printout
@@ -100,12 +100,70 @@ class DBRedmineIssueExtMySQL(DBRedmineIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBRedmineIssueExtSQLite(DBRedmineIssueExt):
+    """
+    SQLite subclass of L{DBRedmineIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_redmine ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     category_id INTEGER, \
+                     done_ratio INTEGER, \
+                     due_date DATETIME, \
+                     estimated_hours INTEGER, \
+                     fixed_version_id INTEGER, \
+                     lft INTEGER, \
+                     rgt INTEGER, \
+                     lock_version INTEGER, \
+                     parent_id INTEGER, \
+                     project_id INTEGER, \
+                     root_id INTEGER, \
+                     start_date DATETIME, \
+                     tracker_id INTEGER, \
+                     updated_on DATETIME, \
+                     issue_id INTEGER \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_ext_redmine_ext_issue_idx ON issues_ext_redmine (issue_id);',
+    )
+
+
+class DBRedmineIssueExtPostgreSQL(DBRedmineIssueExt):
+    """
+    PostgreSQL subclass of L{DBRedmineIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_redmine ( \
+                     id SERIAL PRIMARY KEY, \
+                     category_id INTEGER, \
+                     done_ratio INTEGER, \
+                     due_date TIMESTAMP, \
+                     estimated_hours INTEGER, \
+                     fixed_version_id INTEGER, \
+                     lft INTEGER, \
+                     rgt INTEGER, \
+                     lock_version INTEGER, \
+                     parent_id INTEGER, \
+                     project_id INTEGER, \
+                     root_id INTEGER, \
+                     start_date TIMESTAMP, \
+                     tracker_id INTEGER, \
+                     updated_on TIMESTAMP, \
+                     issue_id INTEGER \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_ext_redmine_ext_issue_idx ON issues_ext_redmine (issue_id);',
+    )
+
+
 class DBRedmineBackend(DBBackend):
     """
     Adapter for Redmine backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBRedmineIssueExtMySQL]
+        self.SQLITE_EXT = [DBRedmineIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBRedmineIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
 
@@ -214,7 +272,7 @@ class Redmine():
     def _get_statuses(self):
         root = self._get_redmine_root(Config.url)
         statuses_url = root + "issue_statuses.json"
-        f = urllib2.urlopen(statuses_url)
+        f = httpclient.urlopen(statuses_url)
         statuses = json.loads(f.read())
 
         for status in statuses["issue_statuses"]:
@@ -230,7 +288,7 @@ class Redmine():
         #print author_url
         identity = None
         try:
-            f = urllib2.urlopen(author_url)
+            f = httpclient.urlopen(author_url)
             person = json.loads(f.read())
             identity = person['user']['mail']
         except (urllib2.HTTPError, KeyError):
@@ -345,7 +403,7 @@ class Redmine():
         issue_url = self._get_issue_url(issue_id)
 
         printdbg("Analyzing issue journals " + issue_url)
-        f = urllib2.urlopen(issue_url)
+        f = httpclient.urlopen(issue_url)
         data = json.loads(f.read())
         journals = data["issue"]["journals"]
 
@@ -439,7 +497,7 @@ class Redmine():
         # Get statuses
         self._get_statuses()
 
-        f = urllib2.urlopen(request)
+        f = httpclient.urlopen(request)
         tickets = json.loads(f.read())
 
         if not tickets["issues"]:
@@ -449,7 +507,6 @@ class Redmine():
         for ticket in tickets["issues"]:
             issue = self.analyze_bug(ticket)
             bugsdb.insert_issue(issue, dbtrk.id)
-            time.sleep(self.delay)
 
         last_ticket = tickets["issues"][0]['id']
 
@@ -459,7 +516,7 @@ class Redmine():
             request = urllib2.Request(url)
             #base64string = base64.encodestring('%s:%s' % (Config.backend_user, Config.backend_password)).replace('\n', '')
             #request.add_header("Authorization", "Basic %s" % base64string)
-            f = urllib2.urlopen(request)
+            f = httpclient.urlopen(request)
             tickets = json.loads(f.read())
 
             if len(tickets['issues']) == 0:
@@ -473,8 +530,8 @@ class Redmine():
             for ticket in tickets["issues"]:
                 issue = self.analyze_bug(ticket)
                 bugsdb.insert_issue(issue, dbtrk.id)
-                time.sleep(self.delay)
 
+        bugsdb.flush_issues()
         pprint.pprint("Total pages: " + str(last_page))
 
         printout("Done. Bugs analyzed:" + str(last_page * tickets_page))
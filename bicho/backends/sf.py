@@ -29,7 +29,6 @@ import re
 import urlparse
 import urllib2
 import sys
-import time
 
 import BeautifulSoup
 from storm.locals import Int, Unicode, Reference
@@ -37,6 +36,7 @@ from storm.locals import Int, Unicode, Reference
 from bicho.common import Issue, People, Tracker, Comment, Attachment, Change
 from bicho.backends import Backend
 from bicho.db.database import DBIssue, DBBackend, get_database
+from bicho import httpclient
 from bicho.config import Config
 from bicho.utils import printdbg, printout, printerr
 
@@ -163,12 +163,42 @@ class DBSourceForgeIssueExtMySQL(DBSourceForgeIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBSourceForgeIssueExtSQLite(DBSourceForgeIssueExt):
+    """
+    SQLite subclass of L{DBSourceForgeIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_sf ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     category VARCHAR(32) NOT NULL, \
+                     group_sf VARCHAR(32) NOT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id) \
+                     );'
+
+
+class DBSourceForgeIssueExtPostgreSQL(DBSourceForgeIssueExt):
+    """
+    PostgreSQL subclass of L{DBSourceForgeIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_sf ( \
+                     id SERIAL PRIMARY KEY, \
+                     category VARCHAR(32) NOT NULL, \
+                     group_sf VARCHAR(32) NOT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id) \
+                     );'
+
+
 class DBSourceForgeBackend(DBBackend):
     """
     Adapter for SourceForge backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBSourceForgeIssueExtMySQL]
+        self.SQLITE_EXT = [DBSourceForgeIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBSourceForgeIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -640,8 +670,7 @@ class SourceForge():
             issue = self.__get_issue(url)
             self.__insert_issue(issue)
 
-            time.sleep(self.delay)
-
+        self.db.flush_issues()
         printout("Done. %s bugs analyzed" % (nbugs))
 
     def __get_issues_list(self, url):
@@ -684,7 +713,7 @@ class SourceForge():
     def __get_html(self, url):
         """
         """
-        html = urllib2.urlopen(url).read()
+        html = httpclient.urlopen(url).read()
         return html
 
     def __check_tracker_url(self, url):
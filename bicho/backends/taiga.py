@@ -19,6 +19,7 @@
 # Authors:  Alvaro del Castillo <acs@bitergia.com>
 #
 
+from bicho import httpclient
 from bicho.config import Config
 
 from bicho.backends import Backend
@@ -91,12 +92,58 @@ class DBTaigaIssueExtMySQL(DBTaigaIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBTaigaIssueExtSQLite(DBTaigaIssueExt):
+    """
+    SQLite subclass of L{DBTaigaIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_taigaTickets ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     tags TEXT, \
+                     type TEXT, \
+                     version TEXT, \
+                     project TEXT, \
+                     milestone TEXT, \
+                     comment TEXT, \
+                     finished_date DATETIME, \
+                     mod_date DATETIME, \
+                     issue_id INTEGER NOT NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_ext_taigaTickets_ext_issue_idx ON issues_ext_taigaTickets (issue_id);',
+    )
+
+
+class DBTaigaIssueExtPostgreSQL(DBTaigaIssueExt):
+    """
+    PostgreSQL subclass of L{DBTaigaIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_taigaTickets ( \
+                     id SERIAL PRIMARY KEY, \
+                     tags TEXT, \
+                     type TEXT, \
+                     version TEXT, \
+                     project TEXT, \
+                     milestone TEXT, \
+                     comment TEXT, \
+                     finished_date TIMESTAMP, \
+                     mod_date TIMESTAMP, \
+                     issue_id INTEGER NOT NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_ext_taigaTickets_ext_issue_idx ON issues_ext_taigaTickets (issue_id);',
+    )
+
+
 class DBTaigaBackend(DBBackend):
     """
     Adapter for Taiga backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBTaigaIssueExtMySQL]
+        self.SQLITE_EXT = [DBTaigaIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBTaigaIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
 
@@ -194,7 +241,7 @@ class Taiga():
         # changes
         url_issue = url + str(issue_data["id"])
         request = urllib2.Request(url_issue, headers={"Authorization":"Bearer " + auth_token})
-        f = urllib2.urlopen(request)
+        f = httpclient.urlopen(request)
         changes = json.loads(f.read())
         for change in changes:
             c = self.parse_change(change)
@@ -290,6 +337,7 @@ class Taiga():
             except UnicodeEncodeError:
                 logging.error("UnicodeEncodeError: the issue %s couldn't be stored"
                          % (issue_data.issue))
+        bugsdb.flush_issues()
         return nitems
 
 
@@ -334,7 +382,7 @@ class Taiga():
         # Get users info in order to change identifiers with real names
         try:
             request = urllib2.Request(self.url_users, headers=headers)
-            f = urllib2.urlopen(request)
+            f = httpclient.urlopen(request)
             users = json.loads(f.read())
             self.users = users
         except urllib2.HTTPError:
@@ -343,13 +391,13 @@ class Taiga():
 
         # Now we need issues, tasks and user stories
         request = urllib2.Request(self.url_issues, headers=headers)
-        f = urllib2.urlopen(request)
+        f = httpclient.urlopen(request)
         issues = json.loads(f.read())
         request = urllib2.Request(self.url_tasks, headers=headers)
-        f = urllib2.urlopen(request)
+        f = httpclient.urlopen(request)
         tasks = json.loads(f.read())
         request = urllib2.Request(self.url_userstories, headers=headers)
-        f = urllib2.urlopen(request)
+        f = httpclient.urlopen(request)
         userstories = json.loads(f.read())
 
 
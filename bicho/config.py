@@ -115,6 +115,16 @@ class Config():
         instance, invoking the Launchpad backend uses 'lp', and so the filename
         is 'lp.py'.
         """
+        if getattr(Config, 'db_upgrade', False):
+            # Upgrading the database does not need any tracker
+            Config.check_output_db()
+            return
+
+        if getattr(Config, 'jobs', None):
+            # Trackers are given by the jobs file
+            Config.check_output_db()
+            return
+
         Config.check_params(['url', 'backend'])
 
         if Config.backend + ".py" not in Backend.get_all_backends():
@@ -140,9 +150,33 @@ class Config():
                                  'db_password_in', 'db_hostname_in',
                                  'db_port_in', 'db_database_in'])
         if getattr(Config, 'output', None) == 'db':
+            Config.check_output_db()
+
+    @staticmethod
+    def check_output_db():
+        """
+        Check the options of the output database. SQLite databases
+        only need the path of the file.
+        """
+        if getattr(Config, 'db_driver_out', None) == 'sqlite':
+            Config.check_params(['db_database_out'])
+        else:
             Config.check_params(['db_driver_out', 'db_user_out',
                                  'db_password_out', 'db_hostname_out',
                                  'db_port_out', 'db_database_out'])
+        Config.check_logtable(getattr(Config, 'logtable', False),
+                              getattr(Config, 'db_driver_out', None))
+
+    @staticmethod
+    def check_logtable(logtable, driver):
+        """
+        Check that the issues log tables can be generated on the output
+        database. They are only created on MySQL databases.
+        """
+        if logtable and driver in ('sqlite', 'postgresql'):
+            raise InvalidConfig('The issues log table (--logtable) is not '
+                                'supported by the %s database driver'
+                                % driver)
 
     @staticmethod
     def clean_empty_options(options):
@@ -161,17 +195,12 @@ class Config():
         return clean_opt
 
     @staticmethod
-    def set_config_options(usage):
+    def create_parser():
         """
-        Take command-line arguments and options from the configuration file.
-
-        Command-line keyword arguments only, not positional -- breaking
-        change November 2013.
+        Create the parser of the command-line options.
 
-        In case of conflict, command-line options are meant to override
-        options specified in config file.
+        @rtype: L{argparse.ArgumentParser}
         """
-
         parser = ArgumentParser(description=info.DESCRIPTION)
         parser.add_argument('--version', action='version', version=info.VERSION)
 
@@ -189,15 +218,56 @@ class Config():
                             default='5')
         parser.add_argument('-g', '--debug', action='store_true', dest='debug',
                             help='Enable debug mode', default=False)
+        parser.add_argument('--bg-history-api', action='store_true',
+                            dest='bg_history_api',
+                            help='Retrieve the changes of the issues using ' +
+                            'the Bug.history web service (Bugzilla >= 4.4)',
+                            default=False)
+        parser.add_argument('--lp-bulk-fetch', action='store_true',
+                            dest='lp_bulk_fetch',
+                            help='Retrieve Launchpad collections in pages ' +
+                            'of 300 entries and each person only once ' +
+                            '(lp backend)',
+                            default=False)
+        parser.add_argument('--lp-people-cache', dest='lp_people_cache',
+                            nargs='?', const='',
+                            help='File where Launchpad people are saved ' +
+                            'between runs. Defaults to ' +
+                            '~/.bicho/cache/launchpad-people.json when ' +
+                            'no file is given (lp backend)',
+                            default=None)
+        parser.add_argument('--github-bulk-fetch', action='store_true',
+                            dest='github_bulk_fetch',
+                            help='Retrieve the comments and events of the ' +
+                            'whole repository instead of requesting them ' +
+                            'for each issue (github backend)',
+                            default=False)
+        parser.add_argument('--github-graphql', action='store_true',
+                            dest='github_graphql',
+                            help='Retrieve the issues with their comments ' +
+                            'and events using the GraphQL API. The ' +
+                            'backend password must be a token ' +
+                            '(github backend)',
+                            default=False)
         parser.add_argument('--gerrit-project', dest='gerrit_project',
                             help='Project to be analyzed (gerrit backend)',
                             default=None)
+        parser.add_argument('--gerrit-rest', dest='gerrit_rest',
+                            nargs='?', const='',
+                            help='Retrieve the reviews from the REST API ' +
+                            'at this URL, by time windows fetched by the ' +
+                            'workers. Defaults to https://<url> when no ' +
+                            'URL is given (gerrit backend)',
+                            default=None)
         parser.add_argument('-i', '--input', choices=['url', 'db'],
                             dest='input', help='Input format', default='url')
         parser.add_argument('-o', '--output', choices=['db'],
                             dest='output', help='Output format', default='db')
-        parser.add_argument('-p', '--path', dest='path',
-                            help='Path where downloaded URLs will be stored',
+        parser.add_argument('-p', '--path', dest='path', nargs='?', const='',
+                            help='Path where downloaded URLs will be stored. '
+                            'Unchanged URLs are not downloaded again. '
+                            'Defaults to ~/.bicho/cache/http when no '
+                            'path is given',
                             default=None)
         parser.add_argument('-u', '--url', dest='url',
                             help='URL to get issues from using the backend',
@@ -209,6 +279,28 @@ class Config():
         parser.add_argument('-n', '--num-issues', type=int, dest='nissues',
                             help='Number of issues requested on each query',
                             default=MAX_ISSUES_PER_QUERY)
+        parser.add_argument('--workers', type=int, dest='workers',
+                            help='Number of concurrent fetch workers ' +
+                            '(bg and gerrit backends)',
+                            default=1)
+        parser.add_argument('--rate', type=float, dest='rate',
+                            help='Requests per second sent to each host ' +
+                            '(default: the requests of an issue every delay seconds)',
+                            default=None)
+        parser.add_argument('--burst', type=int, dest='burst',
+                            help='Requests sent at once to a host after being idle',
+                            default=1)
+        parser.add_argument('--jobs', dest='jobs',
+                            help='Crawl the trackers listed in this file. ' +
+                            'Each line has a backend, a URL and other options',
+                            default=None)
+        parser.add_argument('--jobs-processes', type=int, dest='jobs_processes',
+                            help='Number of trackers crawled at the same time',
+                            default=4)
+        parser.add_argument('--jobs-per-host', type=int, dest='jobs_per_host',
+                            help='Number of trackers of the same host ' +
+                            'crawled at the same time',
+                            default=1)
 
         # Options for output database
         group = parser.add_argument_group('Output database specific options')
@@ -227,7 +319,17 @@ class Config():
                            help='Port of the host where database server is running',
                            default='3306')
         group.add_argument('--db-database-out', dest='db_database_out',
-                           help='Output database name', default=None)
+                           help='Output database name (path of the file for sqlite)',
+                           default=None)
+        group.add_argument('--db-batch-size', type=int, dest='db_batch_size',
+                           help='Number of issues written on each database transaction',
+                           default=None)
+        group.add_argument('--db-people-cache', type=int, dest='db_people_cache',
+                           help='Number of identities kept in memory',
+                           default=100000)
+        group.add_argument('--db-upgrade', action='store_true', dest='db_upgrade',
+                           help='Upgrade the tables of the output database and exit',
+                           default=False)
 
         # Options for input database
         group = parser.add_argument_group('Input database specific options')
@@ -248,6 +350,20 @@ class Config():
         group.add_argument('--db-database-in', dest='db_database_in',
                            help='Input database name', default=None)
 
+        return parser
+
+    @staticmethod
+    def set_config_options(usage):
+        """
+        Take command-line arguments and options from the configuration file.
+
+        Command-line keyword arguments only, not positional -- breaking
+        change November 2013.
+
+        In case of conflict, command-line options are meant to override
+        options specified in config file.
+        """
+        parser = Config.create_parser()
         args = parser.parse_args()
 
         if args.cfgfile is not None:  # if a config file was specified on the command line
@@ -25,14 +25,45 @@ Database module
 """
 
 import datetime
+import hashlib
+import json
+
+from collections import OrderedDict
 
 from storm.exceptions import IntegrityError # DatabaseError,
-from storm.locals import DateTime, Int, Reference, Unicode
+from storm.locals import DateTime, Int, Reference, Unicode, Store, \
+    create_database
 
-from bicho.utils import printdbg
+from bicho.utils import printdbg, printout, printerr, LRUCache
 from bicho.config import Config
 
 
+def get_fingerprint(*values):
+    """
+    Return a SHA-1 fingerprint of the given values.
+
+    Dates are truncated to seconds, the precision of DATETIME columns,
+    so the fingerprint of a stored row can be computed again from
+    the database values.
+
+    @return: hexadecimal digest
+    @rtype: C{unicode}
+    """
+    sha1 = hashlib.sha1()
+    for value in values:
+        if value is None:
+            value = u''
+        elif isinstance(value, datetime.datetime):
+            value = value.strftime('%Y-%m-%d %H:%M:%S')
+        elif not isinstance(value, basestring):
+            value = unicode(value)
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        sha1.update(value)
+        sha1.update('\0')
+    return unicode(sha1.hexdigest())
+
+
 class NotFoundError(Exception):
     """
     Exception raised when an entry is not found into the database.
@@ -47,26 +78,152 @@ class NotFoundError(Exception):
         return repr(self.msg)
 
 
+# Maximum number of rows sent on each multi-row INSERT statement.
+# It keeps the statements under the default max_allowed_packet.
+MAX_ROWS_PER_INSERT = 500
+
+# Default number of issues written on each transaction
+BATCH_SIZE = 1
+
+# Default number of identities kept in memory
+PEOPLE_CACHE_SIZE = 100000
+
+# Connections opened by this process, by URI, when they are shared.
+# See share_connections().
+_shared_connections = None
+
+
+def share_connections():
+    """
+    Reuse the connections of this process.
+
+    Databases created after calling this function use the connection
+    opened by the first database with the same URI, and tables are
+    only created once per connection. Used by processes that crawl
+    several trackers.
+    """
+    global _shared_connections
+    if _shared_connections is None:
+        _shared_connections = {}
+
+
+def rollback_shared_connections():
+    """
+    Roll back the shared connections, discarding the changes left
+    by a failed crawl.
+    """
+    for database, store, created_tables in (_shared_connections or {}).values():
+        store.rollback()
+
+
+class OutdatedDatabaseError(Exception):
+    """
+    Exception raised when the database was created by an older
+    version of Bicho and it has to be upgraded.
+
+    @param msg: explanation of the error
+    @type msg: C{str}
+    """
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return repr(self.msg)
+
+
 class DBDatabase:
     """
     """
+    # Number of issues inserted by this process
+    total_issues = 0
+
+    # Maximum number of parameters of a statement, None when
+    # the database does not limit it
+    MAX_PARAMS = None
+
+    # Expression that converts an integer column into a string
+    SQL_INT_TO_STR = 'CAST(%s AS CHAR)'
+
     def __init__(self, backend=None):
         self.database = None
         self.store = None
         self.backend = backend
+        self.created_tables = set()
+
+        # Bulk write mode. When the batch size is greater than one,
+        # issues are queued and written every X{batch_size} issues
+        # using multi-row INSERT statements and one commit per batch.
+        self.batch_size = getattr(Config, 'db_batch_size', None) or \
+            self.default_batch_size()
+        self.pending_issues = OrderedDict()
+
+        # Identities cache, maps user_id to people.id
+        cache_size = getattr(Config, 'db_people_cache', None) or \
+            PEOPLE_CACHE_SIZE
+        self.people_cache = LRUCache(cache_size)
+        self.uncommitted_people = []
+
+    def connect(self, uri):
+        """
+        Open the connection to the database.
+
+        When connections are shared, the connection already opened
+        for X{uri} is used.
+
+        @param uri: URI of the database
+        @type uri: C{str}
+
+        @return: C{True} when a new connection was opened
+        @rtype: C{bool}
+        """
+        if _shared_connections is not None and uri in _shared_connections:
+            self.database, self.store, self.created_tables = \
+                _shared_connections[uri]
+            return False
+
+        self.database = create_database(uri)
+        self.store = Store(self.database)
+        if _shared_connections is not None:
+            _shared_connections[uri] = (self.database, self.store,
+                                        self.created_tables)
+        return True
 
     def create_tables(self, clsl):
         """
         Create the database tables.
 
         SQL query with the structure of each table is stored into
-        X{__sql_table__} attribute of database classes.
+        X{__sql_table__} attribute of database classes. Databases
+        that do not support inline indexes store the queries to
+        create them into X{__sql_indexes__}.
 
         @param clsl: a list of database classes
         @type clsl: C{list} of L{object}
         """
         for c in clsl:
+            if c in self.created_tables:
+                continue
             self.store.execute(c.__sql_table__)
+            for index in getattr(c, '__sql_indexes__', ()):
+                self.store.execute(index)
+            self.created_tables.add(c)
+
+    def default_batch_size(self):
+        """
+        Number of issues written on each transaction when it is not
+        set in the configuration.
+        """
+        return BATCH_SIZE
+
+    def load_people_cache(self):
+        """
+        Warm up the identities cache with the identities stored
+        in the database.
+        """
+        result = self.store.find((DBPeople.user_id, DBPeople.id))
+        for user_id, people_id in result[:self.people_cache.size]:
+            self.people_cache.set(user_id, people_id)
+        printdbg("%s identities loaded in cache" % len(self.people_cache))
 
     def insert_supported_traker(self, name, version):
         """
@@ -85,6 +242,8 @@ class DBDatabase:
             self.store.add(db_sup)
             self.store.commit()
         except:
+            # Release the locks taken by the failed insert
+            self._rollback()
             db_sup = self._get_db_supported_tracker(name, version)
         return db_sup
 
@@ -109,6 +268,7 @@ class DBDatabase:
             self.store.add(db_tracker)
             self.store.commit()
         except:
+            self._rollback()
             db_tracker = self._get_db_tracker(tracker.url)
             db_tracker.retrieved_on = datetime.datetime.now()
             self.store.commit()
@@ -121,18 +281,103 @@ class DBDatabase:
         @param people: identity to insert
         @type people: L{People}
 
-        @return: the inserted identity
-        @rtype: L{People}
+        @return: identifier of the identity
+        @rtype: C{int}
         """
+        people_id = self.people_cache.get(unicode(people.user_id))
+        if people_id is not None:
+            return people_id
+
+        # Pending changes are committed first, so they are not lost
+        # when the insert fails
+        self._commit()
         try:
             db_people = DBPeople(people.user_id)
             db_people.set_name(people.name)
             db_people.set_email(people.email)
             self.store.add(db_people)
-            self.store.commit()
+            self._commit()
         except IntegrityError:
+            # Stored by another process. PostgreSQL aborts the
+            # transaction on errors, so it must be rolled back
+            # before looking for the identity
+            self._rollback()
             db_people = self._get_db_people(people.user_id)
-        return db_people
+        self.people_cache.set(db_people.user_id, db_people.id)
+        return db_people.id
+
+    def get_people_id(self, people):
+        """
+        Return the identifier of the given identity, inserting it
+        when it is not stored yet. Identities found in the cache
+        do not hit the database.
+
+        @param people: identity
+        @type people: L{People}
+
+        @return: identifier of the identity
+        @rtype: C{int}
+        """
+        return self.insert_people(people)
+
+    def insert_people_batch(self, people):
+        """
+        Insert the given identities not found in the cache using
+        multi-row INSERT statements. Changes are not committed.
+
+        @param people: identities to insert
+        @type people: C{list} of L{People}
+        """
+        missing = OrderedDict()
+        for p in people:
+            user_id = unicode(p.user_id)
+            if user_id not in self.people_cache and user_id not in missing:
+                missing[user_id] = p
+
+        if not missing:
+            return
+
+        # Some of them could have been stored by another process
+        # or evicted from the cache
+        for user_id, people_id in self._get_db_people_ids(missing.keys()):
+            self.people_cache.set(user_id, people_id)
+            del missing[user_id]
+
+        rows = [(user_id, unicode(p.name), unicode(p.email))
+                for user_id, p in missing.items()]
+        self._bulk_insert('people', ('user_id', 'name', 'email'), rows)
+
+        for user_id, people_id in self._get_db_people_ids(missing.keys()):
+            self.people_cache.set(user_id, people_id)
+            self.uncommitted_people.append(user_id)
+
+    def _get_db_people_ids(self, user_ids):
+        """
+        Return the pairs of user_id and identifier of the given identities.
+        """
+        result = []
+        for i in range(0, len(user_ids), MAX_ROWS_PER_INSERT):
+            chunk = user_ids[i:i + MAX_ROWS_PER_INSERT]
+            result.extend(self.store.find((DBPeople.user_id, DBPeople.id),
+                                          DBPeople.user_id.is_in(chunk)))
+        return result
+
+    def _commit(self):
+        """
+        Commit the current transaction.
+        """
+        self.store.commit()
+        self.uncommitted_people = []
+
+    def _rollback(self):
+        """
+        Roll back the current transaction, removing from the cache
+        the identities inserted during it.
+        """
+        self.store.rollback()
+        for user_id in self.uncommitted_people:
+            self.people_cache.remove(user_id)
+        self.uncommitted_people = []
 
     def insert_issue(self, issue, tracker_id):
         """
@@ -143,9 +388,22 @@ class DBDatabase:
         @param tracker_id: identifier of the tracker
         @type tracker_id: C{int}
 
-        @return: the inserted issue
+        @return: the inserted issue or C{None} when the issue was
+         queued to be written in bulk mode
         @rtype: L{DBIssue}
         """
+        DBDatabase.total_issues += 1
+
+        if self.batch_size > 1:
+            # The last version of an issue retrieved on the same batch
+            # replaces the older ones
+            key = (tracker_id, unicode(issue.issue))
+            self.pending_issues.pop(key, None)
+            self.pending_issues[key] = issue
+
+            if len(self.pending_issues) >= self.batch_size:
+                self.flush_issues()
+            return None
 
         newIssue = False;
 
@@ -164,13 +422,13 @@ class DBDatabase:
             db_issue.status = unicode(issue.status)
             db_issue.resolution = unicode(issue.resolution)
             db_issue.priority = unicode(issue.priority)
-            db_issue.submitted_by = self.insert_people(issue.submitted_by).id
+            db_issue.submitted_by = self.get_people_id(issue.submitted_by)
 
 
             db_issue.submitted_on = issue.submitted_on
 
             if issue.assigned_to is not None:
-                db_issue.assigned_to = self.insert_people(issue.assigned_to).id
+                db_issue.assigned_to = self.get_people_id(issue.assigned_to)
 
             #if issue is new, we add to the data base before the flush()
             if newIssue == True:
@@ -182,46 +440,62 @@ class DBDatabase:
             if self.backend is not None:
                 self.backend.insert_issue_ext(self.store, issue, db_issue.id)
 
+            # Load the children already stored, one query per table.
+            # A new issue has none.
+            if newIssue:
+                comments, attachments, changes, watchers = \
+                    set(), set(), set(), set()
+            else:
+                issue_ids = [db_issue.id]
+                comments = self._get_db_comments_keys(issue_ids)
+                attachments = self._get_db_attachments_keys(issue_ids)
+                changes = self._get_db_changes_keys(issue_ids)
+                watchers = self._get_db_watchers_keys(issue_ids)
+            temp_rels = self._get_db_temp_rels_keys(
+                [trel.issue for trel in issue.temp_relationships])
+
             # Insert temporal relationships
             for trel in issue.temp_relationships:
-                db_trel = self._get_db_temp_rel(trel, db_issue.id)
-                if db_trel == -1:
+                key = self._temp_rel_key(trel, tracker_id)
+                if key not in temp_rels:
+                    temp_rels.add(key)
                     db_trel = self._insert_temp_rel(trel, db_issue.id, tracker_id)
                     if self.backend is not None:
                         self.backend.insert_temp_rel(self.store, trel, db_trel, tracker_id)
 
             # Insert comments
             for comment in issue.comments:
-                db_comment = self._get_db_comment(comment, db_issue.id, tracker_id)
-                if db_comment == -1:
+                key = self._comment_key(comment, db_issue.id)
+                if key not in comments:
+                    comments.add(key)
                     db_comment = self._insert_comment(comment, db_issue.id, tracker_id)
                     if self.backend is not None:
                         self.backend.insert_comment_ext(self.store, comment, db_comment.id)
 
             # Insert attachments
             for attachment in issue.attachments:
-                db_attch = self._get_db_attachment(attachment, db_issue.id, tracker_id)
-                if db_attch == -1:
+                key = self._attachment_key(attachment, db_issue.id)
+                if key not in attachments:
+                    attachments.add(key)
                     db_attch = self._insert_attachment(attachment, db_issue.id, tracker_id)
                     if self.backend is not None:
                         self.backend.insert_attachment_ext(self.store, attachment, db_attch.id)
 
             # Insert changes
             for change in issue.changes:
-                db_change = self._get_db_change(change, db_issue.id, tracker_id)
-                if db_change == -1:
+                key = self._change_key(change, db_issue.id)
+                if key not in changes:
+                    changes.add(key)
                     db_change = self._insert_change(change, db_issue.id, tracker_id)
                     if self.backend is not None:
                         self.backend.insert_change_ext(self.store, change, db_change.id)
 
             # Insert CC/watchers
             for person in issue.watchers:
-                try:
-                    #db_issues_watchers = self._insert_issues_watchers(person, db_issue.id,
-                    #                                                  tracker_id)
+                key = (db_issue.id, self.get_people_id(person))
+                if key not in watchers:
+                    watchers.add(key)
                     self._insert_issues_watchers(person, db_issue.id, tracker_id)
-                except:
-                    None
 
             self.store.commit()
 
@@ -230,10 +504,389 @@ class DBDatabase:
             self.store.rollback()
             raise
 
+    def flush_issues(self):
+        """
+        Write the issues queued in bulk mode.
+
+        Issues and their extra data are stored one by one but comments,
+        attachments, changes, temporal relationships and watchers are
+        written using multi-row INSERT statements. Children already
+        stored are filtered out in memory using the same criteria
+        than L{_get_db_comment}, L{_get_db_change}, L{_get_db_attachment}
+        and L{_get_db_temp_rel}. The whole batch is committed at once.
+
+        When the batch fails, its issues are written again one by one,
+        so only the issues that cannot be stored are lost. Their errors
+        are reported and they are skipped, as the backends do with the
+        issues they cannot retrieve.
+        """
+        if not self.pending_issues:
+            return
+
+        pending = self.pending_issues.items()
+        self.pending_issues = OrderedDict()
+
+        if len(pending) > 1:
+            try:
+                self._write_issues_batch(pending)
+                return
+            except Exception, e:
+                printdbg("Error writing a batch of %s issues, writing them "
+                         "one by one: %s" % (len(pending), e))
+
+        for key, issue in pending:
+            try:
+                self._write_issues_batch([(key, issue)])
+            except Exception, e:
+                printerr("Error storing issue %s: %s" % (issue.issue, e))
+
+    def _write_issues_batch(self, pending):
+        """
+        Write and commit the given issues, rolling back on errors.
+
+        @param pending: pairs of (tracker_id, issue identifier) keys
+         and issues to store
+        @type pending: C{list} of C{tuple}
+        """
+        try:
+            self.insert_people_batch(self._get_issues_people(
+                [issue for key, issue in pending]))
+            db_issues = self._store_issues_batch(pending)
+            issue_ids = [db_issue.id for db_issue, issue in db_issues]
+
+            comments = self._get_db_comments_keys(issue_ids)
+            attachments = self._get_db_attachments_keys(issue_ids)
+            changes = self._get_db_changes_keys(issue_ids)
+            watchers = self._get_db_watchers_keys(issue_ids)
+            temp_rels = self._get_db_temp_rels_keys(
+                [trel.issue for db_issue, issue in db_issues
+                 for trel in issue.temp_relationships])
+
+            comment_rows = []
+            attachment_rows = []
+            change_rows = []
+            watcher_rows = []
+            temp_rel_rows = []
+
+            for db_issue, issue in db_issues:
+                issue_id = db_issue.id
+                tracker_id = db_issue.tracker_id
+
+                for trel in issue.temp_relationships:
+                    key = self._temp_rel_key(trel, tracker_id)
+                    if key in temp_rels:
+                        continue
+                    temp_rels.add(key)
+                    if self._has_child_ext():
+                        db_trel = self._insert_temp_rel(trel, issue_id, tracker_id)
+                        self.backend.insert_temp_rel(self.store, trel, db_trel, tracker_id)
+                    else:
+                        temp_rel_rows.append(key)
+
+                for comment in issue.comments:
+                    key = self._comment_key(comment, issue_id)
+                    if key in comments:
+                        continue
+                    comments.add(key)
+                    if self._has_child_ext():
+                        db_comment = self._insert_comment(comment, issue_id, tracker_id)
+                        self.backend.insert_comment_ext(self.store, comment, db_comment.id)
+                    else:
+                        submitted_by = self.get_people_id(comment.submitted_by)
+                        comment_rows.append((issue_id, unicode(comment.comment),
+                                             submitted_by, comment.submitted_on,
+                                             key[1]))
+
+                for attachment in issue.attachments:
+                    key = self._attachment_key(attachment, issue_id)
+                    if key in attachments:
+                        continue
+                    attachments.add(key)
+                    if self._has_child_ext():
+                        db_attch = self._insert_attachment(attachment, issue_id, tracker_id)
+                        self.backend.insert_attachment_ext(self.store, attachment, db_attch.id)
+                    else:
+                        if attachment.submitted_by is not None:
+                            submitted_by = self.get_people_id(attachment.submitted_by)
+                        else:
+                            submitted_by = None
+                        attachment_rows.append((issue_id, unicode(attachment.name),
+                                                unicode(attachment.description),
+                                                unicode(attachment.url),
+                                                submitted_by,
+                                                attachment.submitted_on,
+                                                key[1]))
+
+                for change in issue.changes:
+                    key = self._change_key(change, issue_id)
+                    if key in changes:
+                        continue
+                    changes.add(key)
+                    if self._has_child_ext():
+                        db_change = self._insert_change(change, issue_id, tracker_id)
+                        self.backend.insert_change_ext(self.store, change, db_change.id)
+                    else:
+                        changed_by = self.get_people_id(change.changed_by)
+                        change_rows.append((issue_id, unicode(change.field),
+                                            unicode(change.old_value),
+                                            unicode(change.new_value),
+                                            changed_by, change.changed_on,
+                                            key[1]))
+
+                for person in issue.watchers:
+                    key = (issue_id, self.get_people_id(person))
+                    if key in watchers:
+                        continue
+                    watchers.add(key)
+                    watcher_rows.append(key)
+
+            self._bulk_insert('temp_related_to',
+                              ('issue_id', 'type', 'related_to', 'tracker_id'),
+                              temp_rel_rows)
+            self._bulk_insert('comments',
+                              ('issue_id', 'text', 'submitted_by', 'submitted_on',
+                               'fingerprint'),
+                              comment_rows)
+            self._bulk_insert('attachments',
+                              ('issue_id', 'name', 'description', 'url',
+                               'submitted_by', 'submitted_on', 'fingerprint'),
+                              attachment_rows)
+            self._bulk_insert('changes',
+                              ('issue_id', 'field', 'old_value', 'new_value',
+                               'changed_by', 'changed_on', 'fingerprint'),
+                              change_rows)
+            self._bulk_insert('issues_watchers',
+                              ('issue_id', 'person_id'),
+                              watcher_rows)
+
+            self._commit()
+            printdbg("%s issues stored in bulk mode" % len(db_issues))
+        except:
+            self._rollback()
+            raise
+
+    def _get_issues_people(self, issues):
+        """
+        Return the identities referenced by the given issues.
+        """
+        people = []
+        for issue in issues:
+            people.append(issue.submitted_by)
+            if issue.assigned_to is not None:
+                people.append(issue.assigned_to)
+            people.extend([c.submitted_by for c in issue.comments])
+            people.extend([a.submitted_by for a in issue.attachments
+                           if a.submitted_by is not None])
+            people.extend([c.changed_by for c in issue.changes])
+            people.extend(issue.watchers)
+        return people
+
+    def _store_issues_batch(self, issues):
+        """
+        Insert or update the given issues and their extra data.
+
+        Issues already stored are retrieved with a single query
+        for each tracker.
+
+        @param issues: pairs of (tracker_id, issue identifier) keys
+         and issues to store
+        @type issues: C{list} of C{tuple}
+
+        @return: pairs of stored issues and their source issues
+        @rtype: C{list} of C{tuple}
+        """
+        stored = {}
+        trackers = {}
+        for key, issue in issues:
+            trackers.setdefault(key[0], []).append(key[1])
+
+        for tracker_id, ids in trackers.items():
+            result = self.store.find(DBIssue,
+                                     DBIssue.tracker_id == tracker_id,
+                                     DBIssue.issue.is_in(ids))
+            for db_issue in result:
+                stored[(tracker_id, db_issue.issue)] = db_issue
+
+        db_issues = []
+        for key, issue in issues:
+            db_issue = stored.get(key)
+            if db_issue is None:
+                db_issue = DBIssue(issue.issue, key[0])
+                self.store.add(db_issue)
+
+            db_issue.type = unicode(issue.type)
+            db_issue.summary = unicode(issue.summary)
+            db_issue.description = unicode(issue.description)
+            db_issue.status = unicode(issue.status)
+            db_issue.resolution = unicode(issue.resolution)
+            db_issue.priority = unicode(issue.priority)
+            db_issue.submitted_by = self.get_people_id(issue.submitted_by)
+            db_issue.submitted_on = issue.submitted_on
+
+            if issue.assigned_to is not None:
+                db_issue.assigned_to = self.get_people_id(issue.assigned_to)
+            db_issues.append((db_issue, issue))
+
+        self.store.flush()
+
+        if self.backend is not None:
+            for db_issue, issue in db_issues:
+                self.backend.insert_issue_ext(self.store, issue, db_issue.id)
+
+        return db_issues
+
+    def _has_child_ext(self):
+        """
+        Whether the backend stores extra data for comments, attachments,
+        changes or temporal relationships, which requires inserting
+        them row by row.
+        """
+        return self.backend is not None and \
+            getattr(self.backend, 'CHILD_EXT', False)
+
+    def _bulk_insert(self, table, columns, rows):
+        """
+        Insert the given rows using multi-row INSERT statements.
+
+        @param table: name of the table
+        @type table: C{str}
+        @param columns: names of the columns
+        @type columns: C{tuple} of C{str}
+        @param rows: values to insert, sorted as X{columns}
+        @type rows: C{list} of C{tuple}
+        """
+        marks = '(' + ', '.join(['?'] * len(columns)) + ')'
+        nrows = MAX_ROWS_PER_INSERT
+        if self.MAX_PARAMS:
+            nrows = min(nrows, self.MAX_PARAMS / len(columns))
+
+        for i in range(0, len(rows), nrows):
+            chunk = rows[i:i + nrows]
+            query = 'INSERT INTO %s (%s) VALUES %s' % \
+                (table, ', '.join(columns), ', '.join([marks] * len(chunk)))
+            params = [value for row in chunk for value in row]
+            self.store.execute(query, params, noresult=True)
+
+    def _comment_key(self, comment, issue_id):
+        return (issue_id, DBComment.get_fingerprint(comment.comment,
+                                                    comment.submitted_on))
+
+    def _attachment_key(self, attachment, issue_id):
+        return (issue_id, DBAttachment.get_fingerprint(attachment.url,
+                                                       attachment.submitted_on))
+
+    def _change_key(self, change, issue_id):
+        return (issue_id, DBChange.get_fingerprint(change.field,
+                                                   change.old_value,
+                                                   change.new_value,
+                                                   change.changed_on))
+
+    def _temp_rel_key(self, trel, tracker_id):
+        return (trel.issue, unicode(trel.type), unicode(trel.related_to),
+                tracker_id)
+
+    def _get_db_comments_keys(self, issue_ids):
+        """
+        Return the keys of the comments stored for the given issues.
+        """
+        if not issue_ids:
+            return set()
+        result = self.store.find((DBComment.issue_id, DBComment.fingerprint),
+                                 DBComment.issue_id.is_in(issue_ids))
+        return set(result)
+
+    def _get_db_attachments_keys(self, issue_ids):
+        """
+        Return the keys of the attachments stored for the given issues.
+        """
+        if not issue_ids:
+            return set()
+        result = self.store.find((DBAttachment.issue_id,
+                                  DBAttachment.fingerprint),
+                                 DBAttachment.issue_id.is_in(issue_ids))
+        return set(result)
+
+    def _get_db_changes_keys(self, issue_ids):
+        """
+        Return the keys of the changes stored for the given issues.
+        """
+        if not issue_ids:
+            return set()
+        result = self.store.find((DBChange.issue_id, DBChange.fingerprint),
+                                 DBChange.issue_id.is_in(issue_ids))
+        return set(result)
+
+    def _get_db_watchers_keys(self, issue_ids):
+        """
+        Return the keys of the watchers stored for the given issues.
+        """
+        if not issue_ids:
+            return set()
+        result = self.store.find((DBIssuesWatchers.issue_id,
+                                  DBIssuesWatchers.person_id),
+                                 DBIssuesWatchers.issue_id.is_in(issue_ids))
+        return set(result)
+
+    def _get_db_temp_rels_keys(self, issues):
+        """
+        Return the keys of the temporal relationships stored for the
+        given issues.
+        """
+        if not issues:
+            return set()
+        result = self.store.find((DBIssueTempRelationship.issue_id,
+                                  DBIssueTempRelationship.type,
+                                  DBIssueTempRelationship.related_to,
+                                  DBIssueTempRelationship.tracker_id),
+                                 DBIssueTempRelationship.issue_id.is_in(issues))
+        return set(result)
+
+    def upgrade_tables(self):
+        """
+        Abstract method for upgrading the tables created by older
+        versions of Bicho
+        """
+        raise NotImplementedError
+
+    def backfill_fingerprints(self):
+        """
+        Compute the fingerprints of the comments, attachments and
+        changes stored without them.
+        """
+        self._backfill_fingerprints(DBComment,
+                                    lambda c: DBComment.get_fingerprint(c.text,
+                                                                        c.submitted_on))
+        self._backfill_fingerprints(DBAttachment,
+                                    lambda a: DBAttachment.get_fingerprint(a.url,
+                                                                           a.submitted_on))
+        self._backfill_fingerprints(DBChange,
+                                    lambda c: DBChange.get_fingerprint(c.field,
+                                                                       c.old_value,
+                                                                       c.new_value,
+                                                                       c.changed_on))
+
+    def _backfill_fingerprints(self, cls, fingerprint):
+        """
+        Fill the fingerprint of the rows of X{cls} without it,
+        committing every L{MAX_ROWS_PER_INSERT} rows.
+        """
+        nrows = 0
+        while True:
+            rows = list(self.store.find(cls, cls.fingerprint == None)[:MAX_ROWS_PER_INSERT])
+            if not rows:
+                break
+            for row in rows:
+                row.fingerprint = fingerprint(row)
+            self.store.commit()
+            nrows += len(rows)
+        printdbg("%s fingerprints computed for %s" % (nrows, cls.__storm_table__))
+
     def get_last_modification_date(self, state=None, tracker_id=None):
         """
         Return last modification date stored in database
         """
+        self.flush_issues()
+
         if self.backend is not None:
             # in the github backend we need to get both open and closed
             # issues in two different petitions
@@ -242,6 +895,66 @@ class DBDatabase:
             else:
                 return self.backend.get_last_modification_date(self.store, tracker_id)
 
+    def get_checkpoint(self, tracker_id):
+        """
+        Return the position where the last crawl of a tracker stopped.
+
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+
+        @return: the cursor saved by the backend, C{None} when the
+          last crawl finished
+        @rtype: C{dict}
+        """
+        db_cp = self._get_db_checkpoint(tracker_id)
+        if db_cp is None:
+            return None
+
+        try:
+            return json.loads(db_cp.cursor)
+        except ValueError:
+            printdbg("Invalid checkpoint of tracker %s ignored" % tracker_id)
+            return None
+
+    def save_checkpoint(self, tracker_id, cursor):
+        """
+        Save the position of the crawl of a tracker.
+
+        Queued issues are written before, so the checkpoint never
+        points past issues that are not stored.
+
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        @param cursor: position of the crawl, it must be serializable
+          to JSON
+        @type cursor: C{dict}
+        """
+        self.flush_issues()
+
+        db_cp = self._get_db_checkpoint(tracker_id)
+        if db_cp is None:
+            db_cp = DBCheckpoint(tracker_id)
+            self.store.add(db_cp)
+        db_cp.cursor = unicode(json.dumps(cursor))
+        db_cp.updated_on = datetime.datetime.now()
+        self._commit()
+
+    def clear_checkpoint(self, tracker_id):
+        """
+        Remove the checkpoint of a tracker once its crawl finished.
+
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        """
+        self.flush_issues()
+        self.store.find(DBCheckpoint,
+                        DBCheckpoint.tracker_id == tracker_id).remove()
+        self._commit()
+
+    def _get_db_checkpoint(self, tracker_id):
+        return self.store.find(DBCheckpoint,
+                               DBCheckpoint.tracker_id == tracker_id).one()
+
     def _insert_relationship(self, issue_id, type, rel_id):
         """
         Insert a relationship between the given issues.
@@ -277,18 +990,67 @@ class DBDatabase:
         self.store.flush()
         return db_temp_rel
 
-    def store_final_relationships(self):
+    def store_final_relationships(self, tracker_ids=None):
         """
+        Store the relationships saved in the temporal table whose
+        issues belong to the same tracker.
+
+        Both issues of each relationship are resolved joining
+        X{temp_related_to} with X{issues}, so the whole table is
+        stored by a single INSERT ... SELECT statement. Relationships
+        already stored are not inserted again.
+
+        The temporal table lives as long as the connection, so it
+        keeps the relationships of the trackers crawled before by the
+        same process. Only those of X{tracker_ids} are stored and
+        counted.
+
+        @param tracker_ids: identifiers of the trackers whose
+          relationships are stored, C{None} for all of them
+        @type tracker_ids: C{list} of C{int}
+
+        @return: number of relationships that could not be stored
+          because some of their issues is not in the tracker
+        @rtype: C{int}
         """
-        temp_rels = self.store.find(DBIssueTempRelationship)
+        self.flush_issues()
 
-        for tr in temp_rels:
-            aux_issue_id = self._get_db_issue(tr.issue_id, tr.tracker_id)
-            aux_related_to = self._get_db_issue(tr.related_to, tr.tracker_id)
-            if (aux_related_to != -1 and aux_issue_id != -1):
-                self._insert_relationship(aux_issue_id.id, tr.type, aux_related_to.id)
-            else:
-                printdbg("Issue %s belongs to a different tracker and won't be stored" % tr.related_to)
+        if tracker_ids is None:
+            trackers = ''
+        elif not tracker_ids:
+            return 0
+        else:
+            trackers = 'AND t.tracker_id IN (%s)' \
+                % ', '.join(str(int(i)) for i in tracker_ids)
+
+        issue_key = self.SQL_INT_TO_STR % 't.issue_id'
+        self.store.execute('INSERT INTO related_to (issue_id, related_to, type) \
+                            SELECT DISTINCT i.id, r.id, t.type \
+                            FROM temp_related_to t \
+                            JOIN issues i ON i.issue = %s \
+                              AND i.tracker_id = t.tracker_id \
+                            JOIN issues r ON r.issue = t.related_to \
+                              AND r.tracker_id = t.tracker_id \
+                            WHERE NOT EXISTS (SELECT 1 FROM related_to x \
+                              WHERE x.issue_id = i.id \
+                                AND x.related_to = r.id \
+                                AND x.type = t.type) %s'
+                           % (issue_key, trackers), noresult=True)
+
+        unresolved = self.store.execute('SELECT COUNT(*) \
+                                         FROM temp_related_to t \
+                                         LEFT JOIN issues i ON i.issue = %s \
+                                           AND i.tracker_id = t.tracker_id \
+                                         LEFT JOIN issues r ON r.issue = t.related_to \
+                                           AND r.tracker_id = t.tracker_id \
+                                         WHERE (i.id IS NULL OR r.id IS NULL) %s'
+                                        % (issue_key, trackers)).get_one()[0]
+        self._commit()
+
+        if unresolved:
+            printout("%s relationships with issues of a different tracker "
+                     "won't be stored" % unresolved)
+        return unresolved
 
     def _insert_comment(self, comment, issue_id, tracker_id):
         """
@@ -304,9 +1066,9 @@ class DBDatabase:
         @return: the inserted comment
         @rtype: L{DBComment}
         """
-        submitted_by = self.insert_people(comment.submitted_by)
+        submitted_by = self.get_people_id(comment.submitted_by)
 
-        db_comment = DBComment(comment.comment, submitted_by.id,
+        db_comment = DBComment(comment.comment, submitted_by,
                                comment.submitted_on, issue_id)
         self.store.add(db_comment)
         try:
@@ -331,8 +1093,7 @@ class DBDatabase:
         @rtype: L{DBAttachment}
         """
         if attachment.submitted_by is not None:
-            submitter = self.insert_people(attachment.submitted_by)
-            submitted_by = submitter.id
+            submitted_by = self.get_people_id(attachment.submitted_by)
         else:
             submitted_by = None
 
@@ -357,10 +1118,10 @@ class DBDatabase:
         @return: the inserted change
         @rtype: L{DBChange}
         """
-        changed_by = self.insert_people(change.changed_by)
+        changed_by = self.get_people_id(change.changed_by)
 
         db_change = DBChange(change.field, change.old_value, change.new_value,
-                             changed_by.id, change.changed_on, issue_id)
+                             changed_by, change.changed_on, issue_id)
         self.store.add(db_change)
         self.store.flush()
         return db_change
@@ -372,9 +1133,9 @@ class DBDatabase:
         @return: the inserted comment
         @rtype: L{DBComment}
         """
-        watcher = self.insert_people(people)
+        watcher_id = self.get_people_id(people)
 
-        db_issues_watchers = DBIssuesWatchers(issue_id, watcher.id)
+        db_issues_watchers = DBIssuesWatchers(issue_id, watcher_id)
 
         self.store.add(db_issues_watchers)
         self.store.flush()
@@ -479,10 +1240,11 @@ class DBDatabase:
         @type tracker_id: C{int}
 
         """
+        fingerprint = DBComment.get_fingerprint(comment.comment,
+                                                comment.submitted_on)
         db_comment = self.store.find(DBComment,
                                      DBComment.issue_id == issue_id,
-                                     DBComment.text == unicode(comment.comment),
-                                     DBComment.submitted_on == comment.submitted_on).one()
+                                     DBComment.fingerprint == fingerprint).any()
 
         if not db_comment:
             #if comment is not stored, return -1 to know it's a new one
@@ -502,17 +1264,11 @@ class DBDatabase:
         @type tracker_id: C{int}
 
         """
-        #source forge don't have new_value so we recived
-        #a string that must be unicode
-        if change.new_value == "unknown":
-            change.new_value = unicode(change.new_value)
-
+        fingerprint = DBChange.get_fingerprint(change.field, change.old_value,
+                                               change.new_value, change.changed_on)
         db_change = self.store.find(DBChange,
                                     DBChange.issue_id == issue_id,
-                                    DBChange.field == change.field,
-                                    DBChange.changed_on == change.changed_on,
-                                    DBChange.old_value == change.old_value,
-                                    DBChange.new_value == change.new_value).one()
+                                    DBChange.fingerprint == fingerprint).any()
         if not db_change:
             #if change is not stored, return -1 to know it's a new one
             db_change = -1
@@ -531,10 +1287,11 @@ class DBDatabase:
         @type tracker_id: C{int}
 
         """
+        fingerprint = DBAttachment.get_fingerprint(attachment.url,
+                                                   attachment.submitted_on)
         db_attachment = self.store.find(DBAttachment,
-                                    DBAttachment.issue_id == issue_id,
-                                    DBAttachment.url == attachment.url,
-                                    DBAttachment.submitted_on == attachment.submitted_on).one()
+                                        DBAttachment.issue_id == issue_id,
+                                        DBAttachment.fingerprint == fingerprint).any()
         if not db_attachment:
             #if attachment is not stored, return -1 to know it's a new one
             db_attachment = -1
@@ -624,6 +1381,40 @@ class DBTracker(object):
         self.retrieved_on = datetime.datetime.now()
 
 
+class DBCheckpoint(object):
+    """
+    Maps elements from X{checkpoints} table.
+
+    @param tracker_id: identifier of the tracker
+    @type tracker_id: C{int}
+
+    @ivar __storm_table__: Name of the database table.
+    @type __storm_table__: C{str}
+
+    @ivar id: Checkpoint identifier.
+    @type id: L{storm.locals.Int}
+    @ivar tracker_id: Tracker identifier.
+    @type tracker_id: L{storm.locals.Int}
+    @ivar cursor: Position of the crawl, encoded in JSON.
+    @type cursor: L{storm.locals.Unicode}
+    @ivar updated_on: Date when the checkpoint was saved.
+    @type updated_on: L{storm.locals.DateTime}
+    @ivar tracker: Reference to L{DBTracker} object.
+    @type tracker: L{storm.locals.Reference}
+    """
+    __storm_table__ = 'checkpoints'
+
+    id = Int(primary=True)
+    tracker_id = Int()
+    cursor = Unicode()
+    updated_on = DateTime()
+
+    tracker = Reference(tracker_id, DBTracker.id)
+
+    def __init__(self, tracker_id):
+        self.tracker_id = tracker_id
+
+
 class DBPeople(object):
     """
     Maps elements form X{people} table.
@@ -881,6 +1672,8 @@ class DBComment(object):
     @type submitted: L{storm.locals.Reference}
     @ivar issue_id: Issue identifier.
     @type issue_id: L{storm.locals.Int}
+    @ivar fingerprint: Fingerprint of the text and the submission date.
+    @type fingerprint: L{storm.locals.Unicode}
     """
     __storm_table__ = 'comments'
 
@@ -889,6 +1682,7 @@ class DBComment(object):
     submitted_by = Int()
     submitted_on = DateTime()
     issue_id = Int()
+    fingerprint = Unicode()
 
     issue = Reference(issue_id, DBIssue.id)
     submitted = Reference(submitted_by, DBPeople.id)
@@ -898,6 +1692,11 @@ class DBComment(object):
         self.submitted_by = submitted_by
         self.submitted_on = submitted_on
         self.issue_id = issue_id
+        self.fingerprint = self.get_fingerprint(text, submitted_on)
+
+    @staticmethod
+    def get_fingerprint(text, submitted_on):
+        return get_fingerprint(unicode(text), submitted_on)
 
 
 class DBAttachment(object):
@@ -935,6 +1734,8 @@ class DBAttachment(object):
     @type issue: L{storm.locals.Reference}
     @ivar submitted: Reference to L{DBPeople} object.
     @type submitted: L{storm.locals.Reference}
+    @ivar fingerprint: Fingerprint of the URL and the submission date.
+    @type fingerprint: L{storm.locals.Unicode}
     """
     __storm_table__ = 'attachments'
 
@@ -945,6 +1746,7 @@ class DBAttachment(object):
     submitted_by = Int()
     submitted_on = DateTime()
     issue_id = Int()
+    fingerprint = Unicode()
 
     issue = Reference(issue_id, DBIssue.id)
     submitted = Reference(submitted_by, DBPeople.id)
@@ -956,6 +1758,11 @@ class DBAttachment(object):
         self.submitted_by = submitted_by
         self.submitted_on = submitted_on
         self.issue_id = issue_id
+        self.fingerprint = self.get_fingerprint(url, submitted_on)
+
+    @staticmethod
+    def get_fingerprint(url, submitted_on):
+        return get_fingerprint(unicode(url), submitted_on)
 
 
 class DBChange(object):
@@ -996,6 +1803,8 @@ class DBChange(object):
     @type issue: L{storm.locals.Reference}
     @ivar people: Reference to L{DBPeople} object.
     @type people: L{storm.locals.Reference}
+    @ivar fingerprint: Fingerprint of the field, values and date.
+    @type fingerprint: L{storm.locals.Unicode}
     """
     __storm_table__ = 'changes'
 
@@ -1006,6 +1815,7 @@ class DBChange(object):
     changed_by = Int()
     changed_on = DateTime()
     issue_id = Int()
+    fingerprint = Unicode()
 
     issue = Reference(issue_id, DBIssue.id)
     people = Reference(changed_by, DBPeople.id)
@@ -1017,13 +1827,27 @@ class DBChange(object):
         self.changed_by = changed_by
         self.changed_on = changed_on
         self.issue_id = issue_id
+        self.fingerprint = self.get_fingerprint(field, old_value,
+                                                new_value, changed_on)
+
+    @staticmethod
+    def get_fingerprint(field, old_value, new_value, changed_on):
+        return get_fingerprint(unicode(field), unicode(old_value),
+                               unicode(new_value), changed_on)
 
 
 class DBBackend:
     """
     """
+    # Set to True when the backend stores extra data for comments,
+    # attachments, changes or temporal relationships. Bulk write mode
+    # inserts those rows one by one to get their identifiers.
+    CHILD_EXT = False
+
     def __init__(self):
         self.MYSQL_EXT = None
+        self.SQLITE_EXT = []
+        self.POSTGRESQL_EXT = []
 
     def insert_issue_ext(self, ext, issue_id):
         """
@@ -1066,3 +1890,9 @@ def get_database(backend=None):
     if opts.db_driver_out == "mysql":
         from bicho.db.mysql import DBMySQL
         return DBMySQL(backend)
+    elif opts.db_driver_out == "sqlite":
+        from bicho.db.sqlite import DBSQLite
+        return DBSQLite(backend)
+    elif opts.db_driver_out == "postgresql":
+        from bicho.db.postgresql import DBPostgreSQL
+        return DBPostgreSQL(backend)
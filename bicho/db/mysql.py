@@ -25,12 +25,12 @@ MySQL database module
 
 import warnings
 
-from storm.locals import Store, create_database
-
 from bicho.config import Config
+from bicho.utils import printout
 from bicho.db.database import DBDatabase, DBTracker, DBPeople, \
     DBIssue, DBIssuesWatchers, DBIssueRelationship, DBComment, DBAttachment, \
-    DBChange, DBSupportedTracker, DBIssueTempRelationship
+    DBChange, DBSupportedTracker, DBIssueTempRelationship, DBCheckpoint, \
+    OutdatedDatabaseError
 
 
 class DBMySQL(DBDatabase):
@@ -42,17 +42,17 @@ class DBMySQL(DBDatabase):
         DBDatabase.__init__(self, backend)
         opts = Config()
 
-        self.database = create_database('mysql://' + opts.db_user_out + ':'
-                                        + opts.db_password_out + '@'
-                                        + opts.db_hostname_out + ':'
-                                        + opts.db_port_out + '/'
-                                        + opts.db_database_out)
-        self.store = Store(self.database)
+        self.connect('mysql://' + opts.db_user_out + ':'
+                     + opts.db_password_out + '@'
+                     + opts.db_hostname_out + ':'
+                     + opts.db_port_out + '/'
+                     + opts.db_database_out)
 
         clsl = [DBSupportedTracker, DBTrackerMySQL, DBPeopleMySQL,
                 DBIssueMySQL, DBIssueRelationshipMySQL,
                 DBCommentMySQL, DBAttachmentMySQL, DBChangeMySQL,
-                DBIssuesWatchersMySQL, DBIssueTempRelationshipMySQL]
+                DBIssuesWatchersMySQL, DBIssueTempRelationshipMySQL,
+                DBCheckpointMySQL]
 
         if backend is not None:
             clsl.extend([cls for cls in backend.MYSQL_EXT])
@@ -60,9 +60,47 @@ class DBMySQL(DBDatabase):
         self.suppress_warnings()
         self.create_tables(clsl)
 
+        if not getattr(opts, 'db_upgrade', False):
+            self.check_tables()
+        self.load_people_cache()
+
     def suppress_warnings(self):
         warnings.filterwarnings("ignore", message="Table .* already exists")
 
+    def check_tables(self):
+        """
+        Check whether the tables have to be upgraded.
+
+        @raise OutdatedDatabaseError: when the fingerprint columns
+          do not exist.
+        """
+        for table in ('comments', 'attachments', 'changes'):
+            if not self._has_fingerprint(table):
+                raise OutdatedDatabaseError('Table %s has no fingerprint column. ' \
+                                            'Run bicho --db-upgrade first' % table)
+
+    def _has_fingerprint(self, table):
+        result = self.store.execute("SHOW COLUMNS FROM %s LIKE 'fingerprint'"
+                                    % table)
+        return result.get_one() is not None
+
+    def upgrade_tables(self):
+        """
+        Add the fingerprint columns to databases created by older
+        versions of Bicho and fill them.
+        """
+        for table in ('comments', 'attachments', 'changes'):
+            if self._has_fingerprint(table):
+                continue
+            printout("Adding fingerprint column to %s table" % table)
+            self.store.execute('ALTER TABLE %s \
+                                ADD COLUMN fingerprint CHAR(40) NULL, \
+                                ADD INDEX %s_fingerprint_idx(issue_id, fingerprint)'
+                               % (table, table), noresult=True)
+        self.store.commit()
+
+        self.backfill_fingerprints()
+
 
 class DBSupportedTracker(DBSupportedTracker):
     """
@@ -95,6 +133,24 @@ class DBTrackerMySQL(DBTracker):
                      ) ENGINE=MYISAM;'
 
 
+class DBCheckpointMySQL(DBCheckpoint):
+    """
+    MySQL subclass of L{DBCheckpoint}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS checkpoints ( \
+                     id INTEGER NOT NULL AUTO_INCREMENT, \
+                     tracker_id INTEGER NOT NULL, \
+                     cursor MEDIUMTEXT NOT NULL, \
+                     updated_on DATETIME NOT NULL, \
+                     PRIMARY KEY(id), \
+                     UNIQUE KEY(tracker_id), \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ) ENGINE=MYISAM;'
+
+
 class DBPeopleMySQL(DBPeople):
     """
     MySQL subclass of L{DBPeople}.
@@ -221,9 +277,11 @@ class DBCommentMySQL(DBComment):
                      text TEXT NOT NULL, \
                      submitted_by INTEGER UNSIGNED NOT NULL, \
                      submitted_on DATETIME NOT NULL, \
+                     fingerprint CHAR(40) NULL, \
                      PRIMARY KEY(id), \
                      INDEX comments_submitted_idx(submitted_by), \
                      INDEX comments_issue_idx(issue_id), \
+                     INDEX comments_fingerprint_idx(issue_id, fingerprint), \
                      FOREIGN KEY(submitted_by) \
                        REFERENCES people(id) \
                          ON DELETE SET NULL \
@@ -247,9 +305,11 @@ class DBAttachmentMySQL(DBAttachment):
                      url VARCHAR(255) NOT NULL, \
                      submitted_by INTEGER UNSIGNED, \
                      submitted_on DATETIME, \
+                     fingerprint CHAR(40) NULL, \
                      PRIMARY KEY(id), \
                      INDEX attachments_submitted_idx(submitted_by), \
                      INDEX attachments_issue_idx(issue_id), \
+                     INDEX attachments_fingerprint_idx(issue_id, fingerprint), \
                      FOREIGN KEY(submitted_by) \
                        REFERENCES people(id) \
                          ON DELETE SET NULL \
@@ -273,9 +333,11 @@ class DBChangeMySQL(DBChange):
                      new_value TEXT NOT NULL, \
                      changed_by INTEGER UNSIGNED NOT NULL, \
                      changed_on DATETIME NOT NULL, \
+                     fingerprint CHAR(40) NULL, \
                      PRIMARY KEY(id), \
                      INDEX changes_issue_idx(issue_id), \
                      INDEX changes_changed_idx(changed_by), \
+                     INDEX changes_fingerprint_idx(issue_id, fingerprint), \
                      FOREIGN KEY(issue_id) \
                        REFERENCES issues(id) \
                          ON DELETE CASCADE \
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+PostgreSQL database module
+
+Rows written in bulk are loaded with COPY, which needs the psycopg2
+cursor under the Storm connection. Storm does not expose it, so
+L{DBPostgreSQL._get_copy_cursor} reaches for the private
+C{_raw_connection} attribute and, when a Storm version lacks it,
+the rows are inserted with the multi-row INSERT statements of
+L{DBDatabase._bulk_insert}.
+
+The issues log tables of --logtable are only created on MySQL, so
+that option is rejected with this driver and those tables are not
+loaded with COPY.
+"""
+
+import datetime
+
+from cStringIO import StringIO
+
+from bicho.config import Config
+from bicho.utils import printdbg
+from bicho.db.database import DBDatabase, DBTracker, DBPeople, \
+    DBIssue, DBIssuesWatchers, DBIssueRelationship, DBComment, DBAttachment, \
+    DBChange, DBSupportedTracker, DBIssueTempRelationship, DBCheckpoint
+
+# Issues written on each transaction by default. Rows of the
+# same batch are loaded at once using COPY.
+POSTGRESQL_BATCH_SIZE = 100
+
+
+def copy_value(value):
+    """
+    Format a value for a COPY statement in text format.
+
+    @param value: value to format
+    @type value: C{object}
+
+    @return: the formatted value
+    @rtype: C{str}
+    """
+    if value is None:
+        return '\\N'
+    elif isinstance(value, bool):
+        return value and 't' or 'f'
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    elif not isinstance(value, basestring):
+        value = unicode(value)
+
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return value.replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+class DBPostgreSQL(DBDatabase):
+    """
+    PostgreSQL database adapter.
+
+    Comments, attachments, changes and the rest of rows written
+    in bulk are loaded with COPY instead of INSERT statements.
+    """
+
+    SQL_INT_TO_STR = 'CAST(%s AS VARCHAR)'
+
+    def __init__(self, backend=None):
+        DBDatabase.__init__(self, backend)
+        opts = Config()
+
+        self.connect('postgres://' + opts.db_user_out + ':'
+                     + opts.db_password_out + '@'
+                     + opts.db_hostname_out + ':'
+                     + opts.db_port_out + '/'
+                     + opts.db_database_out)
+
+        clsl = [DBSupportedTrackerPostgreSQL, DBTrackerPostgreSQL,
+                DBPeoplePostgreSQL, DBIssuePostgreSQL,
+                DBIssueRelationshipPostgreSQL, DBCommentPostgreSQL,
+                DBAttachmentPostgreSQL, DBChangePostgreSQL,
+                DBIssuesWatchersPostgreSQL, DBIssueTempRelationshipPostgreSQL,
+                DBCheckpointPostgreSQL]
+
+        if backend is not None:
+            clsl.extend([cls for cls in backend.POSTGRESQL_EXT])
+
+        self.create_tables(clsl)
+        self.store.commit()
+        self.load_people_cache()
+
+    def default_batch_size(self):
+        return POSTGRESQL_BATCH_SIZE
+
+    def upgrade_tables(self):
+        """
+        PostgreSQL databases are created with the fingerprint columns,
+        so only the missing fingerprints are computed.
+        """
+        self.backfill_fingerprints()
+
+    def _bulk_insert(self, table, columns, rows):
+        """
+        Load the given rows using a COPY statement, or INSERT
+        statements when COPY is not available.
+
+        @param table: name of the table
+        @type table: C{str}
+        @param columns: names of the columns
+        @type columns: C{tuple} of C{str}
+        @param rows: values to insert, sorted as X{columns}
+        @type rows: C{list} of C{tuple}
+        """
+        if not rows:
+            return
+
+        cursor = self._get_copy_cursor()
+        if cursor is None:
+            DBDatabase._bulk_insert(self, table, columns, rows)
+            return
+
+        data = StringIO()
+        for row in rows:
+            data.write('\t'.join([copy_value(value) for value in row]))
+            data.write('\n')
+        data.seek(0)
+
+        try:
+            cursor.copy_expert('COPY %s (%s) FROM STDIN'
+                               % (table, ', '.join(columns)), data)
+        finally:
+            cursor.close()
+
+    def _get_copy_cursor(self):
+        """
+        Return a cursor of the connection of the store able to run
+        COPY, so the rows are part of its current transaction.
+
+        This is the only place using private attributes of Storm.
+
+        @return: the psycopg2 cursor or None when it is not available
+        @rtype: C{cursor}
+        """
+        self.store.flush()
+        connection = getattr(self.store, '_connection', None)
+        if connection is None or \
+                not hasattr(connection, '_ensure_connected'):
+            printdbg("Storm connection not available, COPY disabled")
+            return None
+
+        connection._ensure_connected()
+        raw = getattr(connection, '_raw_connection', None)
+        if raw is None:
+            printdbg("Storm raw connection not available, COPY disabled")
+            return None
+
+        cursor = raw.cursor()
+        if not hasattr(cursor, 'copy_expert'):
+            cursor.close()
+            printdbg("Database cursor without COPY support")
+            return None
+        return cursor
+
+
+class DBSupportedTrackerPostgreSQL(DBSupportedTracker):
+    """
+    PostgreSQL subclass of L{DBSupportedTracker}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS supported_trackers ( \
+                     id SERIAL PRIMARY KEY, \
+                     name VARCHAR(64) NOT NULL, \
+                     version VARCHAR(64) NOT NULL, \
+                     UNIQUE(name, version) \
+                     );'
+
+
+class DBTrackerPostgreSQL(DBTracker):
+    """
+    PostgreSQL subclass of L{DBTracker}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS trackers ( \
+                     id SERIAL PRIMARY KEY, \
+                     url VARCHAR(255) NOT NULL, \
+                     type INTEGER NOT NULL, \
+                     retrieved_on TIMESTAMP NOT NULL, \
+                     UNIQUE(url) \
+                     );'
+
+
+class DBCheckpointPostgreSQL(DBCheckpoint):
+    """
+    PostgreSQL subclass of L{DBCheckpoint}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS checkpoints ( \
+                     id SERIAL PRIMARY KEY, \
+                     tracker_id INTEGER NOT NULL \
+                       REFERENCES trackers(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     cursor TEXT NOT NULL, \
+                     updated_on TIMESTAMP NOT NULL, \
+                     UNIQUE(tracker_id) \
+                     );'
+
+
+class DBPeoplePostgreSQL(DBPeople):
+    """
+    PostgreSQL subclass of L{DBPeople}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS people ( \
+                     id SERIAL PRIMARY KEY, \
+                     name VARCHAR(64) NULL, \
+                     email VARCHAR(64) NULL, \
+                     user_id VARCHAR(255) NOT NULL, \
+                     UNIQUE(user_id) \
+                     );'
+
+
+class DBIssuePostgreSQL(DBIssue):
+    """
+    PostgreSQL subclass of L{DBIssue}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues ( \
+                     id SERIAL PRIMARY KEY, \
+                     tracker_id INTEGER NOT NULL \
+                       REFERENCES trackers(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     issue VARCHAR(255) NOT NULL, \
+                     type VARCHAR(64) NULL, \
+                     summary VARCHAR(255) NOT NULL, \
+                     description TEXT NOT NULL, \
+                     status VARCHAR(64) NOT NULL, \
+                     resolution VARCHAR(64) NULL, \
+                     priority VARCHAR(64) NULL, \
+                     submitted_by INTEGER NOT NULL, \
+                     submitted_on TIMESTAMP NOT NULL, \
+                     assigned_to INTEGER NOT NULL, \
+                     UNIQUE(issue, tracker_id) \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_submitted_idx ON issues (submitted_by);',
+        'CREATE INDEX IF NOT EXISTS issues_assigned_idx ON issues (assigned_to);',
+        'CREATE INDEX IF NOT EXISTS issues_tracker_idx ON issues (tracker_id);',
+    )
+
+
+class DBIssuesWatchersPostgreSQL(DBIssuesWatchers):
+    """
+    PostgreSQL subclass of L{DBIssuesWatchers}
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_watchers ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     person_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id, person_id) \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issue_person_idx2 ON issues_watchers (person_id);',
+    )
+
+
+class DBIssueRelationshipPostgreSQL(DBIssueRelationship):
+    """
+    PostgreSQL subclass of L{DBIssueRelationship}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS related_to ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     related_to INTEGER NOT NULL \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     type VARCHAR(64) NOT NULL, \
+                     UNIQUE(issue_id, related_to, type) \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_related_idx2 ON related_to (related_to);',
+    )
+
+
+class DBIssueTempRelationshipPostgreSQL(DBIssueTempRelationship):
+    """
+    PostgreSQL subclass of L{DBIssueTempRelationship}.
+    """
+    __sql_table__ = 'CREATE TEMPORARY TABLE IF NOT EXISTS temp_related_to ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     related_to VARCHAR(64) NOT NULL, \
+                     type VARCHAR(64) NOT NULL, \
+                     tracker_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id, related_to, type, tracker_id) \
+                     );'
+
+
+class DBCommentPostgreSQL(DBComment):
+    """
+    PostgreSQL subclass of L{DBComment}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS comments ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     comment_id INTEGER, \
+                     text TEXT NOT NULL, \
+                     submitted_by INTEGER NOT NULL, \
+                     submitted_on TIMESTAMP NOT NULL, \
+                     fingerprint CHAR(40) NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS comments_submitted_idx ON comments (submitted_by);',
+        'CREATE INDEX IF NOT EXISTS comments_fingerprint_idx ON comments (issue_id, fingerprint);',
+    )
+
+
+class DBAttachmentPostgreSQL(DBAttachment):
+    """
+    PostgreSQL subclass of L{DBAttachment}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS attachments ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     name VARCHAR(64) NOT NULL, \
+                     description TEXT NOT NULL, \
+                     url VARCHAR(255) NOT NULL, \
+                     submitted_by INTEGER, \
+                     submitted_on TIMESTAMP, \
+                     fingerprint CHAR(40) NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS attachments_submitted_idx ON attachments (submitted_by);',
+        'CREATE INDEX IF NOT EXISTS attachments_fingerprint_idx ON attachments (issue_id, fingerprint);',
+    )
+
+
+class DBChangePostgreSQL(DBChange):
+    """
+    PostgreSQL subclass of L{DBChange}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS changes ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     field VARCHAR(64) NOT NULL, \
+                     old_value TEXT NOT NULL, \
+                     new_value TEXT NOT NULL, \
+                     changed_by INTEGER NOT NULL, \
+                     changed_on TIMESTAMP NOT NULL, \
+                     fingerprint CHAR(40) NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS changes_changed_idx ON changes (changed_by);',
+        'CREATE INDEX IF NOT EXISTS changes_fingerprint_idx ON changes (issue_id, fingerprint);',
+    )
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+SQLite database module
+"""
+
+import os
+
+from bicho.config import Config
+from bicho.db.database import DBDatabase, DBTracker, DBPeople, \
+    DBIssue, DBIssuesWatchers, DBIssueRelationship, DBComment, DBAttachment, \
+    DBChange, DBSupportedTracker, DBIssueTempRelationship, DBCheckpoint
+
+# Issues written on each transaction by default. Every commit
+# is a write to disk, so several issues are grouped.
+SQLITE_BATCH_SIZE = 100
+
+# Pages of the cache, in KiB when negative
+SQLITE_CACHE_SIZE = -65536
+
+
+class DBSQLite(DBDatabase):
+    """
+    SQLite database adapter.
+
+    The database is stored in the file given by the X{db_database_out}
+    option. It uses write-ahead logging so readers do not block the
+    crawler.
+    """
+
+    # Default SQLITE_MAX_VARIABLE_NUMBER of older SQLite versions
+    MAX_PARAMS = 999
+
+    def __init__(self, backend=None):
+        DBDatabase.__init__(self, backend)
+        opts = Config()
+
+        path = os.path.abspath(os.path.expanduser(opts.db_database_out))
+        if self.connect('sqlite:' + path +
+                        '?journal_mode=WAL&synchronous=NORMAL' +
+                        '&timeout=30'):
+            self.set_pragmas()
+
+        clsl = [DBSupportedTrackerSQLite, DBTrackerSQLite, DBPeopleSQLite,
+                DBIssueSQLite, DBIssueRelationshipSQLite,
+                DBCommentSQLite, DBAttachmentSQLite, DBChangeSQLite,
+                DBIssuesWatchersSQLite, DBIssueTempRelationshipSQLite,
+                DBCheckpointSQLite]
+
+        if backend is not None:
+            clsl.extend([cls for cls in backend.SQLITE_EXT])
+
+        self.create_tables(clsl)
+        self.store.commit()
+        self.load_people_cache()
+
+    def default_batch_size(self):
+        return SQLITE_BATCH_SIZE
+
+    def set_pragmas(self):
+        """
+        Tune the connection for a single writer.
+        """
+        self.store.execute('PRAGMA cache_size = %s' % SQLITE_CACHE_SIZE)
+        self.store.execute('PRAGMA temp_store = MEMORY')
+        self.store.commit()
+
+    def upgrade_tables(self):
+        """
+        SQLite databases are created with the fingerprint columns,
+        so only the missing fingerprints are computed.
+        """
+        self.backfill_fingerprints()
+
+
+class DBSupportedTrackerSQLite(DBSupportedTracker):
+    """
+    SQLite subclass of L{DBSupportedTracker}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS supported_trackers ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     name VARCHAR(64) NOT NULL, \
+                     version VARCHAR(64) NOT NULL, \
+                     UNIQUE(name, version) \
+                     );'
+
+
+class DBTrackerSQLite(DBTracker):
+    """
+    SQLite subclass of L{DBTracker}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS trackers ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     url VARCHAR(255) NOT NULL, \
+                     type INTEGER NOT NULL, \
+                     retrieved_on DATETIME NOT NULL, \
+                     UNIQUE(url) \
+                     );'
+
+
+class DBCheckpointSQLite(DBCheckpoint):
+    """
+    SQLite subclass of L{DBCheckpoint}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS checkpoints ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     tracker_id INTEGER NOT NULL, \
+                     cursor TEXT NOT NULL, \
+                     updated_on DATETIME NOT NULL, \
+                     UNIQUE(tracker_id) \
+                     );'
+
+
+class DBPeopleSQLite(DBPeople):
+    """
+    SQLite subclass of L{DBPeople}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS people ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     name VARCHAR(64) NULL, \
+                     email VARCHAR(64) NULL, \
+                     user_id VARCHAR(255) NOT NULL, \
+                     UNIQUE(user_id) \
+                     );'
+
+
+class DBIssueSQLite(DBIssue):
+    """
+    SQLite subclass of L{DBIssue}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     tracker_id INTEGER NOT NULL, \
+                     issue VARCHAR(255) NOT NULL, \
+                     type VARCHAR(64) NULL, \
+                     summary VARCHAR(255) NOT NULL, \
+                     description TEXT NOT NULL, \
+                     status VARCHAR(64) NOT NULL, \
+                     resolution VARCHAR(64) NULL, \
+                     priority VARCHAR(64) NULL, \
+                     submitted_by INTEGER NOT NULL, \
+                     submitted_on DATETIME NOT NULL, \
+                     assigned_to INTEGER NOT NULL, \
+                     UNIQUE(issue, tracker_id) \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_submitted_idx ON issues (submitted_by);',
+        'CREATE INDEX IF NOT EXISTS issues_assigned_idx ON issues (assigned_to);',
+        'CREATE INDEX IF NOT EXISTS issues_tracker_idx ON issues (tracker_id);',
+    )
+
+
+class DBIssuesWatchersSQLite(DBIssuesWatchers):
+    """
+    SQLite subclass of L{DBIssuesWatchers}
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_watchers ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     issue_id INTEGER NOT NULL, \
+                     person_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id, person_id) \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issue_person_idx2 ON issues_watchers (person_id);',
+    )
+
+
+class DBIssueRelationshipSQLite(DBIssueRelationship):
+    """
+    SQLite subclass of L{DBIssueRelationship}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS related_to ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     issue_id INTEGER NOT NULL, \
+                     related_to INTEGER NOT NULL, \
+                     type VARCHAR(64) NOT NULL, \
+                     UNIQUE(issue_id, related_to, type) \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS issues_related_idx2 ON related_to (related_to);',
+    )
+
+
+class DBIssueTempRelationshipSQLite(DBIssueTempRelationship):
+    """
+    SQLite subclass of L{DBIssueTempRelationship}.
+    """
+    __sql_table__ = 'CREATE TEMPORARY TABLE IF NOT EXISTS temp_related_to ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     issue_id INTEGER NOT NULL, \
+                     related_to VARCHAR(64) NOT NULL, \
+                     type VARCHAR(64) NOT NULL, \
+                     tracker_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id, related_to, type, tracker_id) \
+                     );'
+
+
+class DBCommentSQLite(DBComment):
+    """
+    SQLite subclass of L{DBComment}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS comments ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     issue_id INTEGER NOT NULL, \
+                     comment_id INTEGER, \
+                     text TEXT NOT NULL, \
+                     submitted_by INTEGER NOT NULL, \
+                     submitted_on DATETIME NOT NULL, \
+                     fingerprint CHAR(40) NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS comments_submitted_idx ON comments (submitted_by);',
+        'CREATE INDEX IF NOT EXISTS comments_fingerprint_idx ON comments (issue_id, fingerprint);',
+    )
+
+
+class DBAttachmentSQLite(DBAttachment):
+    """
+    SQLite subclass of L{DBAttachment}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS attachments ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     issue_id INTEGER NOT NULL, \
+                     name VARCHAR(64) NOT NULL, \
+                     description TEXT NOT NULL, \
+                     url VARCHAR(255) NOT NULL, \
+                     submitted_by INTEGER, \
+                     submitted_on DATETIME, \
+                     fingerprint CHAR(40) NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS attachments_submitted_idx ON attachments (submitted_by);',
+        'CREATE INDEX IF NOT EXISTS attachments_fingerprint_idx ON attachments (issue_id, fingerprint);',
+    )
+
+
+class DBChangeSQLite(DBChange):
+    """
+    SQLite subclass of L{DBChange}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS changes ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     issue_id INTEGER NOT NULL, \
+                     field VARCHAR(64) NOT NULL, \
+                     old_value TEXT NOT NULL, \
+                     new_value TEXT NOT NULL, \
+                     changed_by INTEGER NOT NULL, \
+                     changed_on DATETIME NOT NULL, \
+                     fingerprint CHAR(40) NULL \
+                     );'
+    __sql_indexes__ = (
+        'CREATE INDEX IF NOT EXISTS changes_changed_idx ON changes (changed_by);',
+        'CREATE INDEX IF NOT EXISTS changes_fingerprint_idx ON changes (issue_id, fingerprint);',
+    )
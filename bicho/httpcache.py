@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+"""
+On-disk and in-memory caches of HTTP responses.
+
+Responses with an X{ETag} or X{Last-Modified} header are stored in
+the directory given by the X{path} option. When the same URL is
+requested again, the request is made conditional and a
+X{304 Not Modified} answer is served from the cache.
+"""
+
+import errno
+import hashlib
+import httplib
+import json
+import os
+import tempfile
+import threading
+import urllib2
+
+from collections import OrderedDict
+from cStringIO import StringIO
+
+from bicho.utils import printdbg, create_dir, bicho_dot_dir
+
+# Headers of the response that are not stored
+SKIPPED_HEADERS = ('set-cookie', 'transfer-encoding', 'connection')
+
+# Bytes of the bodies kept by a memory cache
+MEMORY_CACHE_SIZE = 32 * 1024 * 1024
+
+
+class HTTPCache(object):
+    """
+    Responses of GET requests stored in a directory.
+
+    Each response is stored in two files named after the SHA-1 of its
+    URL: X{.json} with the headers, and X{.body}. Files are
+    written to a temporary name and renamed, so several threads can
+    share the cache.
+
+    @param path: directory where the responses are stored
+    @type path: C{str}
+    @param key: value mixed into the names of the files, so the
+      responses retrieved with different credentials are kept apart
+    @type key: C{str}
+    """
+
+    def __init__(self, path, key=''):
+        self.path = path
+        self.key = key
+        if not os.path.isdir(path):
+            os.makedirs(path, 0700)
+
+    def _get_filename(self, url):
+        key = hashlib.sha1(self.key + url).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, url):
+        """
+        Return the cached response of X{url}.
+
+        @return: metadata and body of the response, C{None} when
+          it is not cached
+        @rtype: C{tuple} of (C{dict}, C{str})
+        """
+        filename = self._get_filename(url)
+        try:
+            with open(filename + '.json', 'rb') as f:
+                meta = json.load(f)
+            with open(filename + '.body', 'rb') as f:
+                body = f.read()
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                printdbg("Error reading cache of %s: %s" % (url, e))
+            return None
+        except ValueError:
+            printdbg("Invalid cache entry for %s" % url)
+            return None
+
+        if meta.get('url') != url:
+            return None
+        return meta, body
+
+    def put(self, url, headers, body):
+        """
+        Store the response of X{url}.
+
+        @param headers: headers of the response
+        @type headers: L{mimetools.Message}
+        @param body: body of the response
+        @type body: C{str}
+        """
+        meta = get_meta(url, headers)
+
+        filename = self._get_filename(url)
+        create_dir(os.path.dirname(filename))
+
+        # The body goes first, so an entry is never read with the
+        # metadata of a newer response and an older body
+        self._write(filename + '.body', body)
+        self._write(filename + '.json', json.dumps(meta))
+
+    def _write(self, filename, data):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, filename)
+        except:
+            os.unlink(tmp)
+            raise
+
+    def add_conditions(self, request, meta):
+        """
+        Make X{request} conditional on the cached response.
+
+        @param request: request to send
+        @type request: L{urllib2.Request}
+        @param meta: metadata of the cached response
+        @type meta: C{dict}
+        """
+        if meta.get('etag'):
+            request.add_unredirected_header('If-None-Match',
+                                            meta['etag'].encode('latin-1'))
+        if meta.get('last_modified'):
+            request.add_unredirected_header('If-Modified-Since',
+                                            meta['last_modified'].encode('latin-1'))
+
+
+class MemoryCache(HTTPCache):
+    """
+    Responses of GET requests kept in memory, for the requests of a
+    session. When the bodies take more than X{size} bytes, the least
+    recently used responses are discarded.
+
+    @param size: maximum number of bytes of the bodies
+    @type size: C{int}
+    """
+
+    def __init__(self, size=MEMORY_CACHE_SIZE):
+        self.size = size
+        self.used = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry is not None:
+                self.entries[url] = entry
+            return entry
+
+    def put(self, url, headers, body):
+        meta = get_meta(url, headers)
+        with self.lock:
+            old = self.entries.pop(url, None)
+            if old is not None:
+                self.used -= len(old[1])
+            if len(body) > self.size:
+                return
+            self.entries[url] = (meta, body)
+            self.used += len(body)
+            while self.used > self.size:
+                meta, body = self.entries.popitem(last=False)[1]
+                self.used -= len(body)
+
+
+def get_meta(url, headers):
+    """
+    Return the metadata stored with the response of X{url}.
+
+    @param headers: headers of the response
+    @type headers: L{mimetools.Message}
+
+    @rtype: C{dict}
+    """
+    def decode(value):
+        return value is not None and value.decode('latin-1') or None
+
+    lines = [decode(line) for line in headers.headers
+             if line.split(':', 1)[0].strip().lower() not in SKIPPED_HEADERS]
+    return {'url': url,
+            'etag': decode(headers.getheader('ETag')),
+            'last_modified': decode(headers.getheader('Last-Modified')),
+            'headers': lines}
+
+
+def is_cacheable(headers):
+    """
+    Check whether a response can be revalidated later.
+
+    @param headers: headers of the response
+    @type headers: L{mimetools.Message}
+
+    @rtype: C{bool}
+    """
+    if 'no-store' in (headers.getheader('Cache-Control') or '').lower():
+        return False
+    # The response depends on headers of the request not known
+    if (headers.getheader('Vary') or '').strip() == '*':
+        return False
+    return headers.getheader('ETag') is not None or \
+        headers.getheader('Last-Modified') is not None
+
+
+def make_response(url, meta, body):
+    """
+    Build a response from a cached entry.
+
+    @rtype: L{urllib2.addinfourl}
+    """
+    lines = [line.encode('latin-1') for line in meta['headers']]
+    headers = httplib.HTTPMessage(StringIO(''.join(lines)))
+    resp = urllib2.addinfourl(StringIO(body), headers, url)
+    resp.code = 200
+    resp.msg = 'OK'
+    resp.from_cache = True
+    return resp
+
+
+def get_cache_dir(path):
+    """
+    Return the directory of the cache for the value of the X{path}
+    option. An empty value means the cache directory of Bicho.
+
+    @rtype: C{str}
+    """
+    if not path:
+        return os.path.join(bicho_dot_dir(), 'cache', 'http')
+    return os.path.abspath(os.path.expanduser(path))
@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+"""
+HTTP client shared by the backends.
+
+Connections are kept alive and reused for the following requests
+to the same host. Responses are compressed with gzip or deflate when
+the server supports it. Cookies set by the trackers, such as session
+cookies after a login, are stored in a jar shared by all requests.
+Basic authentication credentials can be registered per host.
+When the X{path} option is set, GET requests are revalidated against
+the responses stored in the on-disk cache of L{bicho.httpcache}.
+"""
+
+import base64
+import cookielib
+import gzip
+import httplib
+import socket
+import threading
+import urllib2
+import urlparse
+import zlib
+
+from cStringIO import StringIO
+
+from bicho import httpcache, ratelimit
+from bicho.config import Config
+from bicho.utils import printdbg
+
+# Idle connections kept for each host
+MAX_IDLE_CONNECTIONS = 4
+
+# Bytes read from the socket at once by streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of idle HTTP connections, grouped by host.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return an idle connection for X{key} or C{None}.
+        """
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop()
+        return None
+
+    def put(self, key, conn):
+        """
+        Keep the connection to be reused.
+        """
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """
+        Close all the idle connections.
+        """
+        with self.lock:
+            for connections in self.idle.values():
+                for conn in connections:
+                    conn.close()
+            self.idle = {}
+
+
+class KeepAliveMixin:
+    """
+    Open requests reusing the connections of a L{ConnectionPool}.
+
+    The body of the response is read at once, so the connection can
+    be given back to the pool before the caller reads the response.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def do_open(self, http_class, req, **http_conn_args):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers = dict(
+            (name.title(), val) for name, val in headers.items())
+        headers['Connection'] = 'keep-alive'
+        headers.setdefault('Accept-Encoding', 'gzip, deflate')
+
+        tunnel_headers = {}
+        if req._tunnel_host and 'Proxy-Authorization' in headers:
+            tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+
+        key = (http_class, host, req._tunnel_host)
+
+        stream = getattr(req, 'stream', False)
+
+        while True:
+            conn = self.pool.get(key)
+            reused = conn is not None
+            if not reused:
+                printdbg("Opening connection to %s" % host)
+                conn = http_class(host, timeout=req.timeout, **http_conn_args)
+                if req._tunnel_host:
+                    conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+
+            try:
+                conn.request(req.get_method(), req.get_selector(),
+                             req.data, headers)
+                r = conn.getresponse()
+                if not stream:
+                    data = r.read()
+            except (socket.error, httplib.HTTPException), err:
+                conn.close()
+                # The server may have closed an idle connection
+                if reused:
+                    continue
+                raise urllib2.URLError(err)
+            break
+
+        if stream:
+            fp = StreamingBody(self.pool, key, conn, r)
+        else:
+            if r.will_close:
+                conn.close()
+            else:
+                self.pool.put(key, conn)
+            fp = StringIO(decode_body(data, r.msg))
+
+        resp = urllib2.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+
+class StreamingBody(object):
+    """
+    Body of a response read from the socket while the caller consumes
+    it. Compressed bodies are decoded on the fly. The connection goes
+    back to the pool once the whole body has been read.
+
+    @param pool: pool the connection belongs to
+    @type pool: L{ConnectionPool}
+    @param key: key of the connection in the pool
+    @type key: C{tuple}
+    @param conn: connection the response is read from
+    @type conn: L{httplib.HTTPConnection}
+    @param response: response whose body is read
+    @type response: L{httplib.HTTPResponse}
+    """
+
+    def __init__(self, pool, key, conn, response):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.buffer = ''
+
+        encoding = (response.msg.getheader('Content-Encoding') or '').lower()
+        if encoding == 'gzip':
+            self.decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self.decoder = zlib.decompressobj()
+        else:
+            self.decoder = None
+
+        if self.decoder:
+            del response.msg['Content-Encoding']
+            if 'Content-Length' in response.msg:
+                del response.msg['Content-Length']
+        self.encoding = encoding
+        self.first = True
+
+    def _decode(self, data):
+        if not self.decoder:
+            return data
+        try:
+            data = self.decoder.decompress(data)
+        except zlib.error:
+            if not (self.first and self.encoding == 'deflate'):
+                raise
+            # Raw deflate streams without zlib header
+            self.decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self.decoder.decompress(data)
+        self.first = False
+        return data
+
+    def _fill(self, size):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+
+        while self.conn is not None and (size < 0 or length < size):
+            data = self.response.read(STREAM_CHUNK_SIZE)
+            if not data:
+                if self.decoder:
+                    chunks.append(self.decoder.flush())
+                self._release()
+                break
+            data = self._decode(data)
+            chunks.append(data)
+            length += len(data)
+
+        self.buffer = ''.join(chunks)
+
+    def _release(self):
+        if self.response.will_close:
+            self.conn.close()
+        else:
+            self.pool.put(self.key, self.conn)
+        self.conn = None
+
+    def read(self, size=-1):
+        self._fill(size)
+        if size < 0:
+            size = len(self.buffer)
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        while '\n' not in self.buffer and self.conn is not None:
+            self._fill(len(self.buffer) + STREAM_CHUNK_SIZE)
+        end = self.buffer.find('\n') + 1 or len(self.buffer)
+        if size >= 0:
+            end = min(end, size)
+        data = self.buffer[:end]
+        self.buffer = self.buffer[end:]
+        return data
+
+    def close(self):
+        # A connection with unread data can not be reused
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.buffer = ''
+
+
+class KeepAliveHTTPHandler(KeepAliveMixin, urllib2.HTTPHandler):
+
+    def __init__(self, pool):
+        urllib2.HTTPHandler.__init__(self)
+        KeepAliveMixin.__init__(self, pool)
+
+
+class KeepAliveHTTPSHandler(KeepAliveMixin, urllib2.HTTPSHandler):
+
+    def __init__(self, pool):
+        urllib2.HTTPSHandler.__init__(self)
+        KeepAliveMixin.__init__(self, pool)
+
+
+class BasicAuthProcessor(urllib2.BaseHandler):
+    """
+    Add the basic authentication header to the requests sent to the
+    hosts with registered credentials, without waiting for a 401
+    response.
+
+    @param credentials: encoded credentials by host
+    @type credentials: C{dict}
+    """
+
+    handler_order = 490
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+
+    def http_request(self, req):
+        auth = self.credentials.get(req.get_host().lower())
+        if auth and not req.has_header('Authorization'):
+            req.add_unredirected_header('Authorization', 'Basic %s' % auth)
+        return req
+
+    https_request = http_request
+
+
+def decode_body(data, headers):
+    """
+    Decompress the body of a response, removing the
+    X{Content-Encoding} header once decoded.
+
+    @param data: body of the response
+    @type data: C{str}
+    @param headers: headers of the response
+    @type headers: L{mimetools.Message}
+
+    @return: the decoded body
+    @rtype: C{str}
+    """
+    encoding = (headers.getheader('Content-Encoding') or '').lower()
+
+    if encoding == 'gzip':
+        data = gzip.GzipFile(fileobj=StringIO(data)).read()
+    elif encoding == 'deflate':
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            # Raw deflate streams without zlib header
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+    else:
+        return data
+
+    del headers['Content-Encoding']
+    if 'Content-Length' in headers:
+        headers['Content-Length'] = str(len(data))
+    return data
+
+
+cookie_jar = cookielib.CookieJar()
+
+_pool = ConnectionPool()
+_credentials = {}
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_handlers():
+    """
+    Return handlers sharing the connections, cookies and credentials
+    of the client, for libraries that build their own opener like
+    feedparser.
+
+    @rtype: C{list} of L{urllib2.BaseHandler}
+    """
+    return [urllib2.HTTPCookieProcessor(cookie_jar),
+            BasicAuthProcessor(_credentials),
+            KeepAliveHTTPHandler(_pool), KeepAliveHTTPSHandler(_pool)]
+
+
+_opener = urllib2.build_opener(*get_handlers())
+
+
+def add_credentials(url, user, password):
+    """
+    Send basic authentication credentials to the host of X{url}.
+    """
+    host = urlparse.urlparse(url).netloc.lower()
+    _credentials[host] = base64.b64encode('%s:%s' % (user, password))
+
+
+def get_cookies(url=None):
+    """
+    Return the cookies stored in the jar.
+
+    @param url: return only the cookies of the host of this URL
+    @type url: C{str}
+
+    @return: cookie values by name
+    @rtype: C{dict}
+    """
+    host = url and urlparse.urlparse(url).hostname
+    cookies = {}
+    for c in cookie_jar:
+        if not host or host.endswith(c.domain.lstrip('.')):
+            cookies[c.name] = c.value
+    return cookies
+
+
+def get_cache():
+    """
+    Return the cache of responses, C{None} when the X{path} option
+    is not set.
+
+    @rtype: L{httpcache.HTTPCache}
+    """
+    global _cache
+
+    path = getattr(Config, 'path', None)
+    if path is None:
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = httpcache.HTTPCache(httpcache.get_cache_dir(path))
+        return _cache
+
+
+def reset():
+    """
+    Forget the registered credentials and the cache of responses, so
+    the next ones are built from the current options. Used when the
+    options change between the trackers crawled by a process.
+    Connections and cookies are kept.
+    """
+    global _cache
+
+    with _cache_lock:
+        _cache = None
+    _credentials.clear()
+
+
+def urlopen(request, data=None, stream=False, cache=None):
+    """
+    Open an URL with the shared client, waiting for the rate limit
+    of its host.
+
+    GET requests of URLs found in the cache are sent with the
+    X{If-None-Match} and X{If-Modified-Since} headers. When the
+    server answers that the resource did not change, the cached
+    response is returned with its attribute X{from_cache} set.
+
+    @param request: URL or request to open
+    @type request: C{str} or L{urllib2.Request}
+    @param data: data sent in the body of the request
+    @type data: C{str}
+    @param stream: read the body from the socket while it is consumed,
+      instead of at once. Streamed responses are not cached.
+    @type stream: C{bool}
+    @param cache: cache used instead of the one set by the X{path}
+      option
+    @type cache: L{httpcache.HTTPCache}
+
+    @return: the response
+    @rtype: file-like object
+    """
+    if not isinstance(request, urllib2.Request):
+        request = urllib2.Request(request)
+    request.stream = stream
+
+    if cache is None:
+        cache = get_cache()
+    if cache is None or stream or data is not None or request.has_data():
+        return ratelimit.urlopen(request, data, opener=_opener)
+
+    url = request.get_full_url()
+    entry = cache.get(url)
+    if entry is not None:
+        cache.add_conditions(request, entry[0])
+
+    try:
+        f = ratelimit.urlopen(request, opener=_opener)
+    except urllib2.HTTPError as e:
+        if e.code != 304 or entry is None:
+            raise
+        printdbg("Not modified, using cached %s" % url)
+        return httpcache.make_response(url, *entry)
+
+    headers = f.info()
+    if not httpcache.is_cacheable(headers):
+        return f
+
+    body = f.read()
+    cache.put(url, headers, body)
+    resp = urllib2.addinfourl(StringIO(body), headers, f.geturl())
+    resp.code = f.code
+    resp.msg = f.msg
+    resp.from_cache = False
+    return resp
+
+
+def close():
+    """
+    Close the idle connections.
+    """
+    _pool.close()
@@ -29,13 +29,35 @@ import sys
 from config import Config, ErrorLoadingConfig, InvalidConfig
 
 from backends import Backend
-from utils import printerr, printdbg
+from utils import printerr, printdbg, printout
 
 from post_processing import IssueLogger
 
 import logging
 
 
+def run_backend():
+    """
+    Crawl the tracker given by the configuration.
+    """
+    try:
+        backend = Backend.create_backend(Config.backend)
+    except ImportError, e:
+        printerr("Backend ''" + Config.backend + "'' doesn't exist. " + str(e))
+        sys.exit(2)
+    printdbg("Bicho object created, options and backend initialized")
+    backend.run()
+
+    if Config.logtable:
+        try:
+            ilogger = IssueLogger.create_logger(Config.backend)
+        except ImportError, e:
+            printerr("Logger ''" + Config.backend + "'' doesn't exist. " + str(e))
+            sys.exit(2)
+        printdbg("Bicho logger object created")
+        ilogger.run()
+
+
 def main():
     """
     """
@@ -52,22 +74,21 @@ def main():
         printerr(str(e))
         sys.exit(2)
 
-    try:
-        backend = Backend.create_backend(Config.backend)
-    except ImportError, e:
-        printerr("Backend ''" + Config.backend + "'' doesn't exist. " + str(e))
-        sys.exit(2)
-    printdbg("Bicho object created, options and backend initialized")
-    backend.run()
+    if Config.db_upgrade:
+        from db.database import get_database
+        get_database().upgrade_tables()
+        printout("Database upgraded")
+        return
 
-    if Config.logtable:
+    if getattr(Config, 'jobs', None):
+        from orchestrator import run_jobs_file
         try:
-            ilogger = IssueLogger.create_logger(Config.backend)
-        except ImportError, e:
-            printerr("Logger ''" + Config.backend + "'' doesn't exist. " + str(e))
+            return run_jobs_file(Config.jobs)
+        except (IOError, InvalidConfig), e:
+            printerr(str(e))
             sys.exit(2)
-        printdbg("Bicho logger object created")
-        ilogger.run()
+
+    run_backend()
 
 if __name__ == "__main__":
     main()
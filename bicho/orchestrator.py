@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+"""
+Crawl several trackers in parallel.
+
+The file given by the X{jobs} option lists a tracker per line: the
+backend, the URL and any other option of Bicho. Empty lines and
+lines starting with '#' are ignored::
+
+  bg https://bugzilla.example.org/buglist.cgi?product=foo --delay 1
+  jira https://jira.example.org/browse/FOO -n 100
+
+Options not given on a line take the values of the command line and
+the configuration file. Jobs run in a pool of X{jobs_processes}
+processes, each one keeping its database connection open, and no
+more than X{jobs_per_host} jobs of the same host run at once.
+SQLite databases are written by a single process.
+"""
+
+import shlex
+import signal
+import time
+import traceback
+import urlparse
+
+from multiprocessing import Pool
+
+from bicho import httpclient, ratelimit
+from bicho.config import Config, InvalidConfig
+from bicho.db.database import DBDatabase, share_connections, \
+    rollback_shared_connections
+from bicho.utils import printdbg, printout, printerr
+
+# Options that cannot be set by a job
+GLOBAL_OPTIONS = ('jobs', 'jobs_processes', 'jobs_per_host', 'cfgfile',
+                  'db_upgrade')
+
+# Configuration of the worker before running any job
+_base_config = None
+
+
+class Job(object):
+    """
+    Tracker to crawl.
+
+    @param number: line of the jobs file
+    @type number: C{int}
+    @param backend: name of the backend
+    @type backend: C{str}
+    @param url: URL of the tracker
+    @type url: C{str}
+    @param options: options of the job, by name
+    @type options: C{dict}
+    """
+
+    def __init__(self, number, backend, url, options):
+        self.number = number
+        self.backend = backend
+        self.url = url
+        self.options = options
+        self.host = urlparse.urlparse(url).netloc
+
+
+class JobResult(object):
+    """
+    Summary of a crawled tracker.
+
+    @param job: the crawled tracker
+    @type job: L{Job}
+    @param status: C{'ok'} or the error that stopped the job
+    @type status: C{str}
+    @param issues: number of issues stored
+    @type issues: C{int}
+    @param elapsed: seconds spent on the job
+    @type elapsed: C{float}
+    """
+
+    def __init__(self, job, status, issues, elapsed):
+        self.job = job
+        self.status = status
+        self.issues = issues
+        self.elapsed = elapsed
+
+    def rate(self):
+        """
+        Return the number of issues stored per second.
+
+        @rtype: C{float}
+        """
+        if not self.elapsed:
+            return 0.0
+        return self.issues / self.elapsed
+
+
+def parse_jobs(lines):
+    """
+    Parse the lines of a jobs file.
+
+    @param lines: lines of the file
+    @type lines: C{iterable} of C{str}
+
+    @return: the jobs in the same order
+    @rtype: C{list} of L{Job}
+
+    @raise InvalidConfig: when a line is not valid
+    """
+    parser = Config.create_parser()
+    defaults = vars(parser.parse_args([]))
+
+    jobs = []
+    for number, line in enumerate(lines, 1):
+        args = shlex.split(line, comments=True)
+        if not args:
+            continue
+        if len(args) < 2:
+            raise InvalidConfig('Line %s of jobs file: backend and URL '
+                                'are required' % number)
+
+        try:
+            options = parser.parse_args(['-b', args[0], '-u', args[1]] +
+                                        args[2:])
+        except SystemExit:
+            raise InvalidConfig('Line %s of jobs file: invalid options'
+                                % number)
+
+        # Only the options given on the line are set
+        options = dict((name, value) for name, value in vars(options).items()
+                       if value != defaults[name] and
+                       name not in GLOBAL_OPTIONS)
+
+        try:
+            Config.check_logtable(
+                options.get('logtable', getattr(Config, 'logtable', False)),
+                options.get('db_driver_out',
+                            getattr(Config, 'db_driver_out', None)))
+        except InvalidConfig, e:
+            raise InvalidConfig('Line %s of jobs file: %s' % (number, e))
+        jobs.append(Job(number, args[0], args[1], options))
+    return jobs
+
+
+def _init_worker():
+    global _base_config
+
+    # Ctrl-C is handled by the main process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    share_connections()
+    _base_config = dict(vars(Config))
+
+
+def _set_job_config(options):
+    for name in vars(Config).keys():
+        if name not in _base_config:
+            delattr(Config, name)
+    Config.__dict__.update(_base_config)
+    Config.__dict__.update(options)
+
+    # The rate limiter, the credentials and the cache were built from
+    # the options of the previous job
+    ratelimit.reset()
+    httpclient.reset()
+
+
+def _run_job(job):
+    # Imported here to avoid circular dependencies
+    from bicho.main import run_backend
+
+    status = 'ok'
+    issues = DBDatabase.total_issues
+    start = time.time()
+
+    try:
+        _set_job_config(job.options)
+        Config.check_config()
+        run_backend()
+    except SystemExit, e:
+        # Some backends exit when there is nothing to retrieve
+        if e.code:
+            status = 'exit %s' % e.code
+    except Exception, e:
+        printerr("Error crawling %s: %s" % (job.url, e))
+        traceback.print_exc()
+        status = 'error: %s' % e
+        rollback_shared_connections()
+
+    return JobResult(job, status, DBDatabase.total_issues - issues,
+                     time.time() - start)
+
+
+def run_jobs(jobs, processes, per_host):
+    """
+    Crawl the trackers of X{jobs}.
+
+    Jobs start in the order of the list when there is a free process
+    and the number of running jobs of its host is under X{per_host}.
+
+    @param jobs: trackers to crawl
+    @type jobs: C{list} of L{Job}
+    @param processes: number of jobs running at once
+    @type processes: C{int}
+    @param per_host: number of jobs of the same host running at once
+    @type per_host: C{int}
+
+    @return: the results, in the order the jobs finished
+    @rtype: C{list} of L{JobResult}
+    """
+    processes = max(processes, 1)
+    per_host = max(per_host, 1)
+
+    pending = list(jobs)
+    running = {}
+    started = {}
+    results = []
+
+    pool = Pool(processes, _init_worker)
+    try:
+        while pending or running:
+            for job in list(pending):
+                if sum(running.values()) >= processes:
+                    break
+                if running.get(job.host, 0) >= per_host:
+                    continue
+                pending.remove(job)
+                running[job.host] = running.get(job.host, 0) + 1
+                printdbg("Starting job of line %s: %s" % (job.number, job.url))
+                started[pool.apply_async(_run_job, (job,))] = \
+                    (job, time.time())
+
+            # A timeout keeps the wait interruptible by Ctrl-C
+            while True:
+                done = [r for r in started if r.ready()]
+                if done:
+                    break
+                started.keys()[0].wait(1)
+
+            ended = done[0]
+            job, start = started.pop(ended)
+            try:
+                result = ended.get()
+            except Exception, e:
+                # Errors outside the job, like results that cannot be
+                # sent back by the worker
+                printerr("Error crawling %s: %s" % (job.url, e))
+                result = JobResult(job, 'error: %s' % e, 0,
+                                   time.time() - start)
+
+            running[result.job.host] -= 1
+            if not running[result.job.host]:
+                del running[result.job.host]
+            results.append(result)
+            printout("Job of line %s finished (%s): %s issues in %.1f s"
+                     % (result.job.number, result.status, result.issues,
+                        result.elapsed))
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    return results
+
+
+def print_summary(results):
+    """
+    Print the issues stored per second of each tracker.
+
+    @param results: results of the jobs
+    @type results: C{list} of L{JobResult}
+    """
+    printout("%-8s %-8s %10s %10s %10s  %s"
+             % ('Backend', 'Status', 'Issues', 'Time (s)', 'Issues/s', 'URL'))
+    for result in sorted(results, key=lambda r: r.job.number):
+        status = result.status == 'ok' and 'ok' or 'failed'
+        printout("%-8s %-8s %10d %10.1f %10.2f  %s"
+                 % (result.job.backend, status, result.issues,
+                    result.elapsed, result.rate(), result.job.url))
+
+    issues = sum(r.issues for r in results)
+    elapsed = sum(r.elapsed for r in results)
+    failed = len([r for r in results if r.status != 'ok'])
+    printout("%s trackers, %s failed, %s issues (%.2f issues/s per process)"
+             % (len(results), failed, issues, elapsed and issues / elapsed or 0))
+
+
+def run_jobs_file(filename):
+    """
+    Crawl the trackers listed in X{filename} using the options
+    X{jobs_processes} and X{jobs_per_host}.
+
+    @param filename: path of the jobs file
+    @type filename: C{str}
+
+    @return: 0 when all the jobs finished without errors, 1 otherwise
+    @rtype: C{int}
+    """
+    with open(filename) as f:
+        jobs = parse_jobs(f)
+
+    processes = getattr(Config, 'jobs_processes', None) or 1
+    per_host = getattr(Config, 'jobs_per_host', None) or 1
+
+    # Writers of a SQLite file wait for each other until they time out
+    if getattr(Config, 'db_driver_out', None) == 'sqlite' and processes > 1:
+        printout("SQLite databases only allow one writer, " +
+                 "jobs will run in one process")
+        processes = 1
+    printout("Running %s jobs in %s processes" % (len(jobs), processes))
+
+    results = run_jobs(jobs, processes, per_host)
+    print_summary(results)
+
+    if [r for r in results if r.status != 'ok']:
+        return 1
+    return 0
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+"""
+Rate limiting of the requests sent to the trackers.
+
+Every host has its own token bucket. A request takes one token and
+waits when the bucket is empty, so the time spent downloading and
+storing issues counts towards the delay between requests. Servers
+can ask to slow down using the X{Retry-After} or the GitHub
+X{X-RateLimit-Remaining} and X{X-RateLimit-Reset} headers.
+"""
+
+import threading
+import time
+import urllib2
+import urlparse
+
+from email.utils import parsedate_tz, mktime_tz
+
+from bicho.backends import Backend
+from bicho.config import Config
+from bicho.utils import printdbg, printout
+
+# Times a request is retried when the server asks to wait
+MAX_RETRIES = 3
+
+# Status codes sent along with Retry-After
+RETRY_STATUS = (429, 503)
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket.
+
+    @param rate: tokens added per second, C{None} for no limit
+    @type rate: C{float}
+    @param burst: maximum number of tokens stored
+    @type burst: C{int}
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.last = time.time()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting until it is available.
+
+        @return: seconds waited
+        @rtype: C{float}
+        """
+        with self.lock:
+            now = time.time()
+            wait = max(self.paused_until - now, 0)
+
+            if self.rate:
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                # Tokens can become negative, so callers that arrive
+                # while others are waiting queue up behind them
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        """
+        Do not give tokens during the given number of seconds.
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+
+
+class RateLimiter(object):
+    """
+    Limit the requests sent to each host.
+
+    @param rate: requests per second allowed for each host, C{None}
+      for no limit
+    @type rate: C{float}
+    @param burst: requests that can be sent at once after being idle
+    @type burst: C{int}
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _get_bucket(self, url):
+        host = urlparse.urlparse(url).netloc.lower()
+
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    def wait(self, url):
+        """
+        Wait until a request to the host of X{url} can be sent.
+
+        @return: seconds waited
+        @rtype: C{float}
+        """
+        return self._get_bucket(url).acquire()
+
+    def pause(self, url, seconds):
+        """
+        Stop sending requests to the host of X{url} for the given
+        number of seconds.
+        """
+        printout("Server asked to wait. Sleeping %s seconds" % int(seconds))
+        self._get_bucket(url).pause(seconds)
+
+    def update(self, url, headers):
+        """
+        Honour the rate limit hints sent by the server.
+
+        @param url: requested URL
+        @type url: C{str}
+        @param headers: headers of the response
+        @type headers: L{mimetools.Message}
+
+        @return: seconds requests are paused, C{None} when the server
+          did not ask to wait
+        @rtype: C{float}
+        """
+        seconds = get_retry_after(headers)
+
+        if seconds is None:
+            remaining = headers.getheader('X-RateLimit-Remaining')
+            reset = headers.getheader('X-RateLimit-Reset')
+            if remaining is not None and reset is not None:
+                try:
+                    if int(remaining) == 0:
+                        seconds = max(int(reset) - time.time(), 0) + 1
+                except ValueError:
+                    printdbg("Invalid rate limit headers: %s, %s"
+                             % (remaining, reset))
+
+        if seconds is not None:
+            self.pause(url, seconds)
+        return seconds
+
+
+def get_retry_after(headers):
+    """
+    Get the seconds to wait from the X{Retry-After} header, that
+    can be a number of seconds or an HTTP date.
+
+    @return: seconds to wait, C{None} when the header is not set
+    @rtype: C{float}
+    """
+    value = headers.getheader('Retry-After')
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    date = parsedate_tz(value)
+    if date is None:
+        printdbg("Invalid Retry-After header: %s" % value)
+        return None
+    return max(mktime_tz(date) - time.time(), 0)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Return the rate limiter shared by all the backends.
+
+    Its rate is set by the X{rate} option or, when not given, the
+    requests the backend sends for an issue every X{delay} seconds,
+    the pace of the old sleep after each issue.
+
+    @rtype: L{RateLimiter}
+    """
+    global _rate_limiter
+
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            rate = getattr(Config, 'rate', None)
+            if rate is None:
+                delay = float(getattr(Config, 'delay', 0) or 0)
+                rate = delay and get_requests_per_delay() / delay or None
+            burst = getattr(Config, 'burst', None) or 1
+            _rate_limiter = RateLimiter(rate, burst)
+        return _rate_limiter
+
+
+def get_requests_per_delay():
+    """
+    Return the requests sent by the backend of the X{backend} option
+    between two sleeps of X{delay} seconds, given by the attribute
+    X{requests_per_delay} of its class.
+
+    @rtype: C{float}
+    """
+    backend = Backend._backends.get(getattr(Config, 'backend', None))
+    return float(getattr(backend, 'requests_per_delay', 1))
+
+
+def reset():
+    """
+    Forget the rate limiter, so the next one is built from the
+    current options. Used when the options change between the
+    trackers crawled by a process.
+    """
+    global _rate_limiter
+
+    with _rate_limiter_lock:
+        _rate_limiter = None
+
+
+def wait(url):
+    """
+    Wait until a request to X{url} can be sent. Used by the backends
+    that do not open the URLs themselves.
+    """
+    return get_rate_limiter().wait(url)
+
+
+def urlopen(request, data=None, opener=None):
+    """
+    Open an URL waiting for the rate limit of its host.
+
+    Requests rejected with a X{Retry-After} header or because the
+    GitHub rate limit was exceeded are sent again once the server
+    allows it.
+
+    @param request: URL or request to open
+    @type request: C{str} or L{urllib2.Request}
+    @param data: data sent in the body of the request
+    @type data: C{str}
+    @param opener: opener used instead of the installed one
+    @type opener: L{urllib2.OpenerDirector}
+
+    @return: the response
+    @rtype: file-like object
+    """
+    if isinstance(request, urllib2.Request):
+        url = request.get_full_url()
+    else:
+        url = request
+
+    limiter = get_rate_limiter()
+    open_url = opener and opener.open or urllib2.urlopen
+    retries = 0
+
+    while True:
+        limiter.wait(url)
+        try:
+            f = open_url(request, data)
+        except urllib2.HTTPError as e:
+            seconds = limiter.update(url, e.info())
+            if seconds is None or retries >= MAX_RETRIES or \
+                    e.code not in RETRY_STATUS + (403,):
+                raise
+            retries += 1
+            printdbg("Retrying %s (%s/%s)" % (url, retries, MAX_RETRIES))
+            continue
+
+        limiter.update(url, f.info())
+        return f
@@ -25,10 +25,13 @@ import cgi
 import errno
 import os
 import random
+import re
 import sys
 import time
 import urllib
 
+from collections import OrderedDict
+
 from config import Config
 
 def printout(str='\n'):
@@ -136,3 +139,78 @@ def valid_XML_char_ordinal(i):
             or 0xE000 <= i <= 0xFFFD
             or 0x10000 <= i <= 0x10FFFF
     )
+
+
+# Control bytes not allowed by XML 1.0. The rest of the bytes of an
+# UTF-8 string are valid, as they belong to valid characters.
+_INVALID_XML_BYTES = ''.join(chr(i) for i in range(0x20)
+                             if not valid_XML_char_ordinal(i))
+
+# Control characters, surrogates and non-characters not allowed by
+# XML 1.0. Narrow builds store characters outside the BMP as surrogate
+# pairs, so only the unpaired ones are removed.
+if sys.maxunicode > 0xFFFF:
+    _INVALID_XML_CHARS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f'
+                                    u'\ud800-\udfff\ufffe\uffff]')
+else:
+    _INVALID_XML_CHARS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]'
+                                    u'|[\ud800-\udbff](?![\udc00-\udfff])'
+                                    u'|(?<![\ud800-\udbff])[\udc00-\udfff]')
+
+
+def strip_invalid_xml_chars(data):
+    """
+    Remove the characters not allowed by XML 1.0 from X{data}.
+
+    @param data: XML document or fragment, byte strings are expected
+      to be UTF-8 encoded
+    @type data: C{str} or C{unicode}
+
+    @return: the cleaned data and the number of characters removed,
+      or bytes for byte strings
+    @rtype: C{tuple} of (C{str} or C{unicode}, C{int})
+    """
+    if isinstance(data, unicode):
+        cleaned = _INVALID_XML_CHARS.sub(u'', data)
+    else:
+        cleaned = data.translate(None, _INVALID_XML_BYTES)
+    return cleaned, len(data) - len(cleaned)
+
+
+class LRUCache(object):
+    """
+    Dictionary bounded to X{size} entries. When it is full, the least
+    recently used entry is discarded.
+
+    @param size: maximum number of entries
+    @type size: C{int}
+    """
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        self._data[key] = value
+        return value
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def remove(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
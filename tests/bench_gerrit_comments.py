@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Bitergia
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Micro-benchmark of the changes found in the comments of Gerrit reviews.
+
+Compares the single-pass classify_comments with the three walks over
+the comments, recompiling their regexes and parsing the formatted
+local time of each change, it replaced. The reviews of
+data/gerrit/reviews.json, in the format of gerrit query, are repeated
+to reach the given number of reviews.
+
+$ python bench_gerrit_comments.py [number of reviews]
+"""
+
+import json
+import os
+import re
+import sys
+import time
+import timeit
+
+from dateutil.parser import parse
+
+sys.path.insert(0, "..")
+from bicho.config import Config
+from bicho.common import Change, People
+
+Config.delay = 0
+from bicho.backends.gerrit import Gerrit
+
+REPEAT = 3
+
+DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    'data', 'gerrit', 'reviews.json')
+
+
+class Target(object):
+    """
+    Issue receiving the changes.
+    """
+
+    def __init__(self, status):
+        self.status = status
+        self.changes = []
+
+    def add_change(self, change):
+        self.changes.append(change)
+
+
+def old_convert_to_datetime(date):
+    return parse(time.strftime('%Y %m %d %H:%M:%S', time.localtime(date)))
+
+
+def old_merged_abandoned(gerrit, review, issue):
+    if (issue.status<>'MERGED' and issue.status<>'ABANDONED'): return
+
+    ABANDONED_REGEXP_1 = re.compile(r'^Patch Set (.*?): Abandoned(.*)')
+    ABANDONED_REGEXP_2 = re.compile(r'^Abandoned(.*)')
+    patchSets = review['patchSets']
+    comments = review['comments']
+    by = None
+    date = None
+    patchNumber = unicode('')
+
+    if (issue.status=='MERGED'):
+        for activity in patchSets:
+            if "approvals" not in activity.keys():
+                continue
+            patchSetNumber = activity['number']
+            for entry in activity['approvals']:
+                if (entry['type']=='Code-Review' and entry['value']=='2'):
+                    by = People(entry['by']['username'])
+                    date = old_convert_to_datetime(entry["grantedOn"])
+                    patchNumber = patchSetNumber
+
+    if (issue.status=='ABANDONED'):
+        for comment in comments:
+            if (ABANDONED_REGEXP_1.match(comment["message"]) or
+               ABANDONED_REGEXP_2.match(comment["message"])):
+                by = People(comment['reviewer']["username"])
+                date = old_convert_to_datetime(comment["timestamp"])
+
+    if (by and date):
+        change = Change(unicode("status"), patchNumber,
+                        issue.status, by, date)
+        issue.add_change(change)
+
+
+def old_uploaded(gerrit, review, issue):
+    UPLOAD_REGEXP_1 = re.compile(r'^Uploaded patch set (.*?).')
+    UPLOAD_REGEXP_2 = re.compile(r'^Patch Set (.*?):(.*)')
+    comments = review['comments']
+    patchset_added = []
+    for comment in comments:
+        by = People(comment['reviewer']["username"])
+        if (UPLOAD_REGEXP_2.match(comment["message"])):
+            patchset = comment["message"].split("Patch Set ")[1]
+            patchset = patchset.split(":")[0]
+        elif (UPLOAD_REGEXP_1.match(comment["message"])):
+            patchset = comment["message"].split(" ")[3]
+            patchset = patchset.split(".")[0]
+        else:
+            continue
+        if patchset in patchset_added: continue
+        patchset_added.append(patchset)
+        change = Change(unicode("status"), unicode(patchset),
+                        unicode("UPLOADED"), by,
+                        old_convert_to_datetime(comment["timestamp"]))
+        issue.add_change(change)
+
+
+def old_merged_abandoned_from_comments(gerrit, review, issue):
+    ABANDONED_REGEXP_1 = re.compile(r'^Patch Set (.*?): Abandoned(.*)')
+    ABANDONED_REGEXP_2 = re.compile(r'^Abandoned(.*)')
+    RESTORED_REGEXP_1 = re.compile(r'^Patch Set (.*?): Restored(.*)')
+    RESTORED_REGEXP_2 = re.compile(r'^Restored(.*)')
+    abandoned = False
+
+    comments = review['comments']
+    for comment in comments:
+        by = People(comment['reviewer']["username"])
+        if (comment["message"] == "Change has been successfully merged into the git repository."):
+            change = Change(unicode("status"), unicode(""),
+                            unicode("MERGED"), by,
+                            old_convert_to_datetime(comment["timestamp"]))
+            issue.add_change(change)
+        elif (ABANDONED_REGEXP_1.match(comment["message"]) or
+              ABANDONED_REGEXP_2.match(comment["message"])):
+            abandoned = True
+            by_abandoned = by
+            date_abandoned = old_convert_to_datetime(comment["timestamp"])
+        elif (RESTORED_REGEXP_1.match(comment["message"]) or
+              RESTORED_REGEXP_2.match(comment["message"])):
+            abandoned = False
+
+    if (abandoned):
+        change = Change(unicode("status"), unicode(""),
+                        unicode("ABANDONED"), by_abandoned, date_abandoned)
+        issue.add_change(change)
+
+
+def old_changes(gerrit, reviews):
+    issues = []
+    for review in reviews:
+        issue = Target(review['status'])
+        old_merged_abandoned(gerrit, review, issue)
+        old_uploaded(gerrit, review, issue)
+        old_merged_abandoned_from_comments(gerrit, review, issue)
+        issues.append(issue)
+    return issues
+
+
+def new_changes(gerrit, reviews):
+    issues = []
+    for review in reviews:
+        issue = Target(review['status'])
+        events = gerrit.classify_comments(review)
+        gerrit.add_merged_abandoned_changes(review, issue, events)
+        gerrit.add_uploaded_patchset_from_comments(review, issue, events)
+        gerrit.add_merged_abandoned_changes_from_comments(review, issue,
+                                                          events)
+        issues.append(issue)
+    return issues
+
+
+def load_reviews(number):
+    """
+    Reviews of the dump, repeated until there are X{number}.
+    """
+    with open(DUMP) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    reviews = [e for e in entries if 'project' in e]
+    return [reviews[i % len(reviews)] for i in range(number)]
+
+
+def summary(issues):
+    return [[(c.field, c.old_value, c.new_value, c.changed_by.user_id,
+              c.changed_on) for c in issue.changes] for issue in issues]
+
+
+def bench(name, func, gerrit, reviews):
+    best = min(timeit.repeat(lambda: func(gerrit, reviews), number=1,
+                             repeat=REPEAT))
+    print "%-34s %8.3f s %8.0f reviews/s" % (name, best, len(reviews) / best)
+    return best
+
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    reviews = load_reviews(number)
+    gerrit = Gerrit()
+
+    changes = summary(new_changes(gerrit, reviews))
+    assert changes == summary(old_changes(gerrit, reviews))
+    print "%s reviews, %s comments, %s changes" % \
+        (len(reviews), sum(len(r['comments']) for r in reviews),
+         sum(len(c) for c in changes))
+
+    old = bench("three walks", old_changes, gerrit, reviews)
+    new = bench("classify_comments", new_changes, gerrit, reviews)
+    print "speedup: %.1fx" % (old / new)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+"""
+Micro-benchmark of the removal of invalid XML characters.
+
+Compares strip_invalid_xml_chars with the generator over
+valid_XML_char_ordinal it replaced, on byte and unicode buffers.
+
+$ python bench_xml_chars.py [size in MiB]
+"""
+
+import random
+import sys
+import timeit
+
+sys.path.insert(0, "..")
+from bicho.utils import strip_invalid_xml_chars, valid_XML_char_ordinal
+
+REPEAT = 3
+
+
+def generator_strip(data):
+    return ''.join(c for c in data if valid_XML_char_ordinal(ord(c)))
+
+
+def make_buffer(size):
+    """
+    Bugzilla-like XML with an invalid control character every 4 KiB.
+    """
+    random.seed(0)
+    line = '<thetext>Comment with some words and UTF-8: \xc3\xb1 \xe2\x82\xac' \
+        '</thetext>\n'
+    lines = []
+    length = 0
+    while length < size:
+        if random.random() < float(len(line)) / 4096:
+            lines.append('\x0b' + line)
+        else:
+            lines.append(line)
+        length += len(lines[-1])
+    return ''.join(lines)
+
+
+def bench(name, func, data):
+    best = min(timeit.repeat(lambda: func(data), number=1, repeat=REPEAT))
+    print "%-34s %8.3f s %8.1f MiB/s" % (name, best,
+                                           len(data) / best / 2 ** 20)
+    return best
+
+
+if __name__ == '__main__':
+    size = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    data = make_buffer(int(size * 2 ** 20))
+    udata = data.decode('utf-8')
+
+    cleaned, removed = strip_invalid_xml_chars(data)
+    assert cleaned == generator_strip(data)
+    assert strip_invalid_xml_chars(udata)[0] == generator_strip(udata)
+    print "%.1f MiB, %s invalid characters" % (len(data) / 2.0 ** 20, removed)
+
+    old = bench("generator (str)", generator_strip, data)
+    new = bench("strip_invalid_xml_chars (str)", strip_invalid_xml_chars, data)
+    print "speedup: %.0fx" % (old / new)
+
+    old = bench("generator (unicode)", generator_strip, udata)
+    new = bench("strip_invalid_xml_chars (unicode)", strip_invalid_xml_chars,
+                udata)
+    print "speedup: %.0fx" % (old / new)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import datetime, glob, os, shutil, StringIO, sys, tempfile, unittest
+sys.path.insert(0, "..")
+from bicho.config import Config
+Config.debug = False
+from bicho.backends import bg
+from dateutil.parser import parse
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'data', 'bugzilla')
+
+
+def dump_changes(changes):
+    return [(c.field, c.old_value, c.new_value, c.changed_by.user_id,
+             c.changed_on) for c in changes]
+
+
+class BugzillaActivityTest(unittest.TestCase):
+    """
+    Both parsers of the activity pages must return the same changes
+    for the pages in data/bugzilla/.
+    """
+
+    def read_page(self, name):
+        return open(os.path.join(DATA_DIR, name)).read()
+
+    @unittest.skipIf(bg.etree is None, "lxml is not installed")
+    def test_parity(self):
+        pages = glob.glob(os.path.join(DATA_DIR, 'activity.*.html'))
+        self.assertTrue(pages)
+        for page in pages:
+            html = open(page).read()
+            soup = bg.SoupHtmlParser(html, '1').parse_changes()
+            fast = bg.LxmlHtmlParser(html, '1')._parse_changes_lxml()
+            self.assertEqual(dump_changes(soup), dump_changes(fast),
+                             os.path.basename(page))
+
+    def test_changes(self):
+        html = self.read_page('activity.bugzilla-4.html')
+        changes = dump_changes(bg.LxmlHtmlParser(html, '52177').parse_changes())
+        self.assertEqual(len(changes), 7)
+        self.assertEqual(changes[0],
+                         (u'Attachment #12723               Flag', u'&nbsp;',
+                          u'review?(dev&#64;example.org)',
+                          u'mar\xeda.garc\xeda@example.es',
+                          datetime.datetime(2012, 11, 19, 3, 27, 13)))
+        self.assertEqual(changes[3][:3], (u'Blocks', u'', u'51000'))
+        self.assertEqual(changes[5][:3], (u'status', u'NEW', u'RESOLVED'))
+
+    def test_no_changes(self):
+        html = self.read_page('activity.no-changes.html')
+        self.assertEqual(bg.LxmlHtmlParser(html, '60001').parse_changes(), [])
+
+    def test_fallback(self):
+        def fail():
+            raise ValueError("unexpected page")
+
+        html = self.read_page('activity.bugzilla-3.html')
+        parser = bg.LxmlHtmlParser(html, '1203')
+        parser._parse_changes_lxml = fail
+        self.assertEqual(dump_changes(parser.parse_changes()),
+                         dump_changes(bg.SoupHtmlParser(html, '1203').parse_changes()))
+
+
+class BugzillaHistoryTest(unittest.TestCase):
+    """
+    Changes of Bug.history must have the same fingerprints as the
+    changes of the activity pages, which show them escaped and in the
+    time zone of the server.
+    """
+
+    FIELD_NAMES = {'short_desc': 'Summary', 'cc': 'CC',
+                   'bug_status': 'Status', 'resolution': 'Resolution'}
+
+    HISTORY = [{'who': 'dev@example.org',
+                'when': datetime.datetime(2012, 11, 20, 10, 2, 41),
+                'changes': [{'field_name': 'short_desc',
+                             'removed': 'Parser <script> handling',
+                             'added': 'Parser mishandles <script> & '
+                                      '"quirks" mode'},
+                            {'field_name': 'cc', 'removed': '',
+                             'added': 'qa@example.org'}]},
+               {'who': 'qa@example.org',
+                'when': datetime.datetime(2012, 11, 21, 16, 0, 0),
+                'changes': [{'field_name': 'bug_status', 'removed': 'NEW',
+                             'added': 'RESOLVED'},
+                            {'field_name': 'resolution', 'removed': '',
+                             'added': 'FIXED'}]}]
+
+    def setUp(self):
+        self.config = dict(vars(Config))
+        for name, value in vars(Config.create_parser().parse_args([])).items():
+            setattr(Config, name, value)
+        Config.debug = False
+        Config.url = 'http://bugs.example.org/buglist.cgi?product=Parser'
+        Config.db_driver_out = 'sqlite'
+        self.path = tempfile.mkdtemp()
+        Config.db_database_out = os.path.join(self.path, 'bicho.db')
+        Config.bg_history_api = True
+
+        self.backend = bg.BGBackend()
+        self.pages = []
+        self.backend._urlopen_auth = self.urlopen
+        self.page = open(os.path.join(DATA_DIR,
+                                      'activity.history.html')).read()
+        self.activity = bg.LxmlHtmlParser(self.page, '52180').parse_changes()
+
+    def tearDown(self):
+        for name in vars(Config).keys():
+            if name not in self.config:
+                delattr(Config, name)
+        Config.__dict__.update(self.config)
+        shutil.rmtree(self.path)
+
+    def urlopen(self, url, stream=False):
+        self.pages.append(url)
+        return StringIO.StringIO(self.page)
+
+    def get_changes(self, history=None):
+        changes = self.backend._history_to_changes(
+            '52180', history or self.HISTORY, self.FIELD_NAMES)
+        return self.backend._get_issue_changes(self.backend.url, '52180',
+                                               {'52180': changes})
+
+    def add_server_dates(self):
+        # Dates of the XML of the issues, in winter and summer
+        self.backend.timezone.add_dates([parse('2012-11-19 03:27:13 -0800'),
+                                         parse('2012-07-02 11:00:00 -0700')])
+
+    def test_same_fingerprints(self):
+        self.add_server_dates()
+        changes = self.get_changes()
+        self.assertEqual(dump_changes(changes), dump_changes(self.activity))
+        self.assertEqual(len(self.pages), 1)
+
+        # The fields are checked once
+        self.assertEqual(dump_changes(self.get_changes()),
+                         dump_changes(self.activity))
+        self.assertEqual(len(self.pages), 1)
+        self.assertTrue(self.backend.history_api)
+
+    def test_unknown_timezone(self):
+        # Without dates of the server the activity page is used
+        changes = self.get_changes()
+        self.assertEqual(dump_changes(changes), dump_changes(self.activity))
+        self.assertEqual(len(self.pages), 1)
+        self.assertEqual(self.backend.checked_fields, set())
+
+    def test_different_changes(self):
+        self.add_server_dates()
+        history = [dict(self.HISTORY[0]), self.HISTORY[1]]
+        history[0]['changes'] = [{'field_name': 'short_desc',
+                                  'removed': 'Parser <script> handling',
+                                  'added': 'Parser mishandles scripts'},
+                                 history[0]['changes'][1]]
+        changes = self.get_changes(history)
+        self.assertEqual(dump_changes(changes), dump_changes(self.activity))
+        self.assertFalse(self.backend.history_api)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import datetime, os, shutil, sys, tempfile, unittest
+sys.path.insert(0, "..")
+from bicho.config import Config
+from bicho.common import Issue, People, Tracker, Comment, TempRelationship
+from bicho.db.database import get_database, DBIssue, DBComment, DBTracker, \
+    DBIssueRelationship
+
+
+class DatabaseTest(unittest.TestCase):
+    """
+    SQLite database in a temporary directory.
+    """
+
+    def setUp(self):
+        self.config = dict(vars(Config))
+        for name, value in vars(Config.create_parser().parse_args([])).items():
+            setattr(Config, name, value)
+        Config.debug = False
+        Config.db_driver_out = 'sqlite'
+        self.path = tempfile.mkdtemp()
+        Config.db_database_out = os.path.join(self.path, 'bicho.db')
+        Config.db_batch_size = 100
+
+        self.db = get_database()
+        self.db.insert_supported_traker('bg', '4.2')
+        self.trk = self.db.insert_tracker(
+            Tracker('http://bugs.example.org', 'bg', '4.2'))
+
+    def tearDown(self):
+        self.db.store.close()
+        for name in vars(Config).keys():
+            if name not in self.config:
+                delattr(Config, name)
+        Config.__dict__.update(self.config)
+        shutil.rmtree(self.path)
+
+    def issue(self, number):
+        date = datetime.datetime(2012, 1, 1, 10, 0, number % 60)
+        issue = Issue(str(number), 'bug', 'Summary', 'Description',
+                      People('user%s' % (number % 7)), date)
+        issue.status = 'NEW'
+        issue.assigned_to = People('nobody')
+        issue.add_comment(Comment('Comment %s' % number,
+                                  People('user%s' % (number % 3)), date))
+        return issue
+
+
+class BatchTest(DatabaseTest):
+    """
+    Issues written in bulk mode.
+    """
+
+    def test_invalid_issue_in_batch(self):
+        for number in range(150):
+            issue = self.issue(number)
+            if number == 50:
+                issue.submitted_on = None
+            self.db.insert_issue(issue, self.trk.id)
+        self.db.flush_issues()
+
+        stored = set(self.db.store.find(DBIssue.issue))
+        self.assertEqual(stored,
+                         set(unicode(n) for n in range(150) if n != 50))
+        self.assertEqual(self.db.store.find(DBComment).count(), 149)
+
+
+class PeopleTest(DatabaseTest):
+    """
+    Identities inserted by several processes.
+    """
+
+    def test_people_stored_by_another_process(self):
+        other = get_database()
+        people_id = other.get_people_id(People('alice'))
+        other.store.close()
+
+        # Pending changes survive the failed insert
+        self.db.store.get(DBTracker, self.trk.id).url = u'http://example.org'
+        self.assertEqual(self.db.get_people_id(People('alice')), people_id)
+        self.assertEqual(self.db.people_cache.get(u'alice'), people_id)
+        self.db.store.rollback()
+        self.assertEqual(self.db.store.get(DBTracker, self.trk.id).url,
+                         u'http://example.org')
+
+
+class RelationshipsTest(DatabaseTest):
+    """
+    Relationships of the trackers crawled by a process.
+    """
+
+    def test_relationships_of_the_tracker(self):
+        other = self.db.insert_tracker(
+            Tracker('http://bugs.example.com', 'bg', '4.2'))
+        for number in range(3):
+            issue = self.issue(number)
+            issue.add_temp_relationship(
+                TempRelationship(number, u'blocks', number + 1))
+            self.db.insert_issue(issue, other.id)
+        self.db.flush_issues()
+        # Issue 3 is missing
+        self.assertEqual(self.db.store_final_relationships([other.id]), 1)
+
+        # The missing issue of the other tracker is not counted again
+        for number in range(3):
+            issue = self.issue(number)
+            if number < 2:
+                issue.add_temp_relationship(
+                    TempRelationship(number, u'blocks', number + 1))
+            self.db.insert_issue(issue, self.trk.id)
+        self.assertEqual(self.db.store_final_relationships([self.trk.id]), 0)
+        self.assertEqual(self.db.store.find(DBIssueRelationship).count(), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
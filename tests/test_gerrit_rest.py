@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Bitergia
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import calendar
+import copy
+import json
+import os
+import re
+import StringIO
+import sys
+import time
+import unittest
+import urlparse
+
+sys.path.insert(0, "..")
+from bicho.config import Config
+from bicho import httpclient
+
+Config.delay = 0
+Config.debug = False
+from bicho.backends.gerrit import Gerrit
+
+DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    'data', 'gerrit', 'changes.json')
+
+
+def load_changes():
+    with open(DUMP) as f:
+        content = f.read()
+    return json.loads(content[content.find("\n") + 1:])
+
+
+def epoch(value):
+    return calendar.timegm(time.strptime(value, '%Y-%m-%d %H:%M:%S'))
+
+
+def rest_time(seconds):
+    return time.strftime('%Y-%m-%d %H:%M:%S.000000000', time.gmtime(seconds))
+
+
+class FakeServer(object):
+    """
+    Changes of the REST API, answering the queries by project and
+    update time like Gerrit, with pages of at most X{page} changes.
+    X{hook} is called before answering each query.
+    """
+
+    QUERY = re.compile(r'project:(\S+)'
+                       r'(?: after:"([^"]+) \+0000" before:"([^"]+) \+0000")?$')
+
+    def __init__(self, changes, page=500, hook=None):
+        self.changes = changes
+        self.page = page
+        self.hook = hook
+        self.queries = 0
+        self.pages = []
+
+    def urlopen(self, request, data=None, stream=False, cache=None):
+        self.queries += 1
+        if self.hook:
+            self.hook(self)
+
+        params = urlparse.parse_qs(urlparse.urlparse(request).query)
+        project, after, before = self.QUERY.match(params['q'][0]).groups()
+        limit = min(int(params['n'][0]), self.page)
+        start = int(params['S'][0])
+
+        changes = sorted([c for c in self.changes if c['project'] == project],
+                         key=lambda c: (c['updated'], c['_number']),
+                         reverse=True)
+        if after:
+            changes = [c for c in changes
+                       if epoch(after) <= epoch(c['updated'][:19])
+                       <= epoch(before)]
+        page = [dict(c) for c in changes[start:start + limit]]
+        if page and start + limit < len(changes):
+            page[-1]['_more_changes'] = True
+        if after:
+            self.pages.append(page)
+        return StringIO.StringIO(")]}'\n" + json.dumps(page))
+
+
+class FakeDatabase(object):
+    """
+    Database keeping the checkpoint and the number of the reviews
+    stored.
+    """
+
+    def __init__(self):
+        self.stored = []
+        self.checkpoint = None
+
+    def get_checkpoint(self, trk_id):
+        return self.checkpoint
+
+    def save_checkpoint(self, trk_id, cursor):
+        self.checkpoint = copy.deepcopy(cursor)
+
+    def get_last_modification_date(self, tracker_id=None):
+        return None
+
+
+class Tracker(object):
+    id = 1
+
+
+class GerritRestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = dict(vars(Config))
+        Config.url = 'review.openstack.org'
+        Config.gerrit_project = 'openstack/nova'
+        Config.gerrit_rest = ''
+        Config.workers = 2
+        self.urlopen = httpclient.urlopen
+        self.gerrit = Gerrit()
+        self.gerrit.store_review = self.store_review
+        self.db = FakeDatabase()
+
+    def tearDown(self):
+        httpclient.urlopen = self.urlopen
+        for name in vars(Config).keys():
+            if name not in self.config:
+                delattr(Config, name)
+        Config.__dict__.update(self.config)
+
+    def store_review(self, bugsdb, review, trk_id):
+        bugsdb.stored.append(review['number'])
+        return True
+
+    def serve(self, changes, page=500, hook=None):
+        server = FakeServer(changes, page, hook)
+        httpclient.urlopen = server.urlopen
+        return server
+
+    def generate(self, updates):
+        """
+        Changes updated at the given seconds, copied from the dump.
+        """
+        template = load_changes()[0]
+        changes = []
+        for number, updated in enumerate(updates):
+            change = copy.deepcopy(template)
+            change['_number'] = number + 1
+            change['updated'] = rest_time(updated)
+            changes.append(change)
+        return changes
+
+    def run_rest(self):
+        return self.gerrit._run_rest(self.db, Tracker())
+
+    def test_convert_rest_change(self):
+        merged, abandoned, new = [self.gerrit._convert_rest_change(c)
+                                  for c in load_changes()]
+
+        self.assertEqual(merged['number'], '635')
+        self.assertEqual(merged['id'],
+                         'I812e95fb0744ad84abd7ea2ad7d11123667abbc8')
+        self.assertEqual(merged['project'], 'openstack/nova')
+        self.assertEqual(merged['branch'], 'master')
+        self.assertEqual(merged['topic'], 'bug/857209')
+        self.assertEqual(merged['url'], 'https://review.openstack.org/635')
+        self.assertEqual(merged['status'], 'MERGED')
+        self.assertFalse(merged['open'])
+        self.assertEqual(merged['owner'],
+                         {'username': 'mordred', 'name': 'Monty Taylor',
+                          'email': 'mordred@inaugust.com'})
+        self.assertEqual(merged['createdOn'], epoch('2011-09-23 21:38:17'))
+        self.assertEqual(merged['lastUpdated'], epoch('2011-09-23 21:55:51'))
+
+        # Patch sets are sorted and the votes are in the last one
+        first, last = merged['patchSets']
+        self.assertEqual((first['number'], last['number']), ('1', '2'))
+        self.assertEqual(last['revision'],
+                         'c586e4ed23846420177802c164f594e021cceea8')
+        self.assertEqual(last['ref'], 'refs/changes/35/635/2')
+        self.assertEqual(last['uploader']['username'], 'mordred')
+        self.assertEqual(last['createdOn'], epoch('2011-09-23 21:40:02'))
+        self.assertFalse('approvals' in first)
+        approvals = sorted((a['type'], a['value'], a['by']['username'],
+                            a['grantedOn']) for a in last['approvals'])
+        self.assertEqual(approvals,
+                         [('Code-Review', '2', 'bcwaldon',
+                           epoch('2011-09-23 21:43:12')),
+                          ('Verified', '1', 'jenkins',
+                           epoch('2011-09-23 21:55:48'))])
+
+        comments = merged['comments']
+        self.assertEqual(len(comments), 5)
+        self.assertEqual(comments[2]['message'],
+                         'Patch Set 2: Code-Review+2\n\nLooks good.')
+        self.assertEqual(comments[2]['reviewer']['username'], 'bcwaldon')
+        self.assertEqual(comments[2]['timestamp'],
+                         epoch('2011-09-23 21:43:12'))
+        # Messages of Gerrit itself have no author
+        self.assertEqual(comments[4]['reviewer'], {})
+
+        self.assertFalse('topic' in abandoned)
+        self.assertFalse(abandoned['open'])
+        self.assertFalse('approvals' in abandoned['patchSets'][0])
+
+        self.assertTrue(new['open'])
+        self.assertEqual(new['patchSets'][0]['approvals'][0]['value'], '-1')
+
+    def test_converted_change_is_analyzed(self):
+        issue = self.gerrit.analyze_review(
+            self.gerrit._convert_rest_change(load_changes()[0]))
+        self.assertEqual(issue.issue, '635')
+        self.assertEqual(issue.status, 'MERGED')
+        self.assertEqual(len(issue.comments), 5)
+
+    def test_oldest_update(self):
+        for number in (1, 2, 3, 7, 8, 37):
+            updates = [1300000000 + 60 * i for i in range(number)]
+            server = self.serve(self.generate(updates))
+            self.assertEqual(self.gerrit._get_oldest_update(), updates[0])
+            # A binary search, not a walk over every change
+            self.assertTrue(server.queries <= 2 * len(bin(number)) + 2)
+
+    def test_oldest_update_of_empty_project(self):
+        self.serve([])
+        self.assertEqual(self.gerrit._get_oldest_update(), None)
+        self.assertEqual(self.run_rest(), 0)
+
+    def test_windows_stored_once(self):
+        updates = [1300000000 + 37 * i for i in range(200)]
+        self.serve(self.generate(updates), page=7)
+        self.assertEqual(self.run_rest(), 200)
+        self.assertEqual(sorted(self.db.stored, key=int),
+                         [str(i + 1) for i in range(200)])
+        self.assertEqual(self.db.checkpoint, {'windows': []})
+
+    def test_pages_in_the_same_second(self):
+        # More changes updated in the same second than fit in a page
+        updates = [1300000000] * 12 + [1300000100] * 10 + \
+            [1300000000 + i for i in range(1, 30)]
+        self.serve(self.generate(updates), page=4)
+        self.assertEqual(self.run_rest(), len(updates))
+        self.assertEqual(sorted(self.db.stored, key=int),
+                         [str(i + 1) for i in range(len(updates))])
+
+    def test_change_updated_while_retrieved(self):
+        Config.workers = 1
+        self.gerrit = Gerrit()
+        self.gerrit.store_review = self.store_review
+        changes = self.generate([1300000000 + 10 * i for i in range(100)])
+        moved = []
+
+        def update(server):
+            # After the first page of a window, its most recently
+            # updated change is updated again
+            if len(server.pages) == 1 and not moved:
+                number = server.pages[0][0]['_number']
+                changes[number - 1]['updated'] = rest_time(int(time.time()))
+                moved.append(number)
+
+        self.serve(changes, page=5, hook=update)
+        self.assertEqual(self.run_rest(), 100)
+        self.assertTrue(moved)
+        self.assertEqual(sorted(self.db.stored, key=int),
+                         [str(i + 1) for i in range(100)])
+
+if __name__ == '__main__':
+    unittest.main()
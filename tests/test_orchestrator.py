@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2011 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import shutil, signal, sys, tempfile, unittest
+sys.path.insert(0, "..")
+from bicho.config import Config, InvalidConfig
+from bicho import httpclient, main, orchestrator, ratelimit
+
+
+class WorkerConfigTest(unittest.TestCase):
+    """
+    Jobs run by the same worker must not share the rate limiter,
+    credentials and cache built from the options of a previous job.
+    """
+
+    def setUp(self):
+        self.config = dict(vars(Config))
+        for name, value in vars(Config.create_parser().parse_args([])).items():
+            setattr(Config, name, value)
+        Config.debug = False
+        Config.db_driver_out = 'sqlite'
+        Config.db_database_out = ':memory:'
+
+        self.path = tempfile.mkdtemp()
+        self.seen = []
+        self.run_backend = main.run_backend
+        main.run_backend = self.record
+        ratelimit.reset()
+        httpclient.reset()
+        orchestrator._init_worker()
+
+    def tearDown(self):
+        main.run_backend = self.run_backend
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        ratelimit.reset()
+        httpclient.reset()
+        for name in vars(Config).keys():
+            if name not in self.config:
+                delattr(Config, name)
+        Config.__dict__.update(self.config)
+        shutil.rmtree(self.path)
+
+    def record(self):
+        httpclient.add_credentials(Config.url, 'user', 'password')
+        cache = httpclient.get_cache()
+        self.seen.append({'delay': Config.delay,
+                          'rate': ratelimit.get_rate_limiter().rate,
+                          'cache': cache and cache.path,
+                          'hosts': sorted(httpclient._credentials)})
+
+    def test_options_of_each_job(self):
+        jobs = orchestrator.parse_jobs([
+            'bg http://a.example.org/buglist.cgi -d 15 -p %s' % self.path,
+            'bg http://b.example.org/buglist.cgi -d 1'])
+        results = [orchestrator._run_job(job) for job in jobs]
+        self.assertEqual([r.status for r in results], ['ok', 'ok'])
+
+        first, second = self.seen
+        self.assertEqual(first['delay'], 15)
+        self.assertAlmostEqual(first['rate'], 1.0 / 15)
+        self.assertEqual(first['cache'], self.path)
+        self.assertEqual(first['hosts'], ['a.example.org'])
+
+        self.assertEqual(second['delay'], 1)
+        self.assertAlmostEqual(second['rate'], 1.0)
+        self.assertEqual(second['cache'], None)
+        self.assertEqual(second['hosts'], ['b.example.org'])
+
+    def test_error_setting_the_options(self):
+        def fail():
+            raise ValueError('broken limiter')
+        ratelimit.reset, reset = fail, ratelimit.reset
+        try:
+            jobs = orchestrator.parse_jobs(['bg http://a.example.org/ -d 1'])
+            results = orchestrator.run_jobs(jobs, 1, 1)
+        finally:
+            ratelimit.reset = reset
+        self.assertEqual([r.status for r in results],
+                         ['error: broken limiter'])
+        self.assertEqual(self.seen, [])
+
+
+class ParseJobsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = dict(vars(Config))
+        for name, value in vars(Config.create_parser().parse_args([])).items():
+            setattr(Config, name, value)
+
+    def tearDown(self):
+        for name in vars(Config).keys():
+            if name not in self.config:
+                delattr(Config, name)
+        Config.__dict__.update(self.config)
+
+    def test_logtable_driver(self):
+        jobs = orchestrator.parse_jobs(['bg http://a.example.org/ -l'])
+        self.assertEqual(jobs[0].options['logtable'], True)
+
+        self.assertRaises(InvalidConfig, orchestrator.parse_jobs,
+                          ['bg http://a.example.org/ -l '
+                           '--db-driver-out sqlite --db-database-out a.db'])
+        Config.db_driver_out = 'sqlite'
+        self.assertRaises(InvalidConfig, orchestrator.parse_jobs,
+                          ['bg http://a.example.org/ -l'])
+        self.assertRaises(InvalidConfig, Config.check_logtable,
+                          True, 'sqlite')
+        self.assertRaises(InvalidConfig, Config.check_logtable,
+                          True, 'postgresql')
+        Config.check_logtable(True, 'mysql')
+
+
+if __name__ == '__main__':
+    unittest.main()